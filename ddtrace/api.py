@@ -1,5 +1,7 @@
 # stdlib
 import logging
+import os
+import socket
 import time
 import ddtrace
 from json import loads
@@ -13,6 +15,10 @@ log = logging.getLogger(__name__)
 
 TRACE_COUNT_HEADER = 'X-Datadog-Trace-Count'
 
+# payloads bigger than this are refused by the trace agent
+MAX_PAYLOAD_SIZE = 8 << 20
+UDS_SCHEME = 'unix://'
+
 _VERSIONS = {'v0.4': {'traces': '/v0.4/traces',
                       'services': '/v0.4/services',
                       'compatibility_mode': False,
@@ -48,16 +54,121 @@ def _parse_response_json(response):
         except (ValueError, TypeError) as err:
             log.debug("unable to load JSON '%s': %s" % (body, err))
 
+
+def _first_error(previous, response):
+    """
+    When a flush is made of several payloads, keep the first error response
+    as result of the whole flush.
+    """
+    if previous is not None and previous.status >= 400:
+        return previous
+    return response
+
+
+def _parse_uds_path(uds_path):
+    """
+    Return the socket file path of a Unix Domain Socket, given either as
+    a path or as an URL like ``unix:///var/run/datadog/apm.socket``.
+    """
+    if uds_path and uds_path.startswith(UDS_SCHEME):
+        return uds_path[len(UDS_SCHEME):]
+    return uds_path
+
+
+class UDSHTTPConnection(httplib.HTTPConnection):
+    """
+    An HTTP connection established over a Unix Domain Socket. Requests are
+    the same sent over TCP, using ``localhost`` as ``Host`` header.
+    """
+    def __init__(self, path, *args, **kwargs):
+        httplib.HTTPConnection.__init__(self, 'localhost', *args, **kwargs)
+        self.path = path
+
+    def connect(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        if self.timeout is not socket._GLOBAL_DEFAULT_TIMEOUT:
+            sock.settimeout(self.timeout)
+        sock.connect(self.path)
+        self.sock = sock
+
+
+class Payload(object):
+    """
+    Encoded traces ready to be sent to the trace agent in a single request.
+    """
+    __slots__ = ['data', 'count', 'content_type', 'spans']
+
+    def __init__(self, data, count, content_type, spans=None):
+        self.data = data
+        self.count = count
+        self.content_type = content_type
+        # number of spans, when known
+        self.spans = spans
+
+
+class Response(object):
+    """
+    Response from the trace agent. The body is read as soon as the response
+    is received so that the underlying connection can be reused; ``read()``
+    returns it like the ``httplib`` response would do.
+    """
+    __slots__ = ['status', 'reason', 'msg', 'body', 'duration', 'reused']
+
+    def __init__(self, status=None, reason=None, msg=None, body=None, duration=None, reused=False):
+        self.status = status
+        self.reason = reason
+        self.msg = msg
+        self.body = body
+        # time spent in the HTTP request and if it reused an open connection
+        self.duration = duration
+        self.reused = reused
+
+    @classmethod
+    def from_http_response(cls, resp, **kwargs):
+        return cls(
+            status=resp.status,
+            reason=resp.reason,
+            msg=resp.msg,
+            body=resp.read(),
+            **kwargs
+        )
+
+    def read(self):
+        return self.body
+
+    def __repr__(self):
+        return '{0}(status={1!r}, body={2!r}, reason={3!r}, msg={4!r})'.format(
+            self.__class__.__name__,
+            self.status,
+            self.body,
+            self.reason,
+            self.msg,
+        )
+
+
 class API(object):
     """
-    Send data to the trace agent using the HTTP protocol and JSON format
+    Send data to the trace agent using the HTTP protocol and JSON format.
+    The HTTP connection is kept open between calls and it's re-created
+    when an error occurs or when the process is forked.
+
+    When ``uds_path`` is set, the agent is reached through that Unix Domain
+    Socket instead of ``hostname`` and ``port``.
+
+    Traces that don't fit in ``max_payload_size`` bytes are split in several
+    requests, keeping each trace whole.
     """
-    def __init__(self, hostname, port, headers=None, encoder=None, priority_sampling=False):
+    def __init__(self, hostname, port, headers=None, encoder=None, priority_sampling=False, uds_path=None,
+                 max_payload_size=MAX_PAYLOAD_SIZE):
         self.hostname = hostname
         self.port = port
+        self.uds_path = _parse_uds_path(uds_path)
+        self.max_payload_size = max_payload_size
 
         self._headers = headers or {}
         self._version = None
+        self._conn = None
+        self._conn_pid = None
 
         if priority_sampling:
             self._set_version('v0.4', encoder=encoder)
@@ -71,6 +182,18 @@ class API(object):
             'Datadog-Meta-Tracer-Version': ddtrace.__version__,
         })
 
+    @property
+    def content_type(self):
+        """The content type of the payloads encoded by the current encoder."""
+        return self._encoder.content_type
+
+    @property
+    def url(self):
+        """The address of the trace agent, used in logs."""
+        if self.uds_path:
+            return UDS_SCHEME + self.uds_path
+        return 'http://{}:{}'.format(self.hostname, self.port)
+
     def _set_version(self, version, encoder=None):
         if version not in _VERSIONS:
             version = 'v0.2'
@@ -101,16 +224,96 @@ class API(object):
         if not traces:
             return
         start = time.time()
+        payloads = self.encode_traces(traces)
+        response = None
+        sent = 0
+        for payload in payloads:
+            response = _first_error(response, self.send_payload(payload))
+            if payload.content_type != self._encoder.content_type:
+                # the API has been downgraded to another encoding, so the traces
+                # not reported yet must be encoded again
+                return self.send_traces(traces[sent:])
+            sent += payload.count
+
+        log.debug("reported %d traces in %.5fs", len(traces), time.time() - start)
+        return response
+
+    def encode_trace(self, trace):
+        """
+        Encode a single trace with the current encoder, so that it can be
+        sent later with ``send_encoded_traces()``.
+        """
+        return self._encoder.encode_trace(trace)
+
+    def encode_traces(self, traces):
+        """
+        Encode the given traces in one or more payloads, each one smaller than
+        ``max_payload_size`` unless it holds a single trace bigger than that.
+        """
         data = self._encoder.encode_traces(traces)
-        response = self._put(self._traces, data, len(traces))
+        if len(data) <= self.max_payload_size or len(traces) == 1:
+            return [Payload(data, len(traces), self._encoder.content_type)]
+        # too big for a single request: encode the traces one by one, so that
+        # they can be split without breaking any trace
+        return self.join_encoded_traces([self._encoder.encode_trace(trace) for trace in traces])
+
+    def join_encoded_traces(self, encoded_traces):
+        """
+        Join traces encoded with ``encode_trace()`` in one or more payloads,
+        each one smaller than ``max_payload_size`` unless it holds a single
+        trace bigger than that.
+        """
+        chunks = [[]]
+        size = 0
+        for encoded in encoded_traces:
+            # keep a margin for the payload framing (array header, brackets and commas)
+            if chunks[-1] and size + len(encoded) + len(chunks[-1]) + 8 > self.max_payload_size:
+                chunks.append([])
+                size = 0
+            chunks[-1].append(encoded)
+            size += len(encoded)
+
+        content_type = self._encoder.content_type
+        payloads = [Payload(self._encoder.join_encoded(chunk), len(chunk), content_type) for chunk in chunks]
+        if len(payloads) > 1:
+            log.debug("split %d traces in %d payloads of %s bytes", len(encoded_traces), len(payloads),
+                      ', '.join(str(len(payload.data)) for payload in payloads))
+        return payloads
+
+    def send_encoded_traces(self, encoded_traces):
+        """
+        Send traces encoded with ``encode_trace()``. The payloads are built by
+        joining the encoded traces, without encoding them again.
+        """
+        if not encoded_traces:
+            return
+        start = time.time()
+        response = None
+        for payload in self.join_encoded_traces(encoded_traces):
+            if payload.content_type != self._encoder.content_type:
+                # traces can't be encoded again from the payload
+                log.error("dropping %d traces encoded as %s, not supported by the trace agent",
+                          payload.count, payload.content_type)
+                continue
+            response = _first_error(response, self.send_payload(payload))
+
+        log.debug("reported %d traces in %.5fs", len(encoded_traces), time.time() - start)
+        return response
+
+    def send_payload(self, payload):
+        """
+        Send a traces payload, downgrading the API if the endpoint is not available.
+        After a downgrade, the payload is sent again only if it's still encoded
+        in the format expected by the new endpoint.
+        """
+        response = self._put(self._traces, payload.data, payload.count)
 
         # the API endpoint is not available so we should downgrade the connection and re-try the call
         if response.status in [404, 415] and self._fallback:
             log.debug('calling endpoint "%s" but received %s; downgrading API', self._traces, response.status)
             self._downgrade()
-            return self.send_traces(traces)
-
-        log.debug("reported %d traces in %.5fs", len(traces), time.time() - start)
+            if self._encoder.content_type == payload.content_type:
+                return self.send_payload(payload)
         return response
 
     def send_services(self, services):
@@ -128,18 +331,61 @@ class API(object):
             self._downgrade()
             return self.send_services(services)
 
-        log.debug("reported %d services", len(services))
+        log.debug("reported %d services", len(s))
         return response
 
     def _put(self, endpoint, data, count=0):
-        conn = httplib.HTTPConnection(self.hostname, self.port)
+        headers = self._headers
+        if count:
+            headers = dict(self._headers)
+            headers[TRACE_COUNT_HEADER] = str(count)
+
+        reused = self._conn is not None and self._conn_pid == os.getpid()
         try:
-            headers = self._headers
-            if count:
-                headers = dict(self._headers)
-                headers[TRACE_COUNT_HEADER] = str(count)
+            return self._request(endpoint, data, headers, reused)
+        except Exception:
+            # an idle keep-alive connection may have been closed by the agent;
+            # retry once on a fresh connection before giving up
+            if not reused:
+                raise
+            log.debug("request on reused connection failed, reconnecting", exc_info=True)
+            return self._request(endpoint, data, headers, False)
 
+    def _request(self, endpoint, data, headers, reused):
+        conn = self._get_connection()
+        start = time.time()
+        try:
             conn.request("PUT", endpoint, data, headers)
-            return get_connection_response(conn)
-        finally:
+            resp = get_connection_response(conn)
+            response = Response.from_http_response(resp, duration=time.time() - start, reused=reused)
+        except Exception:
+            self._close_connection()
+            raise
+
+        if resp.will_close:
+            self._close_connection()
+        log.debug("PUT %s: %s in %.5fs (reused connection: %s)", endpoint, response.status, response.duration, reused)
+        return response
+
+    def _get_connection(self):
+        """
+        Return the current HTTP connection, creating a new one if missing or
+        if it has been opened by the parent of a forked process.
+        """
+        pid = os.getpid()
+        if self._conn is not None and self._conn_pid != pid:
+            self._close_connection()
+        if self._conn is None:
+            self._conn = self._new_connection()
+            self._conn_pid = pid
+        return self._conn
+
+    def _new_connection(self):
+        if self.uds_path:
+            return UDSHTTPConnection(self.uds_path)
+        return httplib.HTTPConnection(self.hostname, self.port)
+
+    def _close_connection(self):
+        conn, self._conn = self._conn, None
+        if conn is not None:
             conn.close()
@@ -0,0 +1,31 @@
+#!/usr/bin/env python
+import argparse
+import logging
+import os
+
+from ddtrace.forwarder import TraceForwarder
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Receive the traces of the processes of this host and send them to the trace agent.",
+    )
+    parser.add_argument('path', help="path of the Unix socket where traces are received")
+    parser.add_argument('--hostname', default=os.environ.get('DATADOG_TRACE_AGENT_HOSTNAME', 'localhost'),
+                        help="hostname of the trace agent (default: localhost)")
+    parser.add_argument('--port', type=int, default=int(os.environ.get('DATADOG_TRACE_AGENT_PORT', 8126)),
+                        help="port of the trace agent (default: 8126)")
+    parser.add_argument('--uds-path', help="Unix Domain Socket of the trace agent, instead of hostname and port")
+    parser.add_argument('--debug', action='store_true', help="log debug messages")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.DEBUG if args.debug else logging.INFO)
+    forwarder = TraceForwarder(args.path, args.hostname, args.port, uds_path=args.uds_path)
+    try:
+        forwarder.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -1,5 +1,6 @@
 import sys
 import platform
+import time
 
 PYTHON_VERSION_INFO = sys.version_info
 PY2 = sys.version_info[0] == 2
@@ -14,6 +15,7 @@ if PY2:
     from urllib import urlencode
     import httplib
     stringify = unicode
+    from thread import get_ident
     from Queue import Queue
     try:
         from cStringIO import StringIO
@@ -21,6 +23,7 @@ if PY2:
         from StringIO import StringIO
 else:
     from queue import Queue
+    from threading import get_ident
     from urllib.parse import urlencode
     import http.client as httplib
     from io import StringIO
@@ -88,6 +91,26 @@ def get_connection_response(conn):
         return conn.getresponse()
 
 
+try:
+    time_ns = time.time_ns
+except AttributeError:
+    # Python < 3.7
+    def time_ns():
+        """Return the time in nanoseconds since the epoch as an integer."""
+        return int(time.time() * 1e9)
+
+try:
+    monotonic_ns = time.monotonic_ns
+except AttributeError:
+    if hasattr(time, 'monotonic'):
+        def monotonic_ns():
+            """Return the value of a monotonic clock in nanoseconds as an integer."""
+            return int(time.monotonic() * 1e9)
+    else:
+        # Python 2 has no monotonic clock
+        monotonic_ns = time_ns
+
+
 if PY2:
     string_type = basestring
     msgpack_type = basestring
@@ -118,6 +141,7 @@ else:
 
 
 __all__ = [
+    'get_ident',
     'httplib',
     'iteritems',
     'PY2',
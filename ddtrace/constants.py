@@ -1,3 +1,5 @@
 FILTERS_KEY = 'FILTERS'
 SAMPLE_RATE_METRIC_KEY = "_sample_rate"
 SAMPLING_PRIORITY_KEY = '_sampling_priority_v1'
+DROPPED_SPANS_KEY = '_dd.dropped_spans'
+DROPPED_SPANS_NO_SERVICE = 'no_service'
@@ -1,7 +1,9 @@
 import logging
 import threading
+import time
 
-from .constants import SAMPLING_PRIORITY_KEY
+from .compat import get_ident, iteritems
+from .constants import DROPPED_SPANS_KEY, DROPPED_SPANS_NO_SERVICE, SAMPLING_PRIORITY_KEY
 
 
 log = logging.getLogger(__name__)
@@ -20,7 +22,11 @@ class Context(object):
     generates the job itself. On the other hand, if it's part of the same
     ``Context``, it will be related to the original trace.
 
-    This data structure is thread-safe.
+    This data structure is thread-safe. The contexts of the ``ThreadLocalContext``
+    are owned by their thread and don't take their lock until they are shared.
+    Only the owner thread shares its context: before handing it to another
+    thread with ``_share()``, or on its next change once another thread asked
+    for it by changing the context or by activating it.
     """
     def __init__(self, trace_id=None, span_id=None, sampled=True, sampling_priority=None):
         """
@@ -31,8 +37,19 @@ class Context(object):
         """
         self._trace = []
         self._finished_spans = 0
+        # spans of the trace already sent by a partial flush
+        self._flushed_spans = 0
+        # count and duration of the spans dropped past the maximum number of
+        # spans per trace, by name and service
+        self._dropped_spans = None
         self._current_span = None
         self._lock = threading.Lock()
+        # the identifier of the thread owning the context, None when shared
+        self._owner = None
+        # set by other threads using an owned context, and by its owner while
+        # it's changed without the lock
+        self._share_requested = False
+        self._busy = False
 
         self._parent_trace_id = trace_id
         self._parent_span_id = span_id
@@ -42,30 +59,42 @@ class Context(object):
     @property
     def trace_id(self):
         """Return current context trace_id."""
+        if self._is_owned():
+            return self._parent_trace_id
         with self._lock:
             return self._parent_trace_id
 
     @property
     def span_id(self):
         """Return current context span_id."""
+        if self._is_owned():
+            return self._parent_span_id
         with self._lock:
             return self._parent_span_id
 
     @property
     def sampled(self):
         """Return current context sampled flag."""
+        if self._is_owned():
+            return self._sampled
         with self._lock:
             return self._sampled
 
     @property
     def sampling_priority(self):
         """Return current context sampling priority."""
+        if self._is_owned():
+            return self._sampling_priority
         with self._lock:
             return self._sampling_priority
 
     @sampling_priority.setter
     def sampling_priority(self, value):
         """Set sampling priority."""
+        if self._enter_owned():
+            self._sampling_priority = value
+            self._busy = False
+            return
         with self._lock:
             self._sampling_priority = value
 
@@ -73,6 +102,7 @@ class Context(object):
         """
         Partially clones the current context.
         It copies everything EXCEPT the registered and finished spans.
+        The clone isn't owned by any thread.
         """
         with self._lock:
             new_ctx = Context(
@@ -84,6 +114,58 @@ class Context(object):
             new_ctx._current_span = self._current_span
             return new_ctx
 
+    def _own(self):
+        """Make the context owned by the current thread: it must not be used by other threads yet."""
+        self._owner = get_ident()
+
+    def _share(self):
+        """
+        Take the lock from now on, because the context is used by another
+        thread. It's called by the owner thread before handing the context
+        over; called by another thread, the owner is asked to share it.
+        """
+        owner = self._owner
+        if owner is None:
+            return
+        if owner != get_ident():
+            self._request_share()
+            return
+        with self._lock:
+            self._owner = None
+
+    def _request_share(self):
+        """
+        Ask the owner to share the context on its next change, and wait for
+        the change it may be doing without the lock.
+        """
+        self._share_requested = True
+        while self._busy:
+            time.sleep(0)
+
+    def _is_owned(self):
+        """Return if the current thread owns the context, and no other thread asked to share it."""
+        return self._owner == get_ident() and not self._share_requested
+
+    def _enter_owned(self):
+        """
+        Return if the context can be changed without the lock, in which case
+        ``_busy`` must be reset once done. The owner shares the context here
+        when another thread asked for it; other threads ask for it.
+        """
+        owner = self._owner
+        if owner is None:
+            return False
+        if owner != get_ident():
+            self._request_share()
+            return False
+        self._busy = True
+        if self._share_requested:
+            # another thread waits for the change, or uses the context
+            self._busy = False
+            self._share()
+            return False
+        return True
+
     def get_current_root_span(self):
         """
         Return the root span of the context or None if it does not exist.
@@ -97,6 +179,8 @@ class Context(object):
         span in asynchronous environments, because some spans can be closed
         earlier while child spans still need to finish their traced execution.
         """
+        if self._is_owned():
+            return self._current_span
         with self._lock:
             return self._current_span
 
@@ -118,41 +202,86 @@ class Context(object):
         """
         Add a span to the context trace list, keeping it as the last active span.
         """
+        if self._enter_owned():
+            try:
+                self._add_span(span)
+            finally:
+                self._busy = False
+            return
         with self._lock:
-            self._set_current_span(span)
-
-            self._trace.append(span)
-            span._context = self
+            self._add_span(span)
+
+    def _add_span(self, span):
+        self._set_current_span(span)
+
+        self._trace.append(span)
+        span._context = self
+
+    def _span_count(self):
+        """Return the number of spans recorded in the current trace, including the flushed ones."""
+        return len(self._trace) + self._flushed_spans
+
+    def _drop_span(self, span):
+        """Count the finished ``NoopSpan`` in the summary of the dropped spans."""
+        if self._enter_owned():
+            try:
+                self._add_dropped_span(span)
+            finally:
+                self._busy = False
+            return
+        with self._lock:
+            self._add_dropped_span(span)
+
+    def _add_dropped_span(self, span):
+        if not self._trace:
+            # the trace is already sent
+            return
+        if self._dropped_spans is None:
+            self._dropped_spans = {}
+        key = (span.name, span.service)
+        count, duration = self._dropped_spans.get(key, (0, 0))
+        self._dropped_spans[key] = (count + 1, duration + (span.duration_ns or 0))
 
     def close_span(self, span):
         """
         Mark a span as a finished, increasing the internal counter to prevent
         cycles inside _trace list.
         """
+        if self._enter_owned():
+            try:
+                self._close_span(span)
+            finally:
+                self._busy = False
+            return
         with self._lock:
-            self._finished_spans += 1
-            self._set_current_span(span._parent)
-
-            # notify if the trace is not closed properly; this check is executed only
-            # if the tracer debug_logging is enabled and when the root span is closed
-            # for an unfinished trace. This logging is meant to be used for debugging
-            # reasons, and it doesn't mean that the trace is wrongly generated.
-            # In asynchronous environments, it's legit to close the root span before
-            # some children. On the other hand, asynchronous web frameworks still expect
-            # to close the root span after all the children.
-            tracer = getattr(span, '_tracer', None)
-            if tracer and tracer.debug_logging and span._parent is None and not self._is_finished():
-                opened_spans = len(self._trace) - self._finished_spans
-                log.debug('Root span "%s" closed, but the trace has %d unfinished spans:', span.name, opened_spans)
-                spans = [x for x in self._trace if not x._finished]
-                for wrong_span in spans:
-                    log.debug('\n%s', wrong_span.pprint())
+            self._close_span(span)
+
+    def _close_span(self, span):
+        self._finished_spans += 1
+        self._set_current_span(span._parent)
+
+        # notify if the trace is not closed properly; this check is executed only
+        # if the tracer debug_logging is enabled and when the root span is closed
+        # for an unfinished trace. This logging is meant to be used for debugging
+        # reasons, and it doesn't mean that the trace is wrongly generated.
+        # In asynchronous environments, it's legit to close the root span before
+        # some children. On the other hand, asynchronous web frameworks still expect
+        # to close the root span after all the children.
+        tracer = getattr(span, '_tracer', None)
+        if tracer and tracer.debug_logging and span._parent is None and not self._is_finished():
+            opened_spans = len(self._trace) - self._finished_spans
+            log.debug('Root span "%s" closed, but the trace has %d unfinished spans:', span.name, opened_spans)
+            spans = [x for x in self._trace if not x._finished]
+            for wrong_span in spans:
+                log.debug('\n%s', wrong_span.pprint())
 
     def is_finished(self):
         """
         Returns if the trace for the current Context is finished or not. A Context
         is considered finished if all spans in this context are finished.
         """
+        if self._is_owned():
+            return self._is_finished()
         with self._lock:
             return self._is_finished()
 
@@ -160,6 +289,8 @@ class Context(object):
         """
         Returns if the ``Context`` contains sampled spans.
         """
+        if self._is_owned():
+            return self._sampled
         with self._lock:
             return self._sampled
 
@@ -172,26 +303,72 @@ class Context(object):
 
         This operation is thread-safe.
         """
+        if self._enter_owned():
+            try:
+                return self._get()
+            finally:
+                self._busy = False
         with self._lock:
-            if self._is_finished():
-                # get the trace
-                trace = self._trace
-                sampled = self._sampled
-                sampling_priority = self._sampling_priority
-                # attach the sampling priority to the context root span
-                if sampled and sampling_priority is not None and trace:
-                    trace[0].set_metric(SAMPLING_PRIORITY_KEY, sampling_priority)
-
-                # clean the current state
-                self._trace = []
-                self._finished_spans = 0
-                self._parent_trace_id = None
-                self._parent_span_id = None
-                self._sampling_priority = None
-                self._sampled = True
-                return trace, sampled
-            else:
-                return None, None
+            return self._get()
+
+    def _get(self):
+        if self._is_finished():
+            # get the trace
+            trace = self._trace
+            sampled = self._sampled
+            sampling_priority = self._sampling_priority
+            # attach the sampling priority to the context root span
+            if sampled and sampling_priority is not None and trace:
+                trace[0].set_metric(SAMPLING_PRIORITY_KEY, sampling_priority)
+            if self._dropped_spans:
+                _set_dropped_spans(trace[0], self._dropped_spans)
+
+            # clean the current state
+            self._trace = []
+            self._finished_spans = 0
+            self._flushed_spans = 0
+            self._dropped_spans = None
+            self._parent_trace_id = None
+            self._parent_span_id = None
+            self._sampling_priority = None
+            self._sampled = True
+            return trace, sampled
+        else:
+            return None, None
+
+    def get_partial(self, min_spans):
+        """
+        Returns a tuple containing the finished spans of the current context and
+        if the context is sampled or not, if at least ``min_spans`` spans are
+        finished while others are still open. The finished spans are removed from
+        the ``Context``; it returns (None, None) otherwise.
+
+        This operation is thread-safe.
+        """
+        if self._enter_owned():
+            try:
+                return self._get_partial(min_spans)
+            finally:
+                self._busy = False
+        with self._lock:
+            return self._get_partial(min_spans)
+
+    def _get_partial(self, min_spans):
+        if self._finished_spans < min_spans or self._is_finished():
+            return None, None
+
+        finished = []
+        opened = []
+        for span in self._trace:
+            (finished if span._finished else opened).append(span)
+        self._trace = opened
+        self._finished_spans = 0
+        self._flushed_spans += len(finished)
+
+        # the sampling priority is given with every part of the trace
+        if self._sampled and self._sampling_priority is not None:
+            finished[0].set_metric(SAMPLING_PRIORITY_KEY, self._sampling_priority)
+        return finished, self._sampled
 
     def _is_finished(self):
         """
@@ -201,6 +378,20 @@ class Context(object):
         return num_traces > 0 and num_traces == self._finished_spans
 
 
+def _set_dropped_spans(root, dropped_spans):
+    """
+    Set on the root span the number of dropped spans, and for each name and
+    service their number and total duration in seconds.
+    """
+    total = 0
+    for (name, service), (count, duration) in iteritems(dropped_spans):
+        prefix = '{}.{}.{}'.format(DROPPED_SPANS_KEY, service or DROPPED_SPANS_NO_SERVICE, name)
+        root.set_metric(prefix + '.count', count)
+        root.set_metric(prefix + '.duration', duration / 1e9)
+        total += count
+    root.set_metric(DROPPED_SPANS_KEY, total)
+
+
 class ThreadLocalContext(object):
     """
     ThreadLocalContext can be used as a tracer global reference to create
@@ -212,13 +403,19 @@ class ThreadLocalContext(object):
         self._locals = threading.local()
 
     def set(self, ctx):
+        if ctx is not None and ctx._owner is not None and ctx._owner != get_ident():
+            # the context of another thread: its owner shares it on its
+            # next change
+            ctx._request_share()
         setattr(self._locals, 'context', ctx)
 
     def get(self):
         ctx = getattr(self._locals, 'context', None)
         if not ctx:
-            # create a new Context if it's not available
+            # create a new Context if it's not available, that only this
+            # thread uses until it's shared
             ctx = Context()
+            ctx._own()
             self._locals.context = ctx
 
         return ctx
@@ -29,7 +29,7 @@ class AIOTracedCursor(wrapt.ObjectProxy):
                               resource=resource) as s:
             s.span_type = sql.TYPE
             s.set_tag(sql.QUERY, resource)
-            s.set_tags(pin.tags)
+            s._add_tag_layer(pin._get_tags_layer())
             s.set_tags(extra_tags)
 
             try:
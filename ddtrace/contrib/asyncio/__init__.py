@@ -38,6 +38,10 @@ between scheduled coroutines and ``Future`` invoked in separated threads:
 A ``patch(asyncio=True)`` is available if you want to automatically use above
 wrappers without changing your code. In that case, the patch method **must be
 called before** importing stdlib functions.
+
+With Python 3.5+, traces can be sent with non-blocking I/O from an event loop
+instead of a thread, using the ``AsyncioWriter`` of
+``ddtrace.contrib.asyncio.writer``.
 """
 from ...utils.importlib import require_modules
 
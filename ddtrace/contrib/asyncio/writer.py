@@ -0,0 +1,315 @@
+"""
+Writer that sends traces from an ``asyncio`` event loop instead of a thread::
+
+    from ddtrace import tracer
+    from ddtrace.contrib.asyncio import context_provider
+    from ddtrace.contrib.asyncio.writer import AsyncioWriter
+
+    tracer.configure(context_provider=context_provider)
+    tracer.writer = AsyncioWriter(loop=loop)
+
+Traces are batched like with the ``AgentWriter`` and sent with non-blocking
+I/O, using a connection kept open to the trace agent. They are encoded in an
+executor, in slices of at most ``encode_slice`` traces, so that encoding
+never blocks the loop.
+
+By default the writer runs its own loop in a daemon thread. With the
+``loop`` argument, traces are sent from the given loop: in that case
+``close()`` must be awaited before stopping the loop, to send what is left.
+"""
+import asyncio
+import atexit
+import logging
+import os
+import threading
+import time
+
+from ...api import Response, TRACE_COUNT_HEADER, _first_error, _parse_response_json
+from ...pool import release_traces
+from ...stats import WriterStats
+from ...writer import (
+    AgentWriter, ServiceQ, TraceQ, FLUSH_INTERVAL, MAX_TRACES, DEFAULT_TIMEOUT, _apply_filters,
+)
+
+
+log = logging.getLogger(__name__)
+
+# traces encoded by each job submitted to the executor
+ENCODE_SLICE = 100
+
+
+class AsyncioWriter(AgentWriter):
+    """
+    ``AgentWriter`` that flushes traces from an event loop. It takes the
+    arguments of the ``AgentWriter``, apart from the ones of the retries and
+    of the spill file, and:
+
+    :param loop: the event loop used to send traces; by default the writer
+        runs its own loop in a thread
+    :param executor: the executor where traces are encoded, the loop default
+        executor if not set
+    :param int encode_slice: the number of traces encoded by each job
+        submitted to the executor
+    """
+    def __init__(self, *args, loop=None, executor=None, encode_slice=ENCODE_SLICE,  # noqa: E999
+                 timeout=DEFAULT_TIMEOUT, **kwargs):
+        super(AsyncioWriter, self).__init__(*args, **kwargs)
+        self._loop = loop
+        self._own_loop = loop is None
+        self._executor = executor
+        self._encode_slice = encode_slice
+        self._timeout = timeout
+        self._wakeup = None
+        self._closed = False
+        self._stream = None
+
+    def write(self, spans=None, services=None):
+        super(AsyncioWriter, self).write(spans=spans, services=services)
+        if self._traces.size() >= self._flush_size or services:
+            try:
+                self._loop.call_soon_threadsafe(self._wake_up)
+            except RuntimeError:
+                # the loop is closed
+                pass
+
+    def _reset_worker(self):
+        pid = os.getpid()
+        if self._pid != pid:
+            self._traces = TraceQ(max_size=MAX_TRACES, max_bytes=self._max_bytes, policy=self._drop_policy)
+            self._services = ServiceQ()
+            self._stats = WriterStats()
+            self._stream = None
+            self._worker = None
+            if self._own_loop:
+                # the loop thread belongs to the parent
+                self._loop = None
+            self._pid = pid
+
+        if self._worker is None:
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+                thread = threading.Thread(target=self._loop.run_forever, name='ddtrace.AsyncioWriter')
+                thread.daemon = True
+                thread.start()
+                atexit.register(self._on_shutdown)
+            # the future of the flush loop, running until the writer is closed
+            self._worker = asyncio.run_coroutine_threadsafe(self._run(), self._loop)
+            self._worker.add_done_callback(self._on_worker_done)
+
+    def _on_worker_done(self, worker):
+        # a flush loop that failed is started again on the same loop by the
+        # next write; once closed, it's done for good
+        if self._worker is worker and not self._closed:
+            self._worker = None
+
+    def _after_fork(self):
+        super(AsyncioWriter, self)._after_fork()
+        # the connection and the loop thread belong to the parent
+        self._stream = None
+        self._wakeup = None
+
+    def _on_shutdown(self):
+        if self._loop.is_running() and not self._closed:
+            future = asyncio.run_coroutine_threadsafe(self.close(), self._loop)
+            try:
+                future.result(self._timeout)
+            except Exception:
+                log.debug("cannot send the last traces", exc_info=True)
+
+    async def close(self):  # noqa: E999
+        """Send the traces left and stop the writer."""
+        self._closed = True
+        self._wake_up()
+        if self._worker is not None:
+            await asyncio.wrap_future(self._worker)
+
+    def _wake_up(self):
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    async def _run(self):  # noqa: E999
+        self._wakeup = asyncio.Event()
+        while True:
+            # once closed, a last flush sends what is left
+            closed = self._closed
+            if not closed:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), self._flush_interval or FLUSH_INTERVAL)
+                except asyncio.TimeoutError:
+                    pass
+                self._wakeup.clear()
+            try:
+                await self.flush()
+            except Exception:
+                log.error("cannot send traces to %s", self.api.url, exc_info=True)
+            if closed:
+                self._close_stream()
+                return
+
+    async def flush(self):  # noqa: E999
+        """Send the traces and services in the queues."""
+        traces = self._traces.pop()
+        if traces:
+            traces = _apply_filters(self._filters, traces)
+        if traces:
+            response = await self._send_traces(traces)
+            if self._priority_sampler:
+                response_json = _parse_response_json(response)
+                if response_json and 'rate_by_service' in response_json:
+                    self._priority_sampler.set_sample_rate_by_service(response_json['rate_by_service'])
+            if response is not None and response.status >= 400:
+                log.error("failed to send traces to %s: HTTP error status %s", self.api.url, response.status)
+
+        services = self._services.pop()
+        if services:
+            await self._send_services(services)
+
+    async def _send_traces(self, traces):  # noqa: E999
+        loop = asyncio.get_event_loop()
+        start = time.time()
+        encoded = []
+        for i in range(0, len(traces), self._encode_slice):
+            encoded.extend((await loop.run_in_executor(
+                self._executor, self._encode_slice_of_traces, traces[i:i + self._encode_slice])))
+        payloads = await loop.run_in_executor(self._executor, self.api.join_encoded_traces, encoded)
+        self._stats.record('encode.duration', time.time() - start)
+        if len(payloads) > 1:
+            self._stats.increment('flushes.chunked')
+
+        offset = 0
+        for payload in payloads:
+            payload.spans = sum(len(trace) for trace in traces[offset:offset + payload.count])
+            offset += payload.count
+        # the spans aren't needed anymore
+        release_traces(traces)
+
+        response = None
+        for payload in payloads:
+            try:
+                response = _first_error(response, (await self._send_payload(payload)))
+            except Exception as err:
+                log.error("cannot send %d traces to %s: %s", payload.count, self.api.url, err)
+                self._stats.increment('http.errors')
+                self._stats.increment('traces.dropped', payload.count)
+        return response
+
+    def _encode_slice_of_traces(self, traces):
+        return [self.api.encode_trace(trace) for trace in traces]
+
+    async def _send_payload(self, payload):  # noqa: E999
+        if payload.content_type != self.api.content_type:
+            # the API has been downgraded and the traces can't be encoded again
+            self._stats.increment('traces.dropped', payload.count)
+            return None
+
+        response = await self._put(self.api._traces, payload.data, payload.count)
+        self._stats.increment('http.status.{}'.format(response.status))
+        self._stats.record('http.duration', response.duration)
+        if response.status in (404, 415) and self.api._fallback:
+            log.debug('calling endpoint "%s" but received %s; downgrading API', self.api._traces, response.status)
+            self.api._downgrade()
+            return (await self._send_payload(payload))
+
+        if 200 <= response.status < 300:
+            self._stats.increment('payloads.sent')
+            self._stats.increment('traces.sent', payload.count)
+            self._stats.increment('spans.sent', payload.spans or 0)
+            self._stats.record('payload.bytes', len(payload.data))
+        return response
+
+    async def _send_services(self, services):  # noqa: E999
+        merged = {}
+        for service in services:
+            merged.update(service)
+        try:
+            response = await self._put(self.api._services, self.api._encoder.encode_services(merged))
+        except Exception as err:
+            log.error("cannot send services to %s: %s", self.api.url, err)
+            # they are sent again with the next flush
+            self._services.requeue(services)
+            return
+        if response.status in (404, 415) and self.api._fallback:
+            self.api._downgrade()
+            await self._send_services(services)
+        elif not 200 <= response.status < 300:
+            self._services.requeue(services)
+
+    async def _put(self, endpoint, data, count=0):  # noqa: E999
+        """
+        Send a PUT request to the trace agent. A request on a connection
+        already used is tried again on a new one if it fails, since the agent
+        may have closed it in the meantime.
+        """
+        headers = dict(self.api._headers)
+        if count:
+            headers[TRACE_COUNT_HEADER] = str(count)
+        if not isinstance(data, bytes):
+            data = data.encode('utf-8')
+
+        reused = self._stream is not None
+        try:
+            return (await asyncio.wait_for(self._request(endpoint, data, headers, reused), self._timeout))
+        except Exception:
+            self._close_stream()
+            if not reused:
+                raise
+        return (await asyncio.wait_for(self._request(endpoint, data, headers, False), self._timeout))
+
+    async def _request(self, endpoint, data, headers, reused):  # noqa: E999
+        if self._stream is None:
+            if self.api.uds_path:
+                self._stream = await asyncio.open_unix_connection(self.api.uds_path)
+            else:
+                self._stream = await asyncio.open_connection(self.api.hostname, self.api.port)
+        reader, writer = self._stream
+
+        start = time.time()
+        lines = ['PUT {} HTTP/1.1'.format(endpoint), 'Host: {}'.format(self.api.hostname)]
+        lines.extend('{}: {}'.format(name, value) for name, value in headers.items())
+        lines.append('Content-Length: {}'.format(len(data)))
+        writer.write(('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1') + data)
+        await writer.drain()
+
+        status_line = await reader.readline()
+        if not status_line:
+            raise ConnectionError('connection closed by the trace agent')
+        # the reason phrase is optional
+        parts = status_line.decode('latin-1').rstrip('\r\n').split(None, 2)
+        status = parts[1]
+        reason = parts[2] if len(parts) > 2 else ''
+        response_headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            response_headers[name.strip().lower()] = value.strip()
+
+        if response_headers.get('transfer-encoding', '').lower() == 'chunked':
+            body = await _read_chunked(reader)
+        elif 'content-length' in response_headers:
+            body = await reader.readexactly(int(response_headers['content-length']))
+        else:
+            body = await reader.read()
+        if response_headers.get('connection', '').lower() == 'close' or 'content-length' not in response_headers:
+            self._close_stream()
+
+        response = Response(status=int(status), reason=reason, body=body, duration=time.time() - start, reused=reused)
+        log.debug("PUT %s: %s in %.5fs (reused connection: %s)", endpoint, response.status, response.duration, reused)
+        return response
+
+    def _close_stream(self):
+        stream, self._stream = self._stream, None
+        if stream is not None:
+            stream[1].close()
+
+
+async def _read_chunked(reader):  # noqa: E999
+    chunks = []
+    while True:
+        size = int((await reader.readline()).split(b';')[0], 16)
+        chunk = await reader.readexactly(size + 2)
+        if not size:
+            return b''.join(chunks)
+        chunks.append(chunk[:-2])
+
@@ -34,7 +34,7 @@ class TracedCursor(wrapt.ObjectProxy):
 
         with pin.tracer.trace(self._self_datadog_name, service=service, resource=resource) as s:
             s.span_type = sql.TYPE
-            s.set_tags(pin.tags)
+            s._add_tag_layer(pin._get_tags_layer())
             s.set_tags(extra_tags)
 
             try:
@@ -7,8 +7,10 @@ def _wrap_submit(func, instance, args, kwargs):
     thread. This wrapper ensures that a new `Context` is created and
     properly propagated using an intermediate function.
     """
-    # propagate the same Context in the new thread
+    # propagate the same Context in the new thread; from now on it's used
+    # by more than one thread
     current_ctx = ddtrace.tracer.context_provider.active()
+    current_ctx._share()
 
     # extract the target function that must be executed in
     # a new thread and the `target` arguments
@@ -28,6 +28,17 @@ patch ``gevent`` **before importing** the library::
 
             with tracer.trace("greenlet.child_call") as child:
                 ...
+
+The tracer writer can also be replaced with a ``GeventWriter`` (see
+``ddtrace.contrib.gevent.writer``), with the same settings: once
+``gevent.monkey`` is applied, traces are encoded and sent from a native thread
+rather than from a greenlet running on the hub. It's enabled before patching
+with ``config.gevent['replace_writer'] = True`` or the
+``DD_GEVENT_REPLACE_WRITER=true`` environment variable::
+
+    from ddtrace import config, patch
+    config.gevent['replace_writer'] = True
+    patch(gevent=True)
 """
 from ...utils.importlib import require_modules
 
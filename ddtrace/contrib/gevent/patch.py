@@ -2,11 +2,26 @@ import gevent
 import gevent.pool
 import ddtrace
 
+from ddtrace import config
+
 from .greenlet import TracedGreenlet, TracedIMap, TracedIMapUnordered
 from .provider import GeventContextProvider
 from ...provider import DefaultContextProvider
+from ...utils.formats import asbool, get_env
+from ...writer import AgentWriter
+
+try:
+    from .writer import GeventWriter
+except ImportError:
+    # gevent < 1.1 can't give the unpatched functions
+    GeventWriter = None
 
 
+# gevent default settings
+config._add('gevent', {
+    'replace_writer': asbool(get_env('gevent', 'replace_writer', False)),
+})
+
 __Greenlet = gevent.Greenlet
 __IMap = gevent.pool.IMap
 __IMapUnordered = gevent.pool.IMapUnordered
@@ -20,9 +35,15 @@ def patch():
 
     This action ensures that if a user extends the ``Greenlet``
     class, the ``TracedGreenlet`` is used as a parent class.
+
+    With the ``replace_writer`` setting, the tracer ``AgentWriter`` is
+    replaced by a ``GeventWriter``, so that traces are sent from a native
+    thread once ``gevent.monkey`` is applied.
     """
     _replace(TracedGreenlet, TracedIMap, TracedIMapUnordered)
     ddtrace.tracer.configure(context_provider=GeventContextProvider())
+    if config.gevent['replace_writer']:
+        _replace_writer(ddtrace.tracer, AgentWriter, GeventWriter)
 
 
 def unpatch():
@@ -33,6 +54,19 @@ def unpatch():
     """
     _replace(__Greenlet, __IMap, __IMapUnordered)
     ddtrace.tracer.configure(context_provider=DefaultContextProvider())
+    if config.gevent['replace_writer']:
+        _replace_writer(ddtrace.tracer, GeventWriter, AgentWriter)
+
+
+def _replace_writer(tracer, old_class, new_class):
+    """
+    Replace the tracer writer with a ``new_class`` one with the same settings,
+    if it's a ``old_class`` instance. Custom writers are kept.
+    """
+    writer = getattr(tracer, 'writer', None)
+    if old_class is None or new_class is None or type(writer) is not old_class:
+        return
+    tracer.writer = new_class(**writer._settings())
 
 
 def _replace(g_class, imap_class, imap_unordered_class):
@@ -0,0 +1,244 @@
+"""
+Writer for applications patched with ``gevent.monkey``.
+
+Once ``threading`` is monkey patched, the ``AgentWriter`` worker thread is a
+greenlet: encoding traces and sending them to the agent run on the hub and
+delay the greenlets serving requests. The ``GeventWriter`` detects the patch
+and keeps flushing on a native thread, with the unpatched locks and sockets::
+
+    from ddtrace import tracer
+    from ddtrace.contrib.gevent.writer import GeventWriter
+
+    tracer.writer = GeventWriter()
+
+``patch(gevent=True)`` installs it on the global tracer. Without monkey
+patching, it behaves like the ``AgentWriter``.
+
+Application greenlets only hold the native queue lock to append a trace; no
+I/O nor logging happens while it's held, so it never blocks the hub. The
+locks of the stats and of the logging handlers reached by the ``ddtrace``
+loggers, when the worker starts, are native locks too.
+"""
+import atexit
+import logging
+import socket
+import threading
+import time
+
+from gevent.monkey import get_original, is_module_patched
+
+from ...api import API, UDSHTTPConnection
+from ...compat import PY2, httplib
+from ...writer import AgentWriter, AsyncWorker
+
+
+_thread_module = 'thread' if PY2 else '_thread'
+_start_new_thread, _allocate_lock = get_original(_thread_module, ['start_new_thread', 'allocate_lock'])
+_sleep = get_original('time', 'sleep')
+_socket, _getaddrinfo = get_original('socket', ['socket', 'getaddrinfo'])
+
+
+def is_patched():
+    """Return if the threads are greenlets."""
+    return is_module_patched('threading')
+
+
+def _acquire(lock, timeout):
+    """Acquire the native lock, waiting at most ``timeout`` seconds if not None."""
+    if timeout is None:
+        return lock.acquire()
+    if not PY2:
+        return lock.acquire(True, max(timeout, 0))
+    # Python 2 locks don't have a timeout
+    delay = 0.0005
+    end = time.time() + timeout
+    while not lock.acquire(False):
+        remaining = end - time.time()
+        if remaining <= 0:
+            return False
+        delay = min(delay * 2, remaining, 0.05)
+        _sleep(delay)
+    return True
+
+
+class NativeCondition(object):
+    """
+    ``threading.Condition`` built on native locks, that can be shared by
+    greenlets and native threads.
+    """
+    def __init__(self):
+        self._lock = _allocate_lock()
+        self._waiters = []
+
+    def __enter__(self):
+        self._lock.acquire()
+        return self
+
+    def __exit__(self, *args):
+        self._lock.release()
+
+    def wait(self, timeout=None):
+        """Wait until notified or until ``timeout`` seconds passed. The lock must be held."""
+        waiter = _allocate_lock()
+        waiter.acquire()
+        self._waiters.append(waiter)
+        self._lock.release()
+        try:
+            return _acquire(waiter, timeout)
+        finally:
+            self._lock.acquire()
+            if waiter in self._waiters:
+                self._waiters.remove(waiter)
+
+    def notify(self, n=1):
+        """Wake up ``n`` waiting threads. The lock must be held."""
+        waiters, self._waiters = self._waiters[:n], self._waiters[n:]
+        for waiter in waiters:
+            waiter.release()
+
+    def notify_all(self):
+        self.notify(len(self._waiters))
+
+
+if PY2:
+    class _NativeRLock(threading._RLock):
+        """``threading.RLock`` waiting on a native lock."""
+        def __init__(self):
+            threading._RLock.__init__(self)
+            self._RLock__block = _allocate_lock()
+else:
+    _NativeRLock = get_original(_thread_module, 'RLock')
+
+
+def _use_native_handler_locks():
+    """
+    Give a native lock to the handlers reached by the ``ddtrace`` loggers, so
+    that the worker thread can log. Handlers created once ``threading`` is
+    patched have a greenlet lock; it's held while it's replaced.
+    """
+    handlers = set()
+    for name, logger in list(logging.Logger.manager.loggerDict.items()):
+        if name.split('.')[0] != 'ddtrace' or not isinstance(logger, logging.Logger):
+            continue
+        while logger is not None:
+            handlers.update(logger.handlers)
+            logger = logger.parent if logger.propagate else None
+    last_resort = getattr(logging, 'lastResort', None)
+    if last_resort is not None:
+        handlers.add(last_resort)
+
+    for handler in handlers:
+        lock = handler.lock
+        if lock is None or isinstance(lock, _NativeRLock):
+            continue
+        with lock:
+            handler.lock = _NativeRLock()
+
+
+class NativeThread(object):
+    """
+    Native thread running the given function, with the ``threading.Thread``
+    methods used by the worker. Native threads are always daemons.
+    """
+    def __init__(self, target):
+        self._target = target
+        self._done = _allocate_lock()
+        self._started = False
+
+    def start(self):
+        self._done.acquire()
+        self._started = True
+        _start_new_thread(self._run, ())
+
+    def _run(self):
+        try:
+            self._target()
+        finally:
+            self._done.release()
+
+    def is_alive(self):
+        return self._started and self._done.locked()
+
+    def join(self, timeout=None):
+        if self._started and _acquire(self._done, timeout):
+            self._done.release()
+
+
+def _create_connection(address, timeout=socket._GLOBAL_DEFAULT_TIMEOUT, source_address=None):
+    """``socket.create_connection()`` with native sockets."""
+    host, port = address
+    error = None
+    for family, socktype, proto, _, sockaddr in _getaddrinfo(host, port, 0, socket.SOCK_STREAM):
+        sock = None
+        try:
+            sock = _socket(family, socktype, proto)
+            if timeout is not socket._GLOBAL_DEFAULT_TIMEOUT:
+                sock.settimeout(timeout)
+            if source_address:
+                sock.bind(source_address)
+            sock.connect(sockaddr)
+            return sock
+        except socket.error as err:
+            error = err
+            if sock is not None:
+                sock.close()
+    raise error or socket.error('getaddrinfo returns an empty list')
+
+
+class NativeHTTPConnection(httplib.HTTPConnection):
+    def connect(self):
+        self.sock = _create_connection((self.host, self.port), self.timeout, self.source_address)
+
+
+class NativeUDSHTTPConnection(UDSHTTPConnection):
+    def connect(self):
+        sock = _socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        if self.timeout is not socket._GLOBAL_DEFAULT_TIMEOUT:
+            sock.settimeout(self.timeout)
+        sock.connect(self.path)
+        self.sock = sock
+
+
+class NativeAPI(API):
+    """``API`` sending requests with native sockets when gevent is patched."""
+    def _new_connection(self):
+        if not is_patched():
+            return super(NativeAPI, self)._new_connection()
+        if self.uds_path:
+            return NativeUDSHTTPConnection(self.uds_path)
+        return NativeHTTPConnection(self.hostname, self.port)
+
+
+class NativeAsyncWorker(AsyncWorker):
+    """``AsyncWorker`` running in a native thread."""
+    def _new_lock(self):
+        return _allocate_lock()
+
+    def start(self):
+        with self._lock:
+            if not self._thread:
+                _use_native_handler_locks()
+                self._thread = NativeThread(self._run)
+                self._thread.start()
+                atexit.register(self._on_shutdown)
+
+
+class GeventWriter(AgentWriter):
+    """
+    ``AgentWriter`` that flushes traces in a native thread when gevent is
+    patched. It takes the same arguments.
+    """
+    _api_class = NativeAPI
+
+    def _new_condition(self):
+        return NativeCondition() if is_patched() else None
+
+    def _new_lock(self):
+        if is_patched():
+            return _allocate_lock()
+        return super(GeventWriter, self)._new_lock()
+
+    def _new_worker(self, *args, **kwargs):
+        if is_patched():
+            return NativeAsyncWorker(*args, **kwargs)
+        return super(GeventWriter, self)._new_worker(*args, **kwargs)
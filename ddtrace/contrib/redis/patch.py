@@ -4,6 +4,7 @@ import wrapt
 
 # project
 from ...pin import Pin
+from ...span import TagLayer
 from ...ext import AppTypes, redis as redisx
 from ...utils.wrappers import unwrap
 from .util import format_command_args, _extract_conn_tags
@@ -49,9 +50,9 @@ def traced_execute_command(func, instance, args, kwargs):
         query = format_command_args(args)
         s.resource = query
         s.set_tag(redisx.RAWCMD, query)
-        if pin.tags:
-            s.set_tags(pin.tags)
-        s.set_tags(_get_tags(instance))
+        # like before the layers, the pin and connection tags win
+        s._add_tag_layer(pin._get_tags_layer())
+        s._add_tag_layer(_get_tags_layer(instance))
         s.set_metric(redisx.ARGS_LEN, len(args))
         # run the command
         return func(*args, **kwargs)
@@ -75,9 +76,17 @@ def traced_execute_pipeline(func, instance, args, kwargs):
     with tracer.trace(redisx.CMD, resource=resource, service=pin.service) as s:
         s.span_type = redisx.TYPE
         s.set_tag(redisx.RAWCMD, resource)
-        s.set_tags(_get_tags(instance))
+        s._add_tag_layer(_get_tags_layer(instance))
         s.set_metric(redisx.PIPELINE_LEN, len(instance.command_stack))
         return func(*args, **kwargs)
 
 def _get_tags(conn):
     return _extract_conn_tags(conn.connection_pool.connection_kwargs)
+
+def _get_tags_layer(conn):
+    """Return the ``TagLayer`` of the connection tags, kept on the client."""
+    previous = getattr(conn, '_datadog_tags_layer', None)
+    layer = TagLayer.get(previous, _get_tags(conn))
+    if layer is not previous:
+        conn._datadog_tags_layer = layer
+    return layer
@@ -1,6 +1,8 @@
 import json
 import logging
+import threading
 
+from .compat import iteritems
 
 # check msgpack CPP implementation; if the import fails, we're using the
 # pure Python implementation that is really slow, so the ``Encoder`` should use
@@ -20,6 +22,8 @@ except ImportError:
 
 log = logging.getLogger(__name__)
 
+_MISSING = object()
+
 
 class Encoder(object):
     """
@@ -46,6 +50,24 @@ class Encoder(object):
         normalized_traces = [[span.to_dict() for span in trace] for trace in traces]
         return self._encode(normalized_traces)
 
+    def encode_trace(self, trace):
+        """
+        Encodes a single trace, expecting a list of spans. The result can be
+        combined with other encoded traces using ``join_encoded()``.
+
+        :param trace: A list of spans that should be serialized
+        """
+        return self._encode([span.to_dict() for span in trace])
+
+    def join_encoded(self, objs):
+        """
+        Joins a list of traces encoded with ``encode_trace()`` in a single
+        payload, equivalent to the one returned by ``encode_traces()``.
+
+        :param objs: A list of encoded traces
+        """
+        raise NotImplementedError
+
     def encode_services(self, services):
         """
         Encodes a dictionary of services.
@@ -71,6 +93,12 @@ class JSONEncoder(Encoder):
     def _encode(self, obj):
         return json.dumps(obj)
 
+    def join_encoded(self, objs):
+        # traces received from other processes are bytes
+        if objs and isinstance(objs[0], bytes):
+            return b'[' + b','.join(objs) + b']'
+        return '[' + ','.join(objs) + ']'
+
 
 class MsgpackEncoder(Encoder):
     def __init__(self):
@@ -80,6 +108,122 @@ class MsgpackEncoder(Encoder):
     def _encode(self, obj):
         return msgpack.packb(obj, **MSGPACK_PARAMS)
 
+    def join_encoded(self, objs):
+        # the payload is a msgpack array header followed by the encoded traces
+        packer = msgpack.Packer(**MSGPACK_PARAMS)
+        return packer.pack_array_header(len(objs)) + b''.join(objs)
+
+
+class MsgpackStreamEncoder(MsgpackEncoder):
+    """
+    Msgpack encoder that packs spans straight from their attributes into a
+    reusable ``Packer`` buffer, without building the intermediate ``dict``
+    returned by ``Span.to_dict()``. The output is the same produced by the
+    ``MsgpackEncoder``. Each thread gets its own buffer, so that an instance
+    can be shared.
+
+    With ``hoist_trace_tags``, the global tags of the tracer are only written
+    once, on the root span, when the other spans have the same value: they
+    apply to the whole trace, but can't be searched on the other spans
+    anymore. The trace agent endpoints expect
+    the tags on each span, so they are written on every span by default, and
+    when the API downgrades to the default encoder.
+    """
+    def __init__(self, hoist_trace_tags=False):
+        super(MsgpackStreamEncoder, self).__init__()
+        self.hoist_trace_tags = hoist_trace_tags
+        self._local = threading.local()
+
+    def _get_packer(self):
+        packer = getattr(self._local, 'packer', None)
+        if packer is None:
+            packer = msgpack.Packer(autoreset=False, **MSGPACK_PARAMS)
+            self._local.packer = packer
+        return packer
+
+    def encode_traces(self, traces):
+        packer = self._get_packer()
+        try:
+            packer.pack_array_header(len(traces))
+            for trace in traces:
+                self._pack_trace(packer, trace)
+            return packer.bytes()
+        finally:
+            packer.reset()
+
+    def encode_trace(self, trace):
+        packer = self._get_packer()
+        try:
+            self._pack_trace(packer, trace)
+            return packer.bytes()
+        finally:
+            packer.reset()
+
+    def _pack_trace(self, packer, trace):
+        pack = packer.pack
+        packer.pack_array_header(len(trace))
+        root = None
+        if self.hoist_trace_tags and len(trace) > 1 and trace[0]._parent is None and trace[0]._trace_tags:
+            # parts of a trace flushed without their root keep all their tags
+            root = trace[0]
+            trace_tags = root._trace_tags.meta
+            # id of the meta of the spans -> meta without the root tags, since
+            # spans share their meta; they're all alive, so ids are unique
+            hoisted = {}
+        for span in trace:
+            # the same fields, in the same order, of ``Span.to_dict()``
+            start = span.start_ns
+            duration = span.duration_ns
+            meta = span._get_meta()
+            if root is not None and span is not root and meta:
+                key = id(meta)
+                without = hoisted.get(key)
+                if without is None:
+                    without = hoisted[key] = _without_tags(meta, trace_tags, root._get_meta())
+                meta = without
+            metrics = span.metrics
+            span_type = span.span_type
+            packer.pack_map_header(
+                7 + bool(start) + bool(duration) + bool(meta) + bool(metrics) + bool(span_type)
+            )
+            pack('trace_id')
+            pack(span.trace_id)
+            pack('parent_id')
+            pack(span.parent_id)
+            pack('span_id')
+            pack(span.span_id)
+            pack('service')
+            pack(span.service)
+            pack('resource')
+            pack(span.resource)
+            pack('name')
+            pack(span.name)
+            pack('error')
+            # a common mistake is to set the error field to a boolean
+            error = span.error
+            pack(1 if error and type(error) is bool else error)
+            if start:
+                pack('start')
+                pack(start)
+            if duration:
+                pack('duration')
+                pack(duration)
+            if meta:
+                pack('meta')
+                pack(meta)
+            if metrics:
+                pack('metrics')
+                pack(metrics)
+            if span_type:
+                pack('type')
+                pack(span_type)
+
+
+def _without_tags(meta, keys, tags):
+    """Return the items of ``meta``, but the ``keys`` that have the same value in ``tags``."""
+    return {key: value for key, value in iteritems(meta) if key not in keys or tags.get(key, _MISSING) != value}
+
+
 def get_encoder():
     """
     Switching logic that choose the best encoder for the API transport.
@@ -87,6 +231,6 @@ def get_encoder():
     installed, falling back to the Python built-in JSON encoder.
     """
     if MSGPACK_ENCODING:
-        return MsgpackEncoder()
+        return MsgpackStreamEncoder()
     else:
         return JSONEncoder()
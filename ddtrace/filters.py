@@ -1,7 +1,20 @@
 import re
+import threading
+from collections import OrderedDict
 
+from .compat import string_type
 from .ext import http
 
+
+# number of urls whose decision is remembered by FilterRequestsOnUrl
+URL_CACHE_SIZE = 1024
+
+# back references are numbered by group: patterns that use them can't be
+# merged with the others
+_BACKREFERENCE = re.compile(r'\\[1-9]|\(\?P=')
+_DEFAULT_FLAGS = re.compile('').flags
+
+
 class FilterRequestsOnUrl(object):
     """Filter out traces from incoming http requests based on the request's url.
     This class takes as argument a list of regular expression patterns
@@ -12,6 +25,11 @@ class FilterRequestsOnUrl(object):
 
     :param list regexps: a list of regular expressions (or a single string) defining
                          the urls that should be filtered out.
+    :param int cache_size: the number of recently seen urls whose decision is
+                           remembered, 0 to disable the cache.
+
+    The regular expressions are merged and matched at once, and only the url
+    of the root span is checked.
 
     Examples:
 
@@ -27,10 +45,15 @@ class FilterRequestsOnUrl(object):
 
         FilterRequestOnUrl([r'http://test\.example\.com', r'http://example\.com/healthcheck'])
     """
-    def __init__(self, regexps):
-        if isinstance(regexps, str):
+    def __init__(self, regexps, cache_size=URL_CACHE_SIZE):
+        if isinstance(regexps, string_type):
             regexps = [regexps]
         self._regexps = [re.compile(regexp) for regexp in regexps]
+        self._match = _merge_regexps(self._regexps)
+        # recent urls and if they are filtered out, least recently used first
+        self._cache = OrderedDict()
+        self._cache_size = cache_size
+        self._cache_lock = threading.Lock()
 
     def process_trace(self, trace):
         """
@@ -39,10 +62,60 @@ class FilterRequestsOnUrl(object):
         be fed to the next filter in the list. If process_trace returns None,
         the whole trace is discarded.
         """
-        for span in trace:
-            if span.parent_id is None and span.get_tag(http.URL) is not None:
-                url = span.get_tag(http.URL)
-                for regexp in self._regexps:
-                    if regexp.match(url):
-                        return None
+        if not trace:
+            return trace
+        # the root span is the first one, unless spans were added out of order
+        root = trace[0]
+        if root.parent_id is not None:
+            root = next((span for span in trace if span.parent_id is None), None)
+            if root is None:
+                return trace
+
+        url = root.get_tag(http.URL)
+        if url is not None and self._is_filtered(url):
+            return None
         return trace
+
+    def _is_filtered(self, url):
+        with self._cache_lock:
+            filtered = self._cache.pop(url, None)
+            if filtered is not None:
+                self._cache[url] = filtered
+                return filtered
+
+        filtered = self._match(url)
+        if self._cache_size:
+            with self._cache_lock:
+                self._cache[url] = filtered
+                if len(self._cache) > self._cache_size:
+                    self._cache.popitem(last=False)
+        return filtered
+
+
+def _merge_regexps(regexps):
+    """
+    Return a function telling if a string matches any of the compiled regular
+    expressions. When possible they are merged in a single alternation, so
+    that a string is matched once rather than once per regular expression.
+    """
+    # compiled regular expressions with their own flags, or back references
+    # whose numbers would change, are matched on their own
+    mergeable = [
+        r for r in regexps
+        if isinstance(r.pattern, string_type) and r.flags == _DEFAULT_FLAGS and not _BACKREFERENCE.search(r.pattern)
+    ]
+    if len(mergeable) > 1:
+        try:
+            merged = re.compile('|'.join('(?:{})'.format(r.pattern) for r in mergeable))
+        except re.error:
+            # e.g. global flags in the middle of a pattern or two groups with the same name
+            pass
+        else:
+            regexps = [merged] + [r for r in regexps if r not in mergeable]
+
+    def match(string):
+        for regexp in regexps:
+            if regexp.match(string):
+                return True
+        return False
+    return match
@@ -0,0 +1,195 @@
+"""
+Trace forwarder shared by the processes of a host.
+
+With pre-fork servers every worker process has its own queue, flush thread
+and connection to the trace agent. Instead, the processes can use a
+``ForwarderWriter``: traces are encoded in the application thread and sent
+right away to a ``TraceForwarder`` through a Unix datagram socket. The
+forwarder is the only one to batch them and send them to the agent.
+
+The forwarder runs in its own process (``ddtrace-forwarder``) or in a thread
+of the master process. When it isn't available, the ``ForwarderWriter`` sends
+traces to the agent itself, like an ``AgentWriter``.
+
+The trace agent sampling rates are only known by the forwarder: with priority
+sampling, the processes keep using the default rates.
+"""
+import errno
+import json
+import logging
+import os
+import socket
+import struct
+import threading
+
+from .writer import AgentWriter, EncodedTrace
+
+
+log = logging.getLogger(__name__)
+
+# datagram types
+TRACE = b'T'
+SERVICES = b'S'
+
+# number of spans, sampling priority and length of the content type of the
+# encoded trace that follows
+TRACE_HEADER = struct.Struct('<IdH')
+
+# traces larger than this are sent by the process itself; the actual limit
+# also depends on the socket buffers
+MAX_DATAGRAM_SIZE = 1 << 20
+
+
+class ForwarderWriter(AgentWriter):
+    """
+    Writer that hands traces to a ``TraceForwarder`` listening on the given
+    socket path; other arguments are the ones of ``AgentWriter``, used when
+    the forwarder can't be reached.
+    """
+    def __init__(self, path, *args, **kwargs):
+        kwargs['encode_on_write'] = True
+        super(ForwarderWriter, self).__init__(*args, **kwargs)
+        self.path = path
+        self._sock = None
+        self._sock_pid = None
+        self._sock_lock = threading.Lock()
+
+    def write(self, spans=None, services=None):
+        if spans:
+            trace = self._encode_trace(spans)
+            if trace:
+                if self._forward(self._trace_message(trace)):
+                    self._stats.increment('traces.forwarded')
+                else:
+                    super(ForwarderWriter, self).write(spans=trace)
+
+        if services:
+            if not self._forward(SERVICES + json.dumps(services).encode('utf-8')):
+                super(ForwarderWriter, self).write(services=services)
+
+    def _trace_message(self, trace):
+        content_type = self.api.content_type.encode('utf-8')
+        header = TRACE_HEADER.pack(trace.spans, trace.priority, len(content_type))
+        data = trace.data if isinstance(trace.data, bytes) else trace.data.encode('utf-8')
+        return b''.join((TRACE, header, content_type, data))
+
+    def _forward(self, message):
+        """Send the message to the forwarder, returning if it succeeded."""
+        if len(message) > MAX_DATAGRAM_SIZE:
+            return False
+        try:
+            self._get_socket().sendto(message, self.path)
+            return True
+        except socket.error as err:
+            # the forwarder isn't running, or it can't keep up
+            log.debug("cannot forward to %s: %s", self.path, err)
+            return False
+
+    def _get_socket(self):
+        # when forks are tracked the socket of the parent is closed after the
+        # fork, otherwise it's detected with the pid
+        if not self._at_fork and self._sock is not None and self._sock_pid != os.getpid():
+            self._close_socket()
+        if self._sock is None:
+            with self._sock_lock:
+                if self._sock is None:
+                    sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+                    # the application never waits for the forwarder
+                    sock.setblocking(False)
+                    _set_buffer_size(sock, socket.SO_SNDBUF)
+                    self._sock = sock
+                    self._sock_pid = os.getpid()
+        return self._sock
+
+    def _close_socket(self):
+        sock, self._sock = self._sock, None
+        if sock is not None:
+            try:
+                sock.close()
+            except socket.error:
+                pass
+
+    def _after_fork(self):
+        super(ForwarderWriter, self)._after_fork()
+        # the lock may have been held by another thread of the parent
+        self._sock_lock = threading.Lock()
+        self._close_socket()
+
+
+class TraceForwarder(object):
+    """
+    Receive the traces of the ``ForwarderWriter`` instances on the given
+    socket path, and send them to the trace agent in batches through an
+    ``AgentWriter`` created with the given arguments.
+    """
+    def __init__(self, path, *args, **kwargs):
+        kwargs['encode_on_write'] = True
+        self.writer = AgentWriter(*args, **kwargs)
+        self.path = path
+        self.dropped = 0
+        self._thread = None
+        self._stopped = False
+
+        try:
+            os.unlink(path)
+        except OSError as err:
+            if err.errno != errno.ENOENT:
+                raise
+        self._sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        _set_buffer_size(self._sock, socket.SO_RCVBUF)
+        self._sock.bind(path)
+        # wake up regularly to check if the forwarder is stopped
+        self._sock.settimeout(1)
+        self._buffer = bytearray(MAX_DATAGRAM_SIZE)
+
+    def start(self):
+        """Receive traces in a daemon thread."""
+        self._thread = threading.Thread(target=self.serve_forever)
+        self._thread.setDaemon(True)
+        self._thread.start()
+
+    def stop(self, timeout=None):
+        self._stopped = True
+        if self._thread:
+            self._thread.join(timeout)
+
+    def serve_forever(self):
+        try:
+            while not self._stopped:
+                try:
+                    size = self._sock.recv_into(self._buffer)
+                except socket.timeout:
+                    continue
+                try:
+                    self.handle(bytes(memoryview(self._buffer)[:size]))
+                except Exception:
+                    log.error("cannot handle the message of %d bytes", size, exc_info=True)
+        finally:
+            self._sock.close()
+            os.unlink(self.path)
+
+    def handle(self, message):
+        kind = message[:1]
+        if kind == TRACE:
+            spans, priority, type_size = TRACE_HEADER.unpack_from(message, 1)
+            offset = 1 + TRACE_HEADER.size
+            content_type = message[offset:offset + type_size].decode('utf-8')
+            if content_type != self.writer.api.content_type:
+                # the agent doesn't support the encoding of the process
+                self.dropped += 1
+                return
+            data = message[offset + type_size:]
+            self.writer.write(spans=EncodedTrace(data, spans, priority))
+        elif kind == SERVICES:
+            self.writer.write(services=json.loads(message[1:].decode('utf-8')))
+        else:
+            log.debug("unknown message type %r", kind)
+
+
+def _set_buffer_size(sock, option, size=MAX_DATAGRAM_SIZE * 4):
+    try:
+        sock.setsockopt(socket.SOL_SOCKET, option, size)
+    except socket.error:
+        # the system may not allow it, the default size is used
+        pass
+
@@ -253,7 +253,8 @@ class Tracer(opentracing.Tracer):
         )
 
         # set the start time if one is specified
-        ddspan.start = start_time or ddspan.start
+        if start_time:
+            ddspan.start = start_time
         if tags is not None:
             ddspan.set_tags(tags)
 
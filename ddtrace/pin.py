@@ -3,6 +3,8 @@ import logging
 import wrapt
 import ddtrace
 
+from .span import TagLayer
+
 
 log = logging.getLogger(__name__)
 
@@ -24,7 +26,7 @@ class Pin(object):
         >>> pin = Pin.override(conn, service="user-db")
         >>> conn = sqlite.connect("/tmp/image.db")
     """
-    __slots__ = ['app', 'app_type', 'tags', 'tracer', '_target', '_config', '_initialized']
+    __slots__ = ['app', 'app_type', 'tags', 'tracer', '_target', '_config', '_sent', '_tags_layer', '_initialized']
 
     def __init__(self, service, app=None, app_type=None, tags=None, tracer=None, _config=None):
         tracer = tracer or ddtrace.tracer
@@ -33,6 +35,10 @@ class Pin(object):
         self.tags = tags
         self.tracer = tracer
         self._target = None
+        # the tracer and service of the last _send()
+        self._sent = None
+        # the TagLayer of the tags, shared by the spans
+        self._tags_layer = None
         # keep the configuration attribute internal because the
         # public API to access it is not the Pin class
         self._config = _config or {}
@@ -48,7 +54,7 @@ class Pin(object):
         return self._config['service_name']
 
     def __setattr__(self, name, value):
-        if getattr(self, '_initialized', False) and name is not '_target':
+        if getattr(self, '_initialized', False) and name not in ('_target', '_sent', '_tags_layer'):
             raise AttributeError("can't mutate a pin, use override() or clone() instead")
         super(Pin, self).__setattr__(name, value)
 
@@ -106,6 +112,13 @@ class Pin(object):
         """Return true if this pin's tracer is enabled. """
         return bool(self.tracer) and self.tracer.enabled
 
+    def _get_tags_layer(self):
+        """Return the ``TagLayer`` of the pin tags to set on spans, None without tags."""
+        layer = TagLayer.get(self._tags_layer, self.tags)
+        if layer is not self._tags_layer:
+            self._tags_layer = layer
+        return layer
+
     def onto(self, obj, send=True):
         """Patch this pin onto the given object. If send is true, it will also
         queue the metadata to be sent to the server.
@@ -156,8 +169,15 @@ class Pin(object):
         )
 
     def _send(self):
+        # the same pin is often put onto many objects (e.g. each cursor of a
+        # connection): its info only needs to be given once to the tracer
+        service = self.service
+        sent = self._sent
+        if sent is not None and sent[0] is self.tracer and sent[1] is service:
+            return
         self.tracer.set_service_info(
-            service=self.service,
+            service=service,
             app=self.app,
             app_type=self.app_type,
         )
+        self._sent = (self.tracer, service)
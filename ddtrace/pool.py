@@ -0,0 +1,108 @@
+"""
+Recycling of the spans sent to the trace agent.
+
+Each span allocates the span itself and its ``meta`` and ``metrics``
+dictionaries, that are garbage as soon as the writer has encoded them. With
+``tracer.configure(recycle_spans=True)``, the spans encoded by the writer are
+cleared and kept in a bounded free list, to be reused by the next
+``Tracer.start_span()`` calls.
+
+A span is only recycled if nothing but its trace references it: spans (or
+their ``meta`` and ``metrics`` dictionaries) kept by the application after
+``finish()``, referenced by a weak reference or by a span that is kept, are
+left alone and garbage collected as usual. References are counted with
+``sys.getrefcount()``, so spans are only recycled on CPython.
+"""
+import collections
+import sys
+import weakref
+
+from .compat import PYTHON_INTERPRETER
+from .span import Span
+
+
+# number of spans kept in the free list
+MAX_SIZE = 5000
+
+# a span of a trace is referenced by the trace list and by the reference
+# given to sys.getrefcount(), so are its dictionaries by the span
+_REFS = 2
+
+# other implementations don't count references
+SUPPORTED = PYTHON_INTERPRETER == 'CPython' and hasattr(sys, 'getrefcount')
+
+
+class SpanPool(object):
+    """
+    Free list of spans, bounded to ``max_size`` spans. It can be shared by
+    threads: the free list is a ``deque``, whose operations are atomic.
+    """
+    def __init__(self, max_size=MAX_SIZE):
+        self.max_size = max_size
+        self._free = collections.deque()
+        self.reused = 0
+        self.recycled = 0
+
+    def __len__(self):
+        return len(self._free)
+
+    def acquire(self, tracer, name, service=None, resource=None, span_type=None, trace_id=None, span_id=None,
+                parent_id=None, start=None, context=None):
+        """Return a span, recycled if available, initialized like with the ``Span`` constructor."""
+        try:
+            span = self._free.pop()
+        except IndexError:
+            span = Span(tracer, name, service=service, resource=resource, span_type=span_type,
+                        trace_id=trace_id, span_id=span_id, parent_id=parent_id, start=start, context=context)
+            span._pool = self
+            return span
+
+        # the dictionaries are emptied on release
+        span._init(tracer, name, service, resource, span_type, trace_id, span_id, parent_id, start, context)
+        self.reused += 1
+        return span
+
+    def release(self, trace):
+        """
+        Put the spans of the trace that were given by this pool and that are
+        only referenced by the trace in the free list. The trace must not be
+        used afterwards.
+        """
+        free = self._free
+        # children come after their parent: releasing them first drops the
+        # references they hold on their parent
+        for i in range(len(trace) - 1, -1, -1):
+            if len(free) >= self.max_size:
+                return
+            if trace[i]._pool is not self or sys.getrefcount(trace[i]) > _REFS:
+                continue
+            span = trace[i]
+            # a shared meta isn't cleared but replaced
+            shared_meta = span._shared_meta
+            if (not shared_meta and sys.getrefcount(span._meta) > _REFS) or sys.getrefcount(span.metrics) > _REFS:
+                continue
+            if weakref.getweakrefcount(span):
+                continue
+            if shared_meta:
+                span._meta = {}
+                span._shared_meta = False
+            else:
+                span._meta.clear()
+            span._raw_tags = None
+            span.metrics.clear()
+            span._tracer = None
+            span._context = None
+            span._parent = None
+            span = None
+            free.append(trace[i])
+            self.recycled += 1
+
+
+def release_traces(traces):
+    """Give the spans of the encoded traces back to their pool, if any."""
+    if not SUPPORTED:
+        return
+    for trace in traces:
+        pool = trace[0]._pool if trace else None
+        if pool is not None:
+            pool.release(trace)
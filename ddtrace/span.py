@@ -1,16 +1,18 @@
 import logging
 import math
-import random
 import sys
-import time
 import traceback
 
-from .compat import StringIO, stringify, iteritems, numeric_types
+from .compat import StringIO, stringify, iteritems, numeric_types, time_ns, monotonic_ns
 from .ext import errors
+from .utils.ids import new_id
 
 
 log = logging.getLogger(__name__)
 
+# merges cached by a TagLayer, there is usually one per layer below it
+MAX_MERGED_LAYERS = 16
+
 
 class Span(object):
 
@@ -22,12 +24,12 @@ class Span(object):
         'span_id',
         'trace_id',
         'parent_id',
-        'meta',
+        '_meta',
         'error',
         'metrics',
         'span_type',
-        'start',
-        'duration',
+        'start_ns',
+        'duration_ns',
         # Sampler attributes
         'sampled',
         # Internal attributes
@@ -35,6 +37,11 @@ class Span(object):
         '_context',
         '_finished',
         '_parent',
+        '_pool',
+        '_monotonic_start',
+        '_shared_meta',
+        '_raw_tags',
+        '_trace_tags',
         '__weakref__',
     ]
 
@@ -67,27 +74,47 @@ class Span(object):
         :param int parent_id: the id of this span's direct parent span.
         :param int span_id: the id of this span.
 
-        :param int start: the start time of request as a unix epoch in seconds
+        :param float start: the start time of request as a unix epoch in seconds
         :param object context: the Context of the span.
         """
+        # tags / metatdata; meta may be shared with other spans until a tag
+        # is set (see ``TagLayer``), values that aren't strings are kept
+        # apart until they are converted
+        self._meta = {}
+        self._shared_meta = False
+        self._raw_tags = None
+        self.metrics = {}
+
+        # the SpanPool the span is given back to once encoded, if any
+        self._pool = None
+
+        self._init(tracer, name, service, resource, span_type, trace_id, span_id, parent_id, start, context)
+
+    def _init(self, tracer, name, service, resource, span_type, trace_id, span_id, parent_id, start, context):
+        """
+        Initialize the fields of the span, but its tag dictionaries: it's also
+        used by the ``SpanPool`` to reuse a span whose dictionaries are empty.
+        """
         # required span info
         self.name = name
         self.service = service
         self.resource = resource or name
         self.span_type = span_type
-
-        # tags / metatdata
-        self.meta = {}
         self.error = 0
-        self.metrics = {}
 
-        # timing
-        self.start = start or time.time()
-        self.duration = None
+        # timing: the start is a wall clock time, the duration is measured
+        # with a monotonic clock unless the start time is given
+        if start:
+            self.start_ns = int(start * 1e9)
+            self._monotonic_start = None
+        else:
+            self.start_ns = time_ns()
+            self._monotonic_start = monotonic_ns()
+        self.duration_ns = None
 
         # tracing
-        self.trace_id = trace_id or _new_id()
-        self.span_id = span_id or _new_id()
+        self.trace_id = trace_id or new_id()
+        self.span_id = span_id or new_id()
         self.parent_id = parent_id
 
         # sampling
@@ -96,6 +123,8 @@ class Span(object):
         self._tracer = tracer
         self._context = context
         self._parent = None
+        # on a root span, the TagLayer of the tags of the whole trace
+        self._trace_tags = None
 
         # state
         self._finished = False
@@ -111,10 +140,8 @@ class Span(object):
             return
         self._finished = True
 
-        if self.duration is None:
-            ft = finish_time or time.time()
-            # be defensive so we don't die if start isn't set
-            self.duration = ft - (self.start or ft)
+        if self.duration_ns is None:
+            self._set_duration(finish_time)
 
         # if a tracer is available to process the current context
         if self._tracer and self._context:
@@ -124,24 +151,138 @@ class Span(object):
             except Exception:
                 log.exception("error recording finished trace")
 
+    def _set_duration(self, finish_time):
+        if finish_time:
+            ft = int(finish_time * 1e9)
+            # be defensive so we don't die if start isn't set
+            self.duration_ns = ft - (self.start_ns or ft)
+        elif self._monotonic_start is not None:
+            self.duration_ns = monotonic_ns() - self._monotonic_start
+        else:
+            ft = time_ns()
+            self.duration_ns = ft - (self.start_ns or ft)
+
+    @property
+    def start(self):
+        """The start time as a unix epoch in seconds; ``start_ns`` is the same in nanoseconds."""
+        return None if self.start_ns is None else self.start_ns / 1e9
+
+    @start.setter
+    def start(self, value):
+        self.start_ns = None if value is None else int(value * 1e9)
+        # the duration can't be measured from the monotonic clock anymore
+        self._monotonic_start = None
+
+    @property
+    def duration(self):
+        """The duration in seconds, once finished; ``duration_ns`` is the same in nanoseconds."""
+        return None if self.duration_ns is None else self.duration_ns / 1e9
+
+    @duration.setter
+    def duration(self, value):
+        self.duration_ns = None if value is None else int(value * 1e9)
+
+    @property
+    def meta(self):
+        """The tags of the span, as strings."""
+        if self._raw_tags:
+            self._convert_raw_tags()
+        elif self._shared_meta:
+            # the meta of a TagLayer must not be changed through the span
+            self._copy_meta()
+        return self._meta
+
+    def _get_meta(self):
+        """Return the tags of the span, as strings, for the encoders: a shared meta isn't copied."""
+        if self._raw_tags:
+            self._convert_raw_tags()
+        return self._meta
+
+    @meta.setter
+    def meta(self, value):
+        self._meta = value
+        self._shared_meta = False
+        self._raw_tags = None
+
     def set_tag(self, key, value):
         """ Set the given key / value tag pair on the span. Keys and values
-            must be strings (or stringable). If a casting error occurs, it will
-            be ignored.
+            must be strings (or stringable). Values that aren't strings are
+            converted when ``meta`` is read, usually when the trace is encoded
+            by the writer: a mutable value is sent as it is at that time, so
+            pass a string to keep the current one. If a casting error occurs,
+            the value will be ignored and the previous one, if any, kept.
         """
-        try:
-            self.meta[key] = stringify(value)
-        except Exception:
-            log.debug("error setting tag %s, ignoring it", key, exc_info=True)
+        raw_tags = self._raw_tags
+        if type(value) is stringify:
+            if self._shared_meta:
+                self._copy_meta()
+            self._meta[key] = value
+            if raw_tags and key in raw_tags:
+                del raw_tags[key]
+        elif raw_tags is None:
+            self._raw_tags = {key: value}
+        else:
+            raw_tags[key] = value
 
     def _remove_tag(self, key):
-        if key in self.meta:
-            del self.meta[key]
+        if self._raw_tags:
+            self._raw_tags.pop(key, None)
+        if key in self._meta:
+            if self._shared_meta:
+                self._copy_meta()
+            del self._meta[key]
+
+    def _copy_meta(self):
+        """Copy the shared meta before a tag of the span is set."""
+        self._meta = dict(self._meta)
+        self._shared_meta = False
+
+    def _convert_raw_tags(self):
+        """Convert the tags that aren't strings yet and move them to meta, ignoring those that can't be."""
+        raw_tags = self._raw_tags
+        self._raw_tags = None
+        if self._shared_meta:
+            self._copy_meta()
+        meta = self._meta
+        for key, value in iteritems(raw_tags):
+            try:
+                meta[key] = stringify(value)
+            except Exception:
+                # like when tags were converted on set, the previous value is kept
+                log.debug("error setting tag %s, ignoring it", key, exc_info=True)
+
+    def _add_tag_layer(self, layer):
+        """
+        Set the tags of the ``TagLayer`` on the span. Its meta is shared with
+        other spans until a tag of the span is set, so they are neither
+        converted nor copied for each span.
+        """
+        if layer is None:
+            return
+        if self._raw_tags:
+            # the tags of the layer win
+            for key in layer.meta:
+                self._raw_tags.pop(key, None)
+        if self._shared_meta:
+            self._meta = layer.merge(self._meta)
+        elif not self._meta:
+            self._meta = layer.meta
+            self._shared_meta = True
+        else:
+            self._meta.update(layer.meta)
 
     def get_tag(self, key):
-        """ Return the given tag or None if it doesn't exist.
+        """ Return the given tag as the string that will be sent, or None if
+            it doesn't exist. A value that can't be converted is ignored.
         """
-        return self.meta.get(key, None)
+        raw_tags = self._raw_tags
+        if not raw_tags or key not in raw_tags:
+            return self._meta.get(key, None)
+        try:
+            return stringify(raw_tags[key])
+        except Exception:
+            log.debug("error converting tag %s", key, exc_info=True)
+            return self._meta.get(key, None)
 
     def set_tags(self, tags):
         """ Set a dictionary of tags on the given span. Keys and values
@@ -205,14 +346,15 @@ class Span(object):
         if err and type(err) == bool:
             d['error'] = 1
 
-        if self.start:
-            d['start'] = int(self.start * 1e9)  # ns
+        if self.start_ns:
+            d['start'] = self.start_ns
 
-        if self.duration:
-            d['duration'] = int(self.duration * 1e9)  # ns
+        if self.duration_ns:
+            d['duration'] = self.duration_ns
 
-        if self.meta:
-            d['meta'] = self.meta
+        meta = self._get_meta()
+        if meta:
+            d['meta'] = meta
 
         if self.metrics:
             d['metrics'] = self.metrics
@@ -249,7 +391,8 @@ class Span(object):
         # readable version of type (e.g. exceptions.ZeroDivisionError)
         exc_type_str = "%s.%s" % (exc_type.__module__, exc_type.__name__)
 
-        self.set_tag(errors.ERROR_MSG, exc_val)
+        # the exception holds the traceback and its frames: don't keep it
+        self.set_tag(errors.ERROR_MSG, stringify(exc_val))
         self.set_tag(errors.ERROR_TYPE, exc_type_str)
         self.set_tag(errors.ERROR_STACK, tb)
 
@@ -311,6 +454,81 @@ class Span(object):
             self.name,
         )
 
-def _new_id():
-    """Generate a random trace_id or span_id"""
-    return random.getrandbits(64)
+
+class NoopSpan(Span):
+    """
+    Span returned by the tracer once a trace has reached its maximum number
+    of spans. It isn't added to the ``Context`` and its tags are ignored: when
+    finished, only its name, service and duration are counted in the summary
+    that the ``Context`` sets on the root span. It has the ids of its parent,
+    so that distributed traces stay attached to the last recorded span.
+    """
+    __slots__ = []
+
+    def finish(self, finish_time=None):
+        if self._finished:
+            return
+        self._finished = True
+
+        if self.duration_ns is None:
+            self._set_duration(finish_time)
+        if self._context:
+            self._context._drop_span(self)
+
+    def set_tag(self, key, value):
+        pass
+
+    def set_metric(self, key, value):
+        pass
+
+    def set_exc_info(self, exc_type, exc_val, exc_tb):
+        pass
+
+    def set_traceback(self, limit=20):
+        pass
+
+    def _add_tag_layer(self, layer):
+        pass
+
+
+class TagLayer(object):
+    """
+    Tags that many spans have in common, like the tags of the tracer, of a
+    ``Pin`` or of a connection. They are converted to strings once, and spans
+    share the resulting meta, as well as its merges with other layers, until
+    they set a tag of their own. The meta of a layer must never be changed: a
+    new layer is created when the tags change (see ``TagLayer.get()``).
+    """
+    __slots__ = ['tags', 'meta', '_merged']
+
+    def __init__(self, tags):
+        self.tags = dict(tags)
+        self.meta = {}
+        for key, value in iteritems(self.tags):
+            try:
+                self.meta[key] = stringify(value)
+            except Exception:
+                log.debug("error setting tag %s, ignoring it", key, exc_info=True)
+        # id of a shared meta -> (meta, meta merged with this layer)
+        self._merged = {}
+
+    @classmethod
+    def get(cls, layer, tags):
+        """Return ``layer`` if it has the given tags, or a new layer for them; None without tags."""
+        if not tags:
+            return None
+        if layer is not None and layer.tags == tags:
+            return layer
+        return cls(tags)
+
+    def merge(self, meta):
+        """Return the given shared meta updated with the tags of the layer, shared as well."""
+        merged = self._merged.get(id(meta))
+        if merged is not None and merged[0] is meta:
+            return merged[1]
+        result = dict(meta)
+        result.update(self.meta)
+        if len(self._merged) >= MAX_MERGED_LAYERS:
+            self._merged = {}
+        self._merged[id(meta)] = (meta, result)
+        return result
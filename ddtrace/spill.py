@@ -0,0 +1,200 @@
+"""
+Spill file for the payloads that can't be sent to the trace agent.
+
+The file is a fixed size ring buffer of encoded payloads, memory mapped so
+that it doesn't grow the Python heap: when the agent is unavailable for a
+long time, the writer appends payloads to it and replays them, oldest first,
+when the agent is back. When the file is full the oldest payloads are
+overwritten, and the pages of the payloads that were sent are released.
+
+The file survives the process, so that traces are kept across restarts; it
+can only be used by a process at a time.
+"""
+import logging
+import mmap
+import os
+import struct
+
+try:
+    import fcntl
+except ImportError:
+    # not available on Windows
+    fcntl = None
+
+from .api import Payload
+
+
+log = logging.getLogger(__name__)
+
+MAGIC = b'DDSP'
+VERSION = 1
+
+# magic, version, head, tail: head and tail are offsets in the data area that
+# only grow, the position in the file is taken modulo its capacity
+HEADER = struct.Struct('<4sIQQ')
+HEADER_SIZE = mmap.PAGESIZE
+
+# length of the data, number of traces, length of the content type
+RECORD = struct.Struct('<IIH')
+
+# record length that marks the unused space at the end of the data area
+SKIP = 0xffffffff
+
+
+class SpillFile(object):
+    """
+    Ring buffer of payloads in a memory mapped file. It isn't thread-safe:
+    it's meant to be used by the writer worker only.
+    """
+    def __init__(self, path, size):
+        self.path = path
+        # the data area is made of whole pages
+        self._size = HEADER_SIZE + max(size - HEADER_SIZE, mmap.PAGESIZE) // mmap.PAGESIZE * mmap.PAGESIZE
+        self._capacity = self._size - HEADER_SIZE
+        self.dropped = 0
+
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            if fcntl is None:
+                raise IOError('file locking is not available')
+            # only one process at a time can use the file
+            fcntl.flock(self._fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+
+            if os.fstat(self._fd).st_size != self._size:
+                os.ftruncate(self._fd, self._size)
+            self._mmap = mmap.mmap(self._fd, self._size)
+        except Exception:
+            os.close(self._fd)
+            raise
+
+        magic, version, head, tail = HEADER.unpack_from(self._mmap, 0)
+        if magic == MAGIC and version == VERSION and head <= tail <= head + self._capacity:
+            self._head, self._tail = head, tail
+            if self:
+                log.debug("found %d bytes of payloads in spill file %s", tail - head, path)
+        else:
+            self._head = self._tail = 0
+            self._write_header()
+
+    def __len__(self):
+        """Bytes used by the stored payloads."""
+        return self._tail - self._head
+
+    def append(self, payload):
+        """
+        Store the payload, dropping the oldest ones if there isn't enough room.
+        Return if the payload was stored.
+        """
+        content_type = payload.content_type.encode('utf-8')
+        # JSON payloads are text
+        data = payload.data if isinstance(payload.data, bytes) else payload.data.encode('utf-8')
+        length = RECORD.size + len(content_type) + len(data)
+        if length > self._capacity:
+            self.dropped += payload.count
+            return False
+
+        if not self:
+            self._head = self._tail = 0
+
+        padding = self._padding(length)
+        while len(self) + padding + length > self._capacity:
+            _, count, offset = self._read(self._head)
+            self.dropped += count
+            self._head = offset
+            if not self:
+                # all the payloads are dropped: start again from the beginning
+                self._head = self._tail = 0
+                padding = self._padding(length)
+
+        if padding:
+            if padding >= RECORD.size:
+                RECORD.pack_into(self._mmap, self._position(self._tail), SKIP, 0, 0)
+            self._tail += padding
+
+        position = self._position(self._tail)
+        RECORD.pack_into(self._mmap, position, len(data), payload.count, len(content_type))
+        position += RECORD.size
+        self._mmap[position:position + len(content_type)] = content_type
+        position += len(content_type)
+        self._mmap[position:position + len(data)] = data
+        self._tail += length
+        self._write_header()
+        return True
+
+    def pop(self):
+        """Remove and return the oldest payload, or None if the file is empty."""
+        if not self:
+            return None
+        start = self._head
+        payload, _, end = self._read(start)
+        self._head = end
+        if not self:
+            # start again from the beginning of the file
+            self._head = self._tail = 0
+        self._write_header()
+        self._release(start, end)
+        return payload
+
+    def close(self):
+        self._mmap.flush()
+        self._mmap.close()
+        os.close(self._fd)
+
+    def _read(self, offset):
+        """Return the payload at the given offset, its count and the offset of the next record."""
+        remaining = self._remaining(offset)
+        if remaining < RECORD.size or RECORD.unpack_from(self._mmap, self._position(offset))[0] == SKIP:
+            offset += remaining
+
+        position = self._position(offset)
+        size, count, type_size = RECORD.unpack_from(self._mmap, position)
+        position += RECORD.size
+        content_type = self._mmap[position:position + type_size].decode('utf-8')
+        position += type_size
+        data = self._mmap[position:position + size]
+        return Payload(data, count, content_type), count, offset + RECORD.size + type_size + size
+
+    def _padding(self, length):
+        """
+        Return the space skipped before a record of the given length: records
+        are never split, if there isn't enough space at the end of the data
+        area, it's skipped and the record goes at the beginning.
+        """
+        padding = self._remaining(self._tail)
+        return 0 if padding >= length else padding
+
+    def _position(self, offset):
+        return HEADER_SIZE + offset % self._capacity
+
+    def _remaining(self, offset):
+        return self._capacity - offset % self._capacity
+
+    def _write_header(self):
+        HEADER.pack_into(self._mmap, 0, MAGIC, VERSION, self._head, self._tail)
+
+    def _release(self, start, end):
+        """Give back to the OS the pages that only held payloads already sent."""
+        madvise = getattr(self._mmap, 'madvise', None)
+        if madvise is None or not hasattr(mmap, 'MADV_DONTNEED'):
+            return
+
+        if end <= start or end - start >= self._capacity:
+            return
+        first = self._position(start)
+        last = self._position(end) if self._position(end) > first else self._size
+        first = -(-first // mmap.PAGESIZE) * mmap.PAGESIZE
+        last = last // mmap.PAGESIZE * mmap.PAGESIZE
+        if last > first:
+            try:
+                madvise(mmap.MADV_DONTNEED, first, last - first)
+            except OSError:
+                pass
+
+
+def open_spill_file(path, size):
+    """Open the spill file, returning None if it can't be used."""
+    try:
+        return SpillFile(path, size)
+    except Exception as err:
+        log.warning("cannot use %s to spill traces: %s", path, err)
+        return None
@@ -0,0 +1,119 @@
+"""
+Internal metrics of the writer: what is queued, dropped and sent, and how long
+it takes to encode and send it.
+"""
+import bisect
+import threading
+from collections import defaultdict
+
+from .compat import iteritems
+
+
+# upper bounds of the histogram buckets, in seconds and bytes
+DURATION_BOUNDS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)
+SIZE_BOUNDS = (1 << 10, 4 << 10, 16 << 10, 64 << 10, 256 << 10, 1 << 20, 4 << 20, 8 << 20)
+
+HISTOGRAM_BOUNDS = {
+    'encode.duration': DURATION_BOUNDS,
+    'http.duration': DURATION_BOUNDS,
+    'payload.bytes': SIZE_BOUNDS,
+}
+
+
+class Histogram(object):
+    """
+    Count, sum, min and max of the recorded values, and how many of them
+    fall in each bucket; the last bucket holds the values above all bounds.
+    """
+    __slots__ = ['bounds', 'buckets', 'count', 'sum', 'min', 'max']
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.buckets = [0] * (len(bounds) + 1)
+        self.count = 0
+        self.sum = 0
+        self.min = None
+        self.max = None
+
+    def add(self, value):
+        self.count += 1
+        self.sum += value
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+        self.buckets[bisect.bisect_left(self.bounds, value)] += 1
+
+    def to_dict(self):
+        return {
+            'count': self.count,
+            'sum': self.sum,
+            'min': self.min,
+            'max': self.max,
+            'buckets': list(zip(self.bounds + (float('inf'),), self.buckets)),
+        }
+
+
+class WriterStats(object):
+    """
+    Counters and histograms updated by the writer. Updates are a dictionary
+    operation under a lock, cheap enough to always be enabled; the lock can be
+    given when the default one can't be shared by the writer and its worker.
+    """
+    def __init__(self, lock=None):
+        self._lock = threading.Lock() if lock is None else lock
+        self._counters = defaultdict(int)
+        self._histograms = {}
+
+    def increment(self, name, value=1):
+        with self._lock:
+            self._counters[name] += value
+
+    def record(self, name, value):
+        """Add the value to the histogram with the given name."""
+        with self._lock:
+            histogram = self._histograms.get(name)
+            if histogram is None:
+                histogram = self._histograms[name] = Histogram(HISTOGRAM_BOUNDS.get(name, DURATION_BOUNDS))
+            histogram.add(value)
+
+    def snapshot(self):
+        """Return a dictionary of the counter values and of the histograms as dictionaries."""
+        with self._lock:
+            stats = dict(self._counters)
+            for name, histogram in iteritems(self._histograms):
+                stats[name] = histogram.to_dict()
+        return stats
+
+
+class StatsReporter(object):
+    """
+    Send the writer stats to a DogStatsD client, or any object with the
+    same ``increment(metric, value)`` and ``gauge(metric, value)`` methods.
+    Counters are sent as the increment since the previous report, levels
+    as gauges and histograms as their count and average over the same period,
+    with the max since the writer started.
+    """
+    def __init__(self, client, prefix='datadog.tracer.'):
+        self.client = client
+        self.prefix = prefix
+        self._last = {}
+
+    def report(self, stats):
+        for name, value in iteritems(stats):
+            metric = self.prefix + name
+            if isinstance(value, dict):
+                last = self._last.get(name, {'count': 0, 'sum': 0})
+                count = value['count'] - last['count']
+                if count:
+                    self.client.increment(metric + '.count', count)
+                    self.client.gauge(metric + '.avg', (value['sum'] - last['sum']) / float(count))
+                    self.client.gauge(metric + '.max', value['max'])
+            elif name.startswith('queue.') or name.startswith('spool.') or name.startswith('spill.'):
+                # current levels
+                self.client.gauge(metric, value)
+            else:
+                delta = value - self._last.get(name, 0)
+                if delta:
+                    self.client.increment(metric, delta)
+            self._last[name] = value
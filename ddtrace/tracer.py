@@ -7,7 +7,8 @@ from .provider import DefaultContextProvider
 from .context import Context
 from .sampler import AllSampler, RateSampler, RateByServiceSampler
 from .writer import AgentWriter
-from .span import Span
+from .span import NoopSpan, Span, TagLayer
+from .pool import SpanPool, SUPPORTED as SPAN_POOL_SUPPORTED
 from .constants import FILTERS_KEY, SAMPLE_RATE_METRIC_KEY
 from . import compat
 from .ext.priority import AUTO_REJECT, AUTO_KEEP
@@ -37,6 +38,9 @@ class Tracer(object):
         """
         self.sampler = None
         self.priority_sampler = None
+        self._span_pool = None
+        self._partial_flush_min_spans = None
+        self._max_spans_per_trace = None
 
         # Apply the default configuration
         self.configure(
@@ -50,8 +54,9 @@ class Tracer(object):
         # A hook for local debugging. shouldn't be needed or used in production
         self.debug_logging = False
 
-        # globally set tags
+        # globally set tags, and their TagLayer shared by the spans
         self.tags = {}
+        self._tags_layer = None
 
         # a buffer for service info so we dont' perpetually send the same things
         self._services = {}
@@ -81,7 +86,8 @@ class Tracer(object):
 
     def configure(self, enabled=None, hostname=None, port=None, sampler=None,
                   context_provider=None, wrap_executor=None, priority_sampling=None,
-                  settings=None):
+                  settings=None, uds_path=None, recycle_spans=None, partial_flush_min_spans=None,
+                  max_spans_per_trace=None):
         """
         Configure an existing Tracer the easy way.
         Allow to configure or reconfigure a Tracer instance.
@@ -99,6 +105,17 @@ class Tracer(object):
             from the default value
         :param priority_sampling: enable priority sampling, this is required for
             complete distributed tracing support.
+        :param str uds_path: path of the Unix Domain Socket of the Trace Agent, as a
+            file path or as an URL like ``unix:///var/run/datadog/apm.socket``. When set,
+            it's used instead of ``hostname`` and ``port``
+        :param bool recycle_spans: reuse the spans once they are encoded by the writer,
+            rather than allocating new ones (see ``ddtrace.pool``). Only available on CPython
+        :param int partial_flush_min_spans: send the finished spans of a trace to the writer
+            as soon as there are this many of them, rather than when the whole trace is
+            finished; 0 to disable it
+        :param int max_spans_per_trace: the maximum number of spans of a trace. Past it, new
+            child spans are ``NoopSpan`` instances that are only counted, by name and service,
+            in the metrics of the root span; 0 to disable it
         """
         if enabled is not None:
             self.enabled = enabled
@@ -114,18 +131,21 @@ class Tracer(object):
             self.priority_sampler = RateByServiceSampler()
 
         if hostname is not None or port is not None or filters is not None or \
-                priority_sampling is not None:
-            # Preserve hostname and port when overriding filters or priority sampling
+                priority_sampling is not None or uds_path is not None:
+            # Preserve hostname, port and socket path when overriding filters or priority sampling
             default_hostname = self.DEFAULT_HOSTNAME
             default_port = self.DEFAULT_PORT
+            default_uds_path = None
             if hasattr(self, 'writer') and hasattr(self.writer, 'api'):
                 default_hostname = self.writer.api.hostname
                 default_port = self.writer.api.port
+                default_uds_path = getattr(self.writer.api, 'uds_path', None)
             self.writer = AgentWriter(
                 hostname or default_hostname,
                 port or default_port,
                 filters=filters,
                 priority_sampler=self.priority_sampler,
+                uds_path=uds_path or default_uds_path,
             )
 
         if context_provider is not None:
@@ -134,6 +154,15 @@ class Tracer(object):
         if wrap_executor is not None:
             self._wrap_executor = wrap_executor
 
+        if partial_flush_min_spans is not None:
+            self._partial_flush_min_spans = partial_flush_min_spans or None
+
+        if max_spans_per_trace is not None:
+            self._max_spans_per_trace = max_spans_per_trace or None
+
+        if recycle_spans is not None:
+            self._span_pool = SpanPool() if recycle_spans and SPAN_POOL_SUPPORTED else None
+
     def start_span(self, name, child_of=None, service=None, resource=None, span_type=None):
         """
         Return a span that will trace an operation called `name`. This method allows
@@ -176,6 +205,22 @@ class Tracer(object):
             trace_id = context.trace_id
             parent_span_id = context.span_id
 
+        if self._max_spans_per_trace and parent and context._span_count() >= self._max_spans_per_trace:
+            # the trace is too large: the span is only counted, and has the
+            # ids of its parent so that its children are attached to it
+            return NoopSpan(
+                self,
+                name,
+                trace_id=trace_id,
+                span_id=parent_span_id,
+                parent_id=parent.parent_id,
+                service=service or parent.service,
+                resource=resource,
+                span_type=span_type,
+                context=context,
+            )
+
+        new_span = Span if self._span_pool is None else self._span_pool.acquire
         if trace_id:
             # child_of a non-empty context, so either a local child span or from a remote context
 
@@ -183,7 +228,7 @@ class Tracer(object):
             if parent:
                 service = service or parent.service
 
-            span = Span(
+            span = new_span(
                 self,
                 name,
                 trace_id=trace_id,
@@ -200,7 +245,7 @@ class Tracer(object):
 
         else:
             # this is the root span of a new trace
-            span = Span(
+            span = new_span(
                 self,
                 name,
                 service=service,
@@ -230,7 +275,10 @@ class Tracer(object):
 
         # add common tags
         if self.tags:
-            span.set_tags(self.tags)
+            layer = self._tags_layer = TagLayer.get(self._tags_layer, self.tags)
+            span._add_tag_layer(layer)
+            if not span._parent:
+                span._trace_tags = layer
         if not span._parent:
             span.set_tag(system.PID, getpid())
 
@@ -309,10 +357,14 @@ class Tracer(object):
 
     def record(self, context):
         """
-        Record the given ``Context`` if it's finished.
+        Record the given ``Context`` if it's finished, or its finished spans
+        if partial flush is enabled and there are enough of them.
         """
         # extract and enqueue the trace if it's sampled
         trace, sampled = context.get()
+        if trace is None and self._partial_flush_min_spans:
+            # or the finished spans of a long trace
+            trace, sampled = context.get_partial(self._partial_flush_min_spans)
         if trace and sampled:
             self.write(trace)
 
@@ -350,16 +402,10 @@ class Tracer(object):
             if self.debug_logging:
                 log.debug("set_service_info: service:%s app:%s type:%s", service, app, app_type)
 
-            # If we had changes, send them to the writer.
+            # If we had changes, send them to the writer: only the changed
+            # service is queued, the writer merges the changes until it flushes
             if self.enabled and self.writer:
-
-                # translate to the form the server understands.
-                services = {}
-                for service, app, app_type in self._services.values():
-                    services[service] = {"app" : app, "app_type" : app_type}
-
-                # queue them for writes.
-                self.writer.write(services=services)
+                self.writer.write(services={service: {"app": app, "app_type": app_type}})
         except Exception:
             log.debug("error setting service info", exc_info=True)
 
@@ -0,0 +1,52 @@
+"""
+Generation of the random 64 bits trace and span ids.
+
+Ids are unpacked in batches from ``os.urandom()`` bytes rather than drawn one
+at a time from the global ``random`` generator, whose state is copied by
+``fork()``: forked processes could generate the same ids as their parent.
+The buffer of ids is shared by the threads, ``list.pop()`` being atomic, and
+it's emptied after a fork so that the ids of a process are never reused by
+its children.
+"""
+import os
+import struct
+
+
+# number of ids unpacked at once
+BATCH_SIZE = 512
+
+_unpack = struct.Struct('<{}Q'.format(BATCH_SIZE)).unpack
+
+_ids = []
+_pid = os.getpid()
+
+# without fork hooks, the pid is checked on every call
+AT_FORK = hasattr(os, 'register_at_fork')
+
+
+def new_id():
+    """Return a random 64 bits id."""
+    if not AT_FORK:
+        _check_pid()
+    try:
+        return _ids.pop()
+    except IndexError:
+        # any thread can refill the buffer, ids are never given twice
+        _ids.extend(_unpack(os.urandom(8 * BATCH_SIZE)))
+        return new_id()
+
+
+def _check_pid():
+    global _pid
+    pid = os.getpid()
+    if pid != _pid:
+        _pid = pid
+        _reset_after_fork()
+
+
+def _reset_after_fork():
+    del _ids[:]
+
+
+if AT_FORK:
+    os.register_at_fork(after_in_child=_reset_after_fork)
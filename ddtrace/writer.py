@@ -1,93 +1,368 @@
 
 # stdlib
 import atexit
+import collections
+import functools
 import logging
 import threading
-import random
 import os
+import random
 import time
+import weakref
 
 from ddtrace import api
+from ddtrace.pool import release_traces
+from ddtrace.spill import open_spill_file
+from ddtrace.stats import StatsReporter, WriterStats
 
 from .api import _parse_response_json
+from .compat import stringify
+from .constants import SAMPLING_PRIORITY_KEY
+from .ext.priority import AUTO_KEEP
 
 log = logging.getLogger(__name__)
 
 
 MAX_TRACES = 1000
+MAX_TRACES_BYTES = 8 << 20
 MAX_SERVICES = 1000
 
+# policies applied when a trace doesn't fit in the queue
+DROP_NEWEST = 'drop_newest'
+DROP_OLDEST = 'drop_oldest'
+DROP_BY_PRIORITY = 'priority'
+
+# the worker flushes as soon as one of these thresholds is reached, or when
+# the oldest queued trace is older than the flush interval
+FLUSH_INTERVAL = 1
+FLUSH_SIZE = 500
+FLUSH_BYTES = 1 << 20
+
+# rough encoded size of the fixed span fields (ids, timestamps and keys)
+SPAN_OVERHEAD = 128
+# rough encoded size of a tag value that isn't converted to a string yet
+TAG_VALUE_SIZE = 16
+
+# payloads that can't be delivered are kept in a spool and retried with an
+# exponential backoff, at most MAX_RETRIES times each
+SPOOL_BYTES = 8 << 20
+MAX_RETRIES = 10
+RETRY_BACKOFF_BASE = 0.5
+RETRY_BACKOFF_MAX = 30
+
+# size of the file where payloads are spilled, when enabled, and how many of
+# them are sent again each time the worker wakes up
+SPILL_SIZE = 64 << 20
+SPILL_REPLAY_BATCH = 16
+
+# interval between two reports of the writer stats, when enabled
+STATS_INTERVAL = 10
+
 DEFAULT_TIMEOUT = 5
 LOG_ERR_INTERVAL = 60
 
 
+# writers that must be reset in the child when the process is forked
+_writers = weakref.WeakSet()
+
+
+def _reset_writers_after_fork():
+    for writer in list(_writers):
+        writer._after_fork()
+
+
+def _unset_worker(writer_ref, worker):
+    # called by a worker that exits, so that the next write starts a new one;
+    # the worker only has a weak reference to its writer
+    writer = writer_ref()
+    if writer is not None and writer._worker is worker:
+        writer._worker = None
+
+
+# where forks can be tracked, the writer doesn't need to check the pid on
+# every write to detect them
+AT_FORK = hasattr(os, 'register_at_fork')
+if AT_FORK:
+    os.register_at_fork(after_in_child=_reset_writers_after_fork)
+
+
 class AgentWriter(object):
+    _api_class = api.API
 
-    def __init__(self, hostname='localhost', port=8126, filters=None, priority_sampler=None):
+    def __init__(self, hostname='localhost', port=8126, filters=None, priority_sampler=None,
+                 flush_interval=FLUSH_INTERVAL, flush_size=FLUSH_SIZE, flush_bytes=FLUSH_BYTES,
+                 max_bytes=MAX_TRACES_BYTES, drop_policy=DROP_BY_PRIORITY, encode_on_write=False,
+                 uds_path=None, max_payload_size=api.MAX_PAYLOAD_SIZE, spool_bytes=SPOOL_BYTES,
+                 max_retries=MAX_RETRIES, spill_path=None, spill_size=SPILL_SIZE, stats_client=None,
+                 stats_interval=STATS_INTERVAL, encoder=None):
         self._pid = None
         self._traces = None
         self._services = None
         self._worker = None
         self._filters = filters
         self._priority_sampler = priority_sampler
+        self._flush_interval = flush_interval
+        self._flush_size = flush_size
+        self._flush_bytes = flush_bytes
+        self._max_bytes = max_bytes
+        self._drop_policy = drop_policy
+        self._encode_on_write = encode_on_write
+        self._spool_bytes = spool_bytes
+        self._max_retries = max_retries
+        self._spill_path = spill_path
+        self._spill_size = spill_size
+        self._spill = None
+        self._stats = WriterStats(self._new_lock())
+        self._stats_client = stats_client
+        self._stats_reporter = None
+        self._stats_interval = stats_interval
+        self._encoder = encoder
         priority_sampling = priority_sampler is not None
-        self.api = api.API(hostname, port, priority_sampling=priority_sampling)
+        self.api = self._api_class(
+            hostname,
+            port,
+            priority_sampling=priority_sampling,
+            uds_path=uds_path,
+            max_payload_size=max_payload_size,
+            encoder=encoder,
+        )
+        self._at_fork = AT_FORK
+        _writers.add(self)
 
     def write(self, spans=None, services=None):
-        # if the worker needs to be reset, do it.
-        self._reset_worker()
+        # if the worker needs to be reset, do it. When forks are tracked the
+        # pid doesn't need to be checked, and a worker that exits unsets itself
+        if not self._at_fork or self._worker is None:
+            self._reset_worker()
 
         if spans:
-            self._traces.add(spans)
+            # in encode on write mode, traces already encoded are queued as they are
+            if self._encode_on_write and not isinstance(spans, EncodedTrace):
+                spans = self._encode_trace(spans)
+            if spans:
+                self._traces.add(spans)
 
         if services:
             self._services.add(services)
 
+    def _encode_trace(self, spans):
+        """
+        Filter and encode the trace in the caller thread, so that the spans are
+        released right away and the queue only holds the encoded bytes.
+        """
+        try:
+            spans = _apply_filters(self._filters, [spans])
+        except Exception as err:
+            log.error("error while filtering traces:{0}".format(err))
+            spans = [spans]
+        if not spans:
+            return None
+
+        trace = spans[0]
+        try:
+            start = time.time()
+            data = self.api.encode_trace(trace)
+            self._stats.record('encode.duration', time.time() - start)
+            encoded = EncodedTrace(data, len(trace), _trace_priority(trace))
+            release_traces(spans)
+            return encoded
+        except Exception:
+            log.debug("error encoding trace", exc_info=True)
+
+    @property
+    def dropped_traces(self):
+        """Number of traces dropped because the queue was full."""
+        return self._traces.dropped if self._traces else 0
+
+    @property
+    def dropped_spans(self):
+        """Number of spans dropped because the queue was full."""
+        return self._traces.dropped_spans if self._traces else 0
+
+    def _settings(self):
+        """Return the arguments to build a writer with the same settings."""
+        return dict(
+            hostname=self.api.hostname,
+            port=self.api.port,
+            filters=self._filters,
+            priority_sampler=self._priority_sampler,
+            flush_interval=self._flush_interval,
+            flush_size=self._flush_size,
+            flush_bytes=self._flush_bytes,
+            max_bytes=self._max_bytes,
+            drop_policy=self._drop_policy,
+            encode_on_write=self._encode_on_write,
+            uds_path=self.api.uds_path,
+            max_payload_size=self.api.max_payload_size,
+            spool_bytes=self._spool_bytes,
+            max_retries=self._max_retries,
+            spill_path=self._spill_path,
+            spill_size=self._spill_size,
+            stats_client=self._stats_client,
+            stats_interval=self._stats_interval,
+            encoder=self._encoder,
+        )
+
+    def stats(self):
+        """
+        Return the writer stats of this process as a dictionary. Counters are:
+
+        - ``traces.enqueued``, ``spans.enqueued``: added to the queue
+        - ``traces.dropped``, ``spans.dropped``: dropped because the queue was
+          full, and traces dropped because they could not be sent
+        - ``traces.sent``, ``spans.sent``, ``payloads.sent``: accepted by the agent
+        - ``flushes.chunked``: flushes split in several payloads, to keep them
+          under ``max_payload_size``
+        - ``http.status.<status>``, ``http.errors``: responses of the agent and
+          failed requests
+        - ``traces.forwarded``: handed to a ``TraceForwarder`` by a
+          ``ForwarderWriter``
+
+        Histograms, as dictionaries of ``count``, ``sum``, ``min``, ``max`` and
+        ``buckets``, are ``encode.duration`` and ``http.duration`` in seconds
+        and ``payload.bytes``. The current levels are ``queue.traces``,
+        ``queue.bytes``, ``spool.traces``, ``spool.bytes`` and ``spill.bytes``.
+        """
+        stats = self._stats.snapshot()
+        stats.setdefault('traces.dropped', 0)
+        traces, worker = self._traces, self._worker
+        if traces is not None:
+            stats['traces.enqueued'] = traces.added
+            stats['spans.enqueued'] = traces.added_spans
+            stats['traces.dropped'] += traces.dropped
+            stats['spans.dropped'] = traces.dropped_spans
+            stats['queue.traces'] = len(traces._things)
+            stats['queue.bytes'] = traces._bytes
+        spool = getattr(worker, '_spool', None)
+        if spool is not None:
+            stats['traces.dropped'] += spool.dropped
+            stats['spool.traces'] = spool.traces
+            stats['spool.bytes'] = spool.bytes
+        if self._spill is not None:
+            stats['traces.dropped'] += self._spill.dropped
+            stats['spill.bytes'] = len(self._spill)
+        return stats
+
+    def _report_stats(self):
+        self._stats_reporter.report(self.stats())
+
+    def _after_fork(self):
+        """
+        Called in the child process after a fork: the queues and the worker
+        are rebuilt on the next write, the HTTP connection when it's needed.
+        """
+        self._pid = None
+        self._worker = None
+        self._traces = None
+        self._services = None
+        self.api._close_connection()
+
+    def _new_condition(self):
+        """Return the condition of the queues, or None to use the default one."""
+        return None
+
+    def _new_lock(self):
+        """Return a lock shared by the application threads and the worker."""
+        return threading.Lock()
+
+    def _new_worker(self, *args, **kwargs):
+        return AsyncWorker(*args, **kwargs)
+
     def _reset_worker(self):
         # if this queue was created in a different process (i.e. this was
         # forked) reset everything so that we can safely work from it.
         pid = os.getpid()
         if self._pid != pid:
             log.debug("resetting queues. pids(old:%s new:%s)", self._pid, pid)
-            self._traces = Q(max_size=MAX_TRACES)
-            self._services = Q(max_size=MAX_SERVICES)
+            trace_queue_cls = EncodedTraceQ if self._encode_on_write else TraceQ
+            self._traces = trace_queue_cls(
+                max_size=MAX_TRACES,
+                max_bytes=self._max_bytes,
+                policy=self._drop_policy,
+                flush_size=self._flush_size,
+                flush_bytes=self._flush_bytes,
+                max_age=self._flush_interval,
+                condition=self._new_condition(),
+            )
+            # services share the traces condition so that the worker waiting
+            # on the traces queue is woken up when new services are added
+            self._services = ServiceQ(
+                flush_size=1,
+                condition=self._traces.condition,
+            )
+            # the file is locked by the process that opened it, so a forked
+            # process can't use its parent spill file
+            if self._spill_path:
+                self._spill = open_spill_file(self._spill_path, self._spill_size)
+            # stats are the ones of the process
+            self._stats = WriterStats(self._new_lock())
+            if self._stats_client is not None:
+                self._stats_reporter = StatsReporter(self._stats_client)
             self._worker = None
             self._pid = pid
 
         # ensure we have an active thread working on this queue
         if not self._worker or not self._worker.is_alive():
-            self._worker = AsyncWorker(
+            self._worker = self._new_worker(
                 self.api,
                 self._traces,
                 self._services,
-                filters=self._filters,
+                # filters are already applied when traces are encoded on write
+                filters=None if self._encode_on_write else self._filters,
                 priority_sampler=self._priority_sampler,
+                spool_bytes=self._spool_bytes,
+                max_retries=self._max_retries,
+                spill=self._spill,
+                stats=self._stats,
+                report_stats=self._report_stats if self._stats_reporter else None,
+                stats_interval=self._stats_interval,
+                on_exit=functools.partial(_unset_worker, weakref.ref(self)),
             )
 
 
 class AsyncWorker(object):
 
     def __init__(self, api, trace_queue, service_queue, shutdown_timeout=DEFAULT_TIMEOUT,
-                 filters=None, priority_sampler=None):
+                 filters=None, priority_sampler=None, spool_bytes=SPOOL_BYTES, max_retries=MAX_RETRIES,
+                 backoff_base=RETRY_BACKOFF_BASE, backoff_max=RETRY_BACKOFF_MAX, spill=None, stats=None,
+                 report_stats=None, stats_interval=STATS_INTERVAL, on_exit=None):
         self._trace_queue = trace_queue
         self._service_queue = service_queue
-        self._lock = threading.Lock()
+        self._lock = self._new_lock()
         self._thread = None
         self._shutdown_timeout = shutdown_timeout
         self._filters = filters
         self._priority_sampler = priority_sampler
         self._last_error_ts = 0
+        self._last_dropped = (0, 0)
+        self._last_dropped_ts = 0
+        self._spill = spill
+        self._spool = Spool(spool_bytes, overflow=self._spill_payload if spill is not None else None)
+        self._max_retries = max_retries
+        self._backoff_base = backoff_base
+        self._backoff_max = backoff_max
+        self._failures = 0
+        self._service_failures = 0
+        self._retry_at = None
+        self._stats = stats or WriterStats()
+        self._report_stats = report_stats
+        self._stats_interval = stats_interval
+        self._stats_reported_at = time.time()
+        self._on_exit = on_exit
         self.api = api
         self.start()
 
     def is_alive(self):
         return self._thread.is_alive()
 
+    def _new_lock(self):
+        return threading.Lock()
+
     def start(self):
         with self._lock:
             if not self._thread:
                 log.debug("starting flush thread")
-                self._thread = threading.Thread(target=self._target)
+                self._thread = threading.Thread(target=self._run)
                 self._thread.setDaemon(True)
                 self._thread.start()
                 atexit.register(self._on_shutdown)
@@ -112,8 +387,8 @@ class AsyncWorker(object):
             if not self._thread:
                 return
 
-            # wait for in-flight queues to get traced.
-            time.sleep(0.1)
+            # closing the queue wakes up the worker, that drains what is left
+            # and exits; we only have to wait for it
             self._trace_queue.close()
 
             size = self._trace_queue.size()
@@ -121,16 +396,47 @@ class AsyncWorker(object):
                 key = "ctrl-break" if os.name == 'nt' else 'ctrl-c'
                 log.debug("Waiting %ss for traces to be sent. Hit %s to quit.",
                         self._shutdown_timeout, key)
-                timeout = time.time() + self._shutdown_timeout
-                while time.time() < timeout and self._trace_queue.size():
-                    # FIXME[matt] replace with a queue join
-                    time.sleep(0.05)
+            self._thread.join(self._shutdown_timeout)
+
+    def _run(self):
+        try:
+            self._target()
+        finally:
+            if self._on_exit is not None:
+                self._on_exit(self)
 
     def _target(self):
         result_traces = None
         result_services = None
 
         while True:
+            # block until there is enough to send, the oldest trace expires,
+            # spooled payloads must be retried or the queue is closed
+            if self._retry_at is not None:
+                retry_in = max(0, self._retry_at - time.time())
+            elif self._spill:
+                # the agent is available: don't wait to send spilled payloads
+                retry_in = 0
+            else:
+                retry_in = None
+            if self._service_queue.retry_at is not None:
+                services_in = max(0, self._service_queue.retry_at - time.time())
+                retry_in = services_in if retry_in is None else min(retry_in, services_in)
+            if self._report_stats:
+                report_in = max(0, self._stats_reported_at + self._stats_interval - time.time())
+                retry_in = report_in if retry_in is None else min(retry_in, report_in)
+            self._trace_queue.wait(timeout=retry_in, others=(self._service_queue,))
+
+            if self._retry_at is not None and self._retry_at <= time.time():
+                if self._spool:
+                    try:
+                        result_traces = self._retry_spooled()
+                    except Exception:
+                        log.error("cannot retry the spooled payloads", exc_info=True)
+                else:
+                    # the backoff is over: spilled payloads can be sent
+                    self._retry_at = None
+
             traces = self._trace_queue.pop()
             if traces:
                 # Before sending the traces, make them go through the
@@ -142,19 +448,40 @@ class AsyncWorker(object):
             if traces:
                 # If we have data, let's try to send it.
                 try:
-                    result_traces = self.api.send_traces(traces)
+                    result_traces = self._send_traces(traces) or result_traces
                 except Exception as err:
-                    log.error("cannot send spans to {1}:{2}: {0}".format(err, self.api.hostname, self.api.port))
+                    log.error("cannot send spans to {1}: {0}".format(err, self.api.url))
+
+            if self._spill and self._retry_at is None and not self._spool:
+                try:
+                    result_traces = self._replay_spilled() or result_traces
+                except Exception:
+                    log.error("cannot replay the spilled payloads", exc_info=True)
+                    # don't try again right away
+                    self._retry_at = time.time() + self._backoff_max
 
             services = self._service_queue.pop()
             if services:
                 try:
                     result_services = self.api.send_services(services)
                 except Exception as err:
-                    log.error("cannot send services to {1}:{2}: {0}".format(err, self.api.hostname, self.api.port))
+                    log.error("cannot send services to {1}: {0}".format(err, self.api.url))
+                    self._requeue_services(services)
+                else:
+                    status = getattr(result_services, 'status', None)
+                    if status is not None and not 200 <= status < 300:
+                        self._requeue_services(services)
+                    else:
+                        self._service_failures = 0
 
             if self._trace_queue.closed() and self._trace_queue.size() == 0:
-                # no traces and the queue is closed. our work is done
+                # no traces and the queue is closed. our work is done, once
+                # spooled payloads get a last chance to be sent
+                try:
+                    self._flush_spool()
+                except Exception:
+                    log.error("cannot flush the spooled payloads", exc_info=True)
+                self._send_stats()
                 return
 
             if self._priority_sampler:
@@ -166,8 +493,162 @@ class AsyncWorker(object):
             result_traces = None
             self._log_error_status(result_services, "services")
             result_services = None
+            self._log_dropped()
+            if self._report_stats and time.time() >= self._stats_reported_at + self._stats_interval:
+                self._send_stats()
+
+    def _send_stats(self):
+        if not self._report_stats:
+            return
+        self._stats_reported_at = time.time()
+        try:
+            self._report_stats()
+        except Exception:
+            log.debug("cannot report the writer stats", exc_info=True)
+
+    def _send_traces(self, traces):
+        start = time.time()
+        if isinstance(traces[0], EncodedTrace):
+            payloads = self.api.join_encoded_traces([trace.data for trace in traces])
+            spans = [trace.spans for trace in traces]
+        else:
+            payloads = self.api.encode_traces(traces)
+            spans = [len(trace) for trace in traces]
+            # the spans aren't needed anymore
+            release_traces(traces)
+        self._stats.record('encode.duration', time.time() - start)
+        if len(payloads) > 1:
+            self._stats.increment('flushes.chunked')
+
+        # payloads hold the traces in order
+        offset = 0
+        for payload in payloads:
+            payload.spans = sum(spans[offset:offset + payload.count])
+            offset += payload.count
+
+        response = None
+        for payload in payloads:
+            if self._retry_at is not None:
+                # the agent is failing: don't hammer it, the payload will be
+                # sent with the spooled ones
+                self._spool.add(payload)
+            else:
+                response = api._first_error(response, self._send_payload(payload, 0))
+        return response
+
+    def _send_payload(self, payload, attempts):
+        """
+        Send the payload; if it fails because the agent is not available, the
+        payload is spooled to be retried later. Returns the agent response, if any.
+        """
+        if payload.content_type != self.api.content_type:
+            log.error("dropping %d traces encoded as %s, not supported by the trace agent",
+                      payload.count, payload.content_type)
+            self._stats.increment('traces.dropped', payload.count)
+            return None
+
+        try:
+            response = self.api.send_payload(payload)
+        except Exception as err:
+            log.debug("cannot send %d traces to %s: %s", payload.count, self.api.url, err)
+            self._stats.increment('http.errors')
+            response = None
+        else:
+            self._record_response(payload, response)
+            if not _is_retryable(response):
+                self._failures = 0
+                self._retry_at = None
+                return response
+
+        if attempts < self._max_retries:
+            self._spool.add(payload, attempts + 1)
+        elif self._spill is not None:
+            self._spill_payload(payload)
+        else:
+            log.error("dropping %d traces that could not be sent to %s after %d attempts",
+                      payload.count, self.api.url, attempts + 1)
+            self._stats.increment('traces.dropped', payload.count)
+        self._failures += 1
+        self._retry_at = time.time() + self._backoff(self._failures)
+        return response
+
+    def _requeue_services(self, services):
+        """Queue the services that could not be sent again, after a backoff."""
+        self._service_failures += 1
+        self._service_queue.requeue(services, time.time() + self._backoff(self._service_failures))
+
+    def _record_response(self, payload, response):
+        status = getattr(response, 'status', None)
+        self._stats.increment('http.status.{}'.format(status))
+        duration = getattr(response, 'duration', None)
+        if duration is not None:
+            self._stats.record('http.duration', duration)
+        if status is not None and 200 <= status < 300:
+            self._stats.increment('payloads.sent')
+            self._stats.increment('traces.sent', payload.count)
+            self._stats.increment('spans.sent', payload.spans or 0)
+            self._stats.record('payload.bytes', len(payload.data))
 
-            time.sleep(1)  # replace with a blocking pop.
+    def _retry_spooled(self):
+        """
+        Send spooled payloads, oldest first, stopping at the first failure.
+        """
+        log.debug("retrying %d spooled payloads", len(self._spool))
+        response = None
+        self._retry_at = None
+        while self._spool and self._retry_at is None:
+            payload, attempts = self._spool.pop()
+            response = self._send_payload(payload, attempts) or response
+        return response
+
+    def _replay_spilled(self):
+        """
+        Send a batch of the payloads spilled to disk, oldest first. The ones
+        that fail again are spooled like new payloads.
+        """
+        response = None
+        for _ in range(SPILL_REPLAY_BATCH):
+            if not self._spill or self._retry_at is not None:
+                break
+            payload = self._spill.pop()
+            response = self._send_payload(payload, 0) or response
+        return response
+
+    def _spill_payload(self, payload):
+        if not self._spill.append(payload):
+            log.error("dropping %d traces larger than the spill file %s", payload.count, self._spill.path)
+
+    def _flush_spool(self):
+        """
+        Last attempt to send spooled payloads on shutdown, without waiting for
+        the backoff; what can't be sent is spilled to disk or dropped.
+        """
+        while self._spool:
+            payload, _ = self._spool.pop()
+            if payload.content_type != self.api.content_type:
+                continue
+            try:
+                if not _is_retryable(self.api.send_payload(payload)):
+                    continue
+            except Exception:
+                pass
+
+            if self._spill is not None:
+                self._spill_payload(payload)
+                while self._spool:
+                    self._spill_payload(self._spool.pop()[0])
+            else:
+                log.warning("dropping %d traces that could not be sent to %s",
+                            payload.count + self._spool.traces, self.api.url)
+            return
+
+    def _backoff(self, failures):
+        """
+        Exponential backoff with jitter: half of the delay is fixed and half is
+        random, so that hosts restarted together don't retry at the same time.
+        """
+        delay = min(self._backoff_max, self._backoff_base * 2 ** min(failures - 1, 32))
+        return delay / 2 + random.uniform(0, delay / 2)
 
     def _log_error_status(self, result, result_name):
         log_level = log.debug
@@ -180,35 +661,115 @@ class AsyncWorker(object):
                       getattr(result, "status", None), getattr(result, "reason", None),
                       getattr(result, "msg", None))
 
+    def _log_dropped(self):
+        dropped = (self._trace_queue.dropped, self._trace_queue.dropped_spans)
+        if dropped == self._last_dropped:
+            return
+        now = time.time()
+        if now > self._last_dropped_ts + LOG_ERR_INTERVAL:
+            log.warning("dropped %d traces (%d spans) because the queue was full",
+                        dropped[0] - self._last_dropped[0], dropped[1] - self._last_dropped[1])
+            self._last_dropped = dropped
+            self._last_dropped_ts = now
+
     def _apply_filters(self, traces):
         """
         Here we make each trace go through the filters configured in the
         tracer. There is no need for a lock since the traces are owned by the
         AsyncWorker at that point.
         """
-        if self._filters is not None:
-            filtered_traces = []
-            for trace in traces:
-                for filtr in self._filters:
-                    trace = filtr.process_trace(trace)
-                    if trace is None:
-                        break
-                if trace is not None:
-                    filtered_traces.append(trace)
-            return filtered_traces
+        return _apply_filters(self._filters, traces)
+
+
+def _apply_filters(filters, traces):
+    """
+    Make each trace go through the given filters, returning the traces that
+    have not been discarded.
+    """
+    if not filters:
         return traces
+    process_trace = [filtr.process_trace for filtr in filters]
+    filtered_traces = []
+    for trace in traces:
+        for process in process_trace:
+            trace = process(trace)
+            if trace is None:
+                break
+        if trace is not None:
+            filtered_traces.append(trace)
+    return filtered_traces
+
+
+def _is_retryable(response):
+    """Return if the request must be retried, given the agent response."""
+    status = getattr(response, 'status', None)
+    return status == 429 or (status is not None and status >= 500)
+
+
+def _trace_priority(trace):
+    """Return the sampling priority of the trace root span, defaulting to ``AUTO_KEEP``."""
+    priority = trace[0].get_metric(SAMPLING_PRIORITY_KEY) if trace else None
+    return AUTO_KEEP if priority is None else priority
+
+
+def estimate_trace_size(trace):
+    """
+    Return a cheap estimate of the encoded size of the given trace in bytes,
+    accounting for the span fields and tags that usually dominate the payload.
+    """
+    size = 0
+    for span in trace:
+        size += SPAN_OVERHEAD + len(span.name or '') + len(span.service or '') + len(span.resource or '')
+        for k, v in span._meta.items():
+            size += len(k) + (len(v) if type(v) is stringify else TAG_VALUE_SIZE)
+        if span._raw_tags:
+            # the values are only converted to strings when encoded
+            for k in span._raw_tags:
+                size += len(k) + TAG_VALUE_SIZE
+        size += 16 * len(span.metrics)
+    return size
 
 
 class Q(object):
     """
-    Q is a threadsafe queue that let's you pop everything at once and
-    will randomly overwrite elements when it's over the max size.
+    Q is a threadsafe queue that let's you pop everything at once. It's bounded
+    by the number of items (``max_size``) and by their size in bytes
+    (``max_bytes``); when an item doesn't fit, the ``policy`` decides what is
+    dropped:
+
+    * ``DROP_NEWEST``: the new item is dropped
+    * ``DROP_OLDEST``: the oldest items are dropped to make room
+    * ``DROP_BY_PRIORITY``: the items with the lowest priority are dropped,
+      starting from the oldest; the new item is dropped if its priority is
+      lower than everything in the queue
+
+    Dropped items are accounted in ``dropped`` and ``dropped_spans``.
+
+    Consumers can block on ``wait()`` until the queue is ready to be flushed:
+    that happens when it holds ``flush_size`` items or ``flush_bytes`` bytes,
+    when the oldest item is older than ``max_age`` seconds, or when the queue
+    is closed.
     """
-    def __init__(self, max_size=1000):
+    def __init__(self, max_size=1000, max_bytes=None, policy=DROP_NEWEST, flush_size=None,
+                 flush_bytes=None, max_age=None, condition=None):
         self._things = []
-        self._lock = threading.Lock()
+        self._sizes = []
+        self._priorities = []
+        self.condition = condition or threading.Condition(threading.Lock())
+        self._lock = self.condition
         self._max_size = max_size
+        self._max_bytes = max_bytes
+        self._policy = policy
+        self._flush_size = flush_size
+        self._flush_bytes = flush_bytes
+        self._max_age = max_age
+        self._bytes = 0
+        self._oldest = None
         self._closed = False
+        self.added = 0
+        self.added_spans = 0
+        self.dropped = 0
+        self.dropped_spans = 0
 
     def size(self):
         with self._lock:
@@ -217,22 +778,46 @@ class Q(object):
     def close(self):
         with self._lock:
             self._closed = True
+            self.condition.notify_all()
 
     def closed(self):
         with self._lock:
             return self._closed
 
     def add(self, thing):
+        size = self._size(thing)
+        priority = self._priority(thing) if self._policy == DROP_BY_PRIORITY else 0
         with self._lock:
             if self._closed:
                 return False
 
-            if len(self._things) < self._max_size or self._max_size <= 0:
-                self._things.append(thing)
-                return True
-            else:
-                idx = random.randrange(0, len(self._things))
-                self._things[idx] = thing
+            if self._max_bytes and size > self._max_bytes:
+                self._count_dropped(thing)
+                return False
+
+            while self._things and self._is_over_budget(size):
+                idx = self._drop_index(priority)
+                if idx is None:
+                    self._count_dropped(thing)
+                    return False
+                self._count_dropped(self._things.pop(idx))
+                self._bytes -= self._sizes.pop(idx)
+                self._priorities.pop(idx)
+
+            first = not self._things
+            if first:
+                self._oldest = time.time()
+            self.added += 1
+            self.added_spans += self._spans(thing)
+            self._things.append(thing)
+            self._sizes.append(size)
+            self._priorities.append(priority)
+            self._bytes += size
+
+            # the first item makes the consumer wait for its max age at most
+            if first or self._is_full():
+                self.condition.notify()
+            return True
 
     def pop(self):
         with self._lock:
@@ -240,4 +825,225 @@ class Q(object):
                 return None
             things = self._things
             self._things = []
+            self._sizes = []
+            self._priorities = []
+            self._bytes = 0
+            self._oldest = None
             return things
+
+    def wait(self, timeout=None, others=()):
+        """
+        Block until the queue is ready to be flushed or ``timeout`` seconds have
+        passed. Queues in ``others`` must share this queue condition; any of
+        them ready to be flushed makes the wait return.
+        """
+        end = None if timeout is None else time.time() + timeout
+        with self._lock:
+            # notifications are also sent for the first item, so that the
+            # wait is bounded by its max age
+            while not (self._closed or self._is_full() or any(q._is_full() for q in others)):
+                now = time.time()
+                wait_for = None if end is None else end - now
+                if self._oldest is not None and self._max_age is not None:
+                    expires_in = self._oldest + self._max_age - now
+                    if wait_for is None or expires_in < wait_for:
+                        wait_for = expires_in
+                if wait_for is not None and wait_for <= 0:
+                    return
+                self.condition.wait(wait_for)
+
+    def _size(self, thing):
+        """Return the size in bytes of the given item."""
+        return 0
+
+    def _priority(self, thing):
+        """Return the priority of the given item; higher priorities are dropped last."""
+        return 0
+
+    def _spans(self, thing):
+        """Return the number of spans in the given item."""
+        return 0
+
+    def _is_over_budget(self, size):
+        """
+        Internal method that checks if an item of the given size fits in the queue.
+        Must be called with the lock held.
+        """
+        if self._max_size > 0 and len(self._things) >= self._max_size:
+            return True
+        return bool(self._max_bytes) and self._bytes + size > self._max_bytes
+
+    def _drop_index(self, priority):
+        """
+        Internal method that returns the index of the item to drop according to the
+        policy, or None if the new item must be dropped. Must be called with the lock held.
+        """
+        if self._policy == DROP_OLDEST:
+            return 0
+        if self._policy == DROP_BY_PRIORITY:
+            lowest = min(self._priorities)
+            if priority < lowest:
+                return None
+            return self._priorities.index(lowest)
+        return None
+
+    def _count_dropped(self, thing):
+        self.dropped += 1
+        self.dropped_spans += self._spans(thing)
+
+    def _is_full(self):
+        """
+        Internal method that checks if one of the flush thresholds has been reached.
+        Must be called with the lock held.
+        """
+        if self._flush_size and len(self._things) >= self._flush_size:
+            return True
+        return bool(self._flush_bytes) and self._bytes >= self._flush_bytes
+
+
+class TraceQ(Q):
+    """
+    Q of traces, where the size of each trace is its estimated encoded size and
+    its priority is the sampling priority of the root span.
+    """
+    def _size(self, trace):
+        return estimate_trace_size(trace)
+
+    def _priority(self, trace):
+        return _trace_priority(trace)
+
+    def _spans(self, trace):
+        return len(trace)
+
+
+class ServiceQ(Q):
+    """
+    Q of services, where the changes are merged in a single dictionary until
+    it's popped: the latest info of each service wins and the queue never
+    holds more than one item.
+
+    Services that could not be sent are requeued with ``requeue()``: they
+    aren't popped again before their retry time.
+    """
+    def __init__(self, *args, **kwargs):
+        super(ServiceQ, self).__init__(*args, **kwargs)
+        self.retry_at = None
+
+    def add(self, services):
+        with self._lock:
+            if self._closed:
+                return False
+            if self._things:
+                self._things[0].update(services)
+            else:
+                self._oldest = time.time()
+                self._things.append(dict(services))
+                self._sizes.append(0)
+                self._priorities.append(0)
+            self.added += 1
+
+            if self._is_full():
+                self.condition.notify()
+            return True
+
+    def requeue(self, things, retry_at=None):
+        """
+        Merge back the popped ``things``: the services added since then win.
+        They are popped again once ``retry_at`` is passed, if given.
+        """
+        with self._lock:
+            merged = {}
+            for services in things:
+                merged.update(services)
+            if self._things:
+                merged.update(self._things[0])
+                self._things[0] = merged
+            else:
+                self._oldest = time.time()
+                self._things.append(merged)
+                self._sizes.append(0)
+                self._priorities.append(0)
+            self.retry_at = retry_at
+
+    def pop(self):
+        with self._lock:
+            if self._is_retry_pending():
+                return None
+            self.retry_at = None
+        return super(ServiceQ, self).pop()
+
+    def _is_retry_pending(self):
+        return self.retry_at is not None and time.time() < self.retry_at
+
+    def _is_full(self):
+        return not self._is_retry_pending() and super(ServiceQ, self)._is_full()
+
+
+class Spool(object):
+    """
+    FIFO of payloads waiting to be sent again, bounded by the total size of
+    their data: when it's full, the oldest payloads are dropped, or given to
+    the `overflow` function if any. It's owned by the worker thread so it
+    doesn't need a lock.
+    """
+    def __init__(self, max_bytes, overflow=None):
+        self._payloads = collections.deque()
+        self._max_bytes = max_bytes
+        self._overflow = overflow
+        self.bytes = 0
+        self.traces = 0
+        self.dropped = 0
+
+    def __len__(self):
+        return len(self._payloads)
+
+    def add(self, payload, attempts=0):
+        size = len(payload.data)
+        if size > self._max_bytes:
+            self._drop(payload)
+            return
+        while self._payloads and self.bytes + size > self._max_bytes:
+            self._drop(self.pop()[0])
+        self._payloads.append((payload, attempts))
+        self.bytes += size
+        self.traces += payload.count
+
+    def _drop(self, payload):
+        if self._overflow:
+            self._overflow(payload)
+        else:
+            self.dropped += payload.count
+
+    def pop(self):
+        payload, attempts = self._payloads.popleft()
+        self.bytes -= len(payload.data)
+        self.traces -= payload.count
+        return payload, attempts
+
+
+class EncodedTrace(object):
+    """
+    A trace encoded when it's written, with the details the queue needs to
+    account for it.
+    """
+    __slots__ = ['data', 'spans', 'priority']
+
+    def __init__(self, data, spans, priority):
+        self.data = data
+        self.spans = spans
+        self.priority = priority
+
+
+class EncodedTraceQ(Q):
+    """
+    Q of ``EncodedTrace``, where the size of each trace is the exact length
+    of its encoded data.
+    """
+    def _size(self, trace):
+        return len(trace.data)
+
+    def _priority(self, trace):
+        return trace.priority
+
+    def _spans(self, trace):
+        return trace.spans
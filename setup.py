@@ -70,7 +70,8 @@ setup(
     cmdclass={'test': Tox},
     entry_points={
         'console_scripts': [
-            'ddtrace-run = ddtrace.commands.ddtrace_run:main'
+            'ddtrace-run = ddtrace.commands.ddtrace_run:main',
+            'ddtrace-forwarder = ddtrace.commands.ddtrace_forwarder:main',
         ]
     },
     classifiers=[
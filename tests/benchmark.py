@@ -1,7 +1,23 @@
+import gc
+import random
+import re
+import threading
 import time
 import timeit
 
-from ddtrace import Tracer
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+from ddtrace import Pin, Tracer
+from ddtrace.ext import http
+from ddtrace.filters import FilterRequestsOnUrl
+from ddtrace.pool import release_traces
+from ddtrace.encoding import MsgpackEncoder, MsgpackStreamEncoder
+from ddtrace.span import Span
+from ddtrace.utils.ids import new_id
+from ddtrace.writer import AgentWriter, MAX_TRACES
 
 from .test_tracer import DummyWriter
 from os import getpid
@@ -80,7 +96,352 @@ def benchmark_getpid():
     print("- getpid execution time: {:8.6f}".format(min(result)))
 
 
+def benchmark_tracer_write():
+    # the queue is emptied before each run and never flushed: only the cost
+    # of Tracer.write() is measured
+    tracer = Tracer()
+    tracer.writer = AgentWriter(flush_interval=3600, flush_size=MAX_TRACES + 1)
+    trace = [Span(tracer, "a", service="s", resource="r", span_type="t")]
+
+    print("## tracer.write() benchmark: {} loops ##".format(MAX_TRACES))
+    for at_fork in (False, True):
+        tracer.writer._at_fork = at_fork
+        tracer.write(trace)
+        timer = timeit.Timer(lambda: tracer.write(trace), setup=tracer.writer._traces.pop)
+        result = timer.repeat(repeat=REPEAT * 5, number=MAX_TRACES)
+        print("- {} execution time: {:8.6f}".format("at-fork reset" if at_fork else "getpid() reset", min(result)))
+
+
+def benchmark_encoders():
+    # a single trace with thousands of tagged spans
+    trace = []
+    for i in range(2000):
+        span = Span(None, "client.testing", service="s", resource="r", span_type="db")
+        span.set_tag("sql.query", "SELECT * FROM users WHERE id = %s" % i)
+        span.set_metric("sql.rows", i)
+        span.duration = 0.01
+        trace.append(span)
+    traces = [trace]
+    number = 10
+
+    print("## encode_traces() benchmark: {} loops of a {} spans trace ##".format(number, len(trace)))
+    for encoder in (MsgpackEncoder(), MsgpackStreamEncoder()):
+        timer = timeit.Timer(lambda: encoder.encode_traces(traces))
+        result = timer.repeat(repeat=REPEAT, number=number)
+        print("- {} execution time: {:8.6f}".format(encoder.__class__.__name__, min(result)))
+        if tracemalloc:
+            tracemalloc.start()
+            encoder.encode_traces(traces)
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            print("- {} peak memory: {} KB".format(encoder.__class__.__name__, peak // 1024))
+
+
+def benchmark_filters():
+    # 50 excluded urls and traces of 10 spans on 100 distinct urls
+    patterns = [r'http://example\.com/health/{}(/.*)?$'.format(i) for i in range(50)]
+    traces = []
+    for i in range(10000):
+        root = Span(None, "web.request")
+        root.set_tag(http.URL, "http://example.com/{}/{}".format("health" if i % 10 else "users", i % 100))
+        trace = [root]
+        for _ in range(9):
+            span = Span(None, "db.query", parent_id=root.span_id)
+            span.set_tag(http.URL, "http://db.example.com/")
+            trace.append(span)
+        traces.append(trace)
+
+    def loop_filter(trace):
+        # one match per regular expression, on every root span
+        regexps = loop_filter.regexps
+        for span in trace:
+            if span.parent_id is None and span.get_tag(http.URL) is not None:
+                url = span.get_tag(http.URL)
+                for regexp in regexps:
+                    if regexp.match(url):
+                        return None
+        return trace
+    loop_filter.regexps = [re.compile(pattern) for pattern in patterns]
+
+    filters = [
+        ("regexps loop", loop_filter),
+        ("merged regexps", FilterRequestsOnUrl(patterns, cache_size=0).process_trace),
+        ("merged regexps and url cache", FilterRequestsOnUrl(patterns).process_trace),
+    ]
+    print("## filters benchmark: {} traces, {} patterns ##".format(len(traces), len(patterns)))
+    for name, process_trace in filters:
+        timer = timeit.Timer(lambda: [process_trace(trace) for trace in traces])
+        result = timer.repeat(repeat=REPEAT, number=1)
+        print("- {} execution time: {:8.6f}".format(name, min(result)))
+
+
+class NoopEncoder(object):
+    def encode_traces(self, traces):
+        pass
+
+
+class NoopWriter(object):
+    def write(self, spans=None, services=None):
+        pass
+
+
+def benchmark_span_pool():
+    # batches of traces created, kept until flushed and released like in the
+    # writer worker, with the garbage collector enabled
+    def flush(tracer):
+        for _ in range(200):
+            with tracer.trace("web.request", service="web") as root:
+                root.set_tag("http.url", "http://example.com/users")
+                for i in range(20):
+                    with tracer.trace("db.query") as span:
+                        span.set_tag("sql.query", "SELECT 1")
+                        span.set_metric("db.rows", i)
+        traces = tracer.writer.pop_traces()
+        tracer.writer.spans = []
+        release_traces(traces)
+
+    gc_time = [0, None]
+
+    def gc_callback(phase, info):
+        if phase == 'start':
+            gc_time[1] = time.time()
+        else:
+            gc_time[0] += time.time() - gc_time[1]
+
+    number = 10
+    print("## span pool benchmark: {} flushes of 200 traces of 21 spans ##".format(number))
+    gc.callbacks.append(gc_callback)
+    try:
+        for recycle in (False, True):
+            tracer = Tracer()
+            tracer.writer = DummyWriter()
+            # the DummyWriter encodes traces on write
+            tracer.writer.json_encoder = tracer.writer.msgpack_encoder = NoopEncoder()
+            tracer.configure(recycle_spans=recycle)
+            gc_time[0] = 0
+            timer = timeit.Timer(lambda: flush(tracer), setup='gc.enable()')
+            result = timer.repeat(repeat=REPEAT, number=number)
+            name = "recycled spans" if recycle else "new spans"
+            print("- {} execution time: {:8.6f}".format(name, min(result)))
+            print("- {} gc time: {:8.6f}".format(name, gc_time[0] / REPEAT))
+    finally:
+        gc.callbacks.remove(gc_callback)
+
+
+def benchmark_new_id():
+    def getrandbits():
+        return random.getrandbits(64)
+
+    def in_threads(generate, threads=4):
+        def run():
+            for _ in range(NUMBER * 10):
+                generate()
+        workers = [threading.Thread(target=run) for _ in range(threads)]
+        start = time.time()
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        return time.time() - start
+
+    print("## span ids benchmark: {} ids ##".format(NUMBER * 10))
+    for name, generate in (("random.getrandbits()", getrandbits), ("new_id()", new_id)):
+        timer = timeit.Timer(generate)
+        result = timer.repeat(repeat=REPEAT, number=NUMBER * 10)
+        print("- {} execution time: {:8.6f}".format(name, min(result)))
+        result = min(in_threads(generate) for _ in range(REPEAT))
+        print("- {} execution time in 4 threads: {:8.6f}".format(name, result))
+
+
+def benchmark_tracer_trace_nesting():
+    def trace(tracer, depth):
+        if depth:
+            with tracer.trace("nested"):
+                trace(tracer, depth - 1)
+
+    print("## tracer.trace() nesting benchmark: {} loops ##".format(NUMBER // 10))
+    for depth in (1, 5, 20):
+        for shared in (True, False):
+            tracer = Tracer()
+            tracer.writer = DummyWriter()
+            tracer.writer.json_encoder = tracer.writer.msgpack_encoder = NoopEncoder()
+            if shared:
+                # the context takes its lock like when it's used by many threads
+                tracer.get_call_context()._share()
+            timer = timeit.Timer(lambda: trace(tracer, depth), setup=tracer.writer.pop)
+            result = timer.repeat(repeat=REPEAT, number=NUMBER // 10)
+            print("- depth {} {} context execution time: {:8.6f}".format(
+                depth, "shared" if shared else "thread", min(result)))
+
+
+def benchmark_partial_flush():
+    # a long running root span, like a batch job, whose spans are dropped
+    # by the writer as soon as they are flushed
+    spans = 20000
+    print("## partial flush benchmark: trace of {} spans ##".format(spans))
+    for min_spans in (0, 500):
+        tracer = Tracer()
+        tracer.writer = NoopWriter()
+        tracer.configure(partial_flush_min_spans=min_spans)
+        name = "partial flush of {} spans".format(min_spans) if min_spans else "no partial flush"
+        if tracemalloc:
+            tracemalloc.start()
+        start = time.time()
+        with tracer.trace("batch.job"):
+            for i in range(spans):
+                with tracer.trace("db.query") as span:
+                    span.set_tag("sql.query", "SELECT * FROM users WHERE id = %s" % i)
+        print("- {} execution time: {:8.6f}".format(name, time.time() - start))
+        if tracemalloc:
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            print("- {} peak memory: {} KB".format(name, peak // 1024))
+
+
+def benchmark_max_spans_per_trace():
+    # a runaway loop traced inside a request
+    spans = 100000
+    print("## max spans per trace benchmark: loop of {} spans ##".format(spans))
+    for max_spans in (0, 1000):
+        tracer = Tracer()
+        tracer.writer = NoopWriter()
+        tracer.configure(max_spans_per_trace=max_spans)
+        name = "max {} spans".format(max_spans) if max_spans else "no max"
+        if tracemalloc:
+            tracemalloc.start()
+        start = time.time()
+        with tracer.trace("web.request"):
+            for i in range(spans):
+                with tracer.trace("cache.get") as span:
+                    span.set_tag("cache.key", "user:%s" % i)
+        print("- {} execution time: {:8.6f}".format(name, time.time() - start))
+        if tracemalloc:
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            print("- {} peak memory: {} KB".format(name, peak // 1024))
+
+
+def benchmark_tag_layers():
+    # database queries with global, pin and connection tags
+    tracer = Tracer()
+    tracer.writer = NoopWriter()
+    tracer.set_tags({"env": "prod", "version": "1.2.3", "region": "us-east-1"})
+    pin = Pin(service="db", tags={"db.name": "users", "team": "core"}, tracer=tracer)
+    conn_tags = {"out.host": "127.0.0.1", "out.port": 5432, "db.user": "app"}
+    conn = Pin(service="db", tags=conn_tags, tracer=tracer)
+
+    def query_set_tags():
+        with tracer.trace("root"):
+            for _ in range(10):
+                with tracer.trace("postgres.query") as span:
+                    for tags in (tracer.tags, pin.tags, conn_tags):
+                        for key, value in tags.items():
+                            span.set_tag(key, value)
+
+    def query_layers():
+        with tracer.trace("root"):
+            for _ in range(10):
+                with tracer.trace("postgres.query") as span:
+                    span._add_tag_layer(pin._get_tags_layer())
+                    span._add_tag_layer(conn._get_tags_layer())
+
+    print("## tag layers benchmark: {} traces of 10 queries ##".format(NUMBER // 10))
+    for name, trace in (("set_tags", query_set_tags), ("tag layers", query_layers)):
+        timer = timeit.Timer(trace)
+        result = timer.repeat(repeat=REPEAT, number=NUMBER // 10)
+        print("- {} execution time: {:8.6f}".format(name, min(result)))
+
+
+def django_trace(tracer, db_pin, i):
+    # the spans of the Django integration for a request with a few queries
+    with tracer.trace("django.request", service="django", resource="app.views.user", span_type="http") as root:
+        root.set_tag(http.METHOD, "GET")
+        root.set_tag(http.URL, "http://localhost:8000/users/%s/" % i)
+        root.set_tag(http.STATUS_CODE, 200)
+        root.set_tag("django.user.is_authenticated", True)
+        for name in ("SecurityMiddleware", "SessionMiddleware", "CommonMiddleware", "CsrfViewMiddleware",
+                     "AuthenticationMiddleware", "MessageMiddleware", "XFrameOptionsMiddleware"):
+            with tracer.trace("django.middleware", resource="django.middleware.%s.process_request" % name):
+                pass
+        for key in ("session", "user", "permissions"):
+            with tracer.trace("django.cache", service="django-cache", resource="get", span_type="cache") as span:
+                span.set_tag("django.cache.backend", "django_redis.cache.RedisCache")
+                span.set_tag("django.cache.key", "%s:%s" % (key, i))
+        for query in range(15):
+            with tracer.trace("postgres.query", service="postgres", span_type="sql") as span:
+                span.resource = "SELECT * FROM app_table_%s WHERE id = %%s" % query
+                span._add_tag_layer(db_pin._get_tags_layer())
+                span.set_metric("db.rowcount", 1)
+        with tracer.trace("django.template", resource="users/detail.html", span_type="template") as span:
+            span.set_tag("django.template_name", "users/detail.html")
+
+
+def benchmark_hoist_trace_tags():
+    tracer = Tracer()
+    tracer.writer = DummyWriter()
+    tracer.set_tags({"env": "production", "version": "2.13.0", "region": "us-east-1", "team": "accounts"})
+    db_pin = Pin(service="postgres", tracer=tracer, tags={
+        "out.host": "db.internal.example.com", "out.port": 5432, "db.name": "accounts", "db.user": "django",
+    })
+    for i in range(100):
+        django_trace(tracer, db_pin, i)
+    traces = tracer.writer.pop_traces()
+
+    print("## trace tags hoisting benchmark: {} Django traces of {} spans ##".format(len(traces), len(traces[0])))
+    for name, encoder in (("tags on every span", MsgpackStreamEncoder()),
+                          ("hoisted trace tags", MsgpackStreamEncoder(hoist_trace_tags=True))):
+        timer = timeit.Timer(lambda: encoder.encode_traces(traces))
+        result = timer.repeat(repeat=REPEAT, number=10)
+        print("- {} payload size: {} bytes".format(name, len(encoder.encode_traces(traces))))
+        print("- {} encoding time: {:8.6f}".format(name, min(result)))
+
+
+def benchmark_set_tag():
+    # tags of a web request, converted when set or by the writer
+    class User(object):
+        def __init__(self, id):
+            self.id = id
+
+        def __str__(self):
+            return "User(id={})".format(self.id)
+
+    tags = {"http.status_code": 200, "user.id": 123456789, "http.method": "GET", "user": User(42),
+            "response.size": 1024.5}
+    span = Span(None, "web.request")
+
+    def set_tags_converted():
+        for key, value in tags.items():
+            span.set_tag(key, str(value))
+
+    def set_tags_raw():
+        for key, value in tags.items():
+            span.set_tag(key, value)
+
+    def set_tags_raw_and_encode():
+        set_tags_raw()
+        # like the encoding, reading meta converts the tags
+        return span.meta
+
+    print("## set_tag benchmark: {} loops of {} tags ##".format(NUMBER, len(tags)))
+    for name, func in (("converted on set_tag", set_tags_converted), ("converted on encoding", set_tags_raw),
+                       ("converted on encoding, with the encoding", set_tags_raw_and_encode)):
+        timer = timeit.Timer(func)
+        result = timer.repeat(repeat=REPEAT, number=NUMBER)
+        print("- {} execution time: {:8.6f}".format(name, min(result)))
+
+
 if __name__ == '__main__':
     benchmark_tracer_wrap()
     benchmark_tracer_trace()
     benchmark_getpid()
+    benchmark_tracer_write()
+    benchmark_encoders()
+    benchmark_filters()
+    benchmark_span_pool()
+    benchmark_new_id()
+    benchmark_tracer_trace_nesting()
+    benchmark_partial_flush()
+    benchmark_max_spans_per_trace()
+    benchmark_tag_layers()
+    benchmark_hoist_trace_tags()
+    benchmark_set_tag()
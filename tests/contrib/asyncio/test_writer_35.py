@@ -0,0 +1,145 @@
+import asyncio
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import HTTPServer
+from socketserver import ThreadingMixIn, UnixStreamServer
+from unittest import TestCase
+
+from ddtrace.contrib.asyncio.writer import AsyncioWriter
+from ddtrace.sampler import RateByServiceSampler
+
+from tests.test_api import AgentStandInHandler
+from tests.test_writer import make_trace
+
+
+class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class ThreadingUnixServer(ThreadingMixIn, UnixStreamServer):
+    daemon_threads = True
+
+
+class CountingExecutor(ThreadPoolExecutor):
+    def __init__(self):
+        super(CountingExecutor, self).__init__(max_workers=1)
+        self.jobs = 0
+
+    def submit(self, *args, **kwargs):
+        self.jobs += 1
+        return super(CountingExecutor, self).submit(*args, **kwargs)
+
+
+class AsyncioWriterTests(TestCase):
+    def start_server(self, server):
+        server.requests = []
+        thread = threading.Thread(target=server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        return server
+
+    def wait_for(self, predicate, timeout=5):
+        start = time.time()
+        while not predicate() and time.time() - start < timeout:
+            time.sleep(0.01)
+
+    def test_own_loop(self):
+        server = self.start_server(ThreadingHTTPServer(('127.0.0.1', 0), AgentStandInHandler))
+        writer = AsyncioWriter('127.0.0.1', server.server_address[1], flush_interval=0.05)
+        for _ in range(3):
+            writer.write(spans=make_trace(2))
+        writer.write(services={'web': {'app': 'flask', 'app_type': 'web'}})
+        self.wait_for(lambda: len(server.requests) == 2)
+
+        requests = sorted(server.requests)
+        self.assertEqual([request[0] for request in requests], ['/v0.3/services', '/v0.3/traces'])
+        _, headers, body = requests[1]
+        self.assertEqual(headers['X-Datadog-Trace-Count'], '3')
+        self.assertEqual([len(trace) for trace in json.loads(body.decode('utf-8'))], [2, 2, 2])
+
+        # traces left are sent on shutdown
+        writer.write(spans=make_trace(1))
+        writer._on_shutdown()
+        self.assertEqual(len(server.requests), 3)
+        stats = writer.stats()
+        self.assertEqual(stats['traces.sent'], 4)
+        self.assertEqual(stats['spans.sent'], 7)
+        self.assertEqual(stats['http.status.200'], 2)
+
+    def test_app_loop(self):
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        path = os.path.join(tmpdir, 'apm.socket')
+        server = self.start_server(ThreadingUnixServer(path, AgentStandInHandler))
+
+        loop = asyncio.new_event_loop()
+        self.addCleanup(loop.close)
+        sampler = RateByServiceSampler()
+        executor = CountingExecutor()
+        writer = AsyncioWriter(
+            uds_path=path, priority_sampler=sampler, loop=loop, executor=executor, encode_slice=2,
+            flush_interval=60,
+        )
+
+        async def run():
+            for _ in range(5):
+                writer.write(spans=make_trace(1))
+            await writer.close()
+
+        loop.run_until_complete(run())
+
+        # the API is downgraded and the payload is sent again
+        self.assertEqual([request[0] for request in server.requests], ['/v0.4/traces', '/v0.3/traces'])
+        self.assertEqual(server.requests[1][1]['X-Datadog-Trace-Count'], '5')
+        # 3 slices of traces are encoded, and then joined in a payload
+        self.assertEqual(executor.jobs, 4)
+        # the sampling rates of the agent are used
+        self.assertEqual(sampler._by_service_samplers['service:,env:'].sample_rate, 0.5)
+
+    def test_restart_failed_worker(self):
+        server = self.start_server(ThreadingHTTPServer(('127.0.0.1', 0), AgentStandInHandler))
+        writer = AsyncioWriter('127.0.0.1', server.server_address[1], flush_interval=60)
+        writer.write(spans=make_trace(1))
+        worker, loop = writer._worker, writer._loop
+        # the flush loop failed, but the event loop is still running
+        worker.cancel()
+        self.wait_for(worker.done)
+        writer.write(spans=make_trace(1))
+        self.assertIsNot(writer._worker, worker)
+        self.assertIs(writer._loop, loop)
+        self.assertFalse(writer._worker.done())
+        writer._on_shutdown()
+        self.assertEqual(writer.stats()['traces.sent'], 2)
+
+    def test_status_without_reason(self):
+        loop = asyncio.new_event_loop()
+        self.addCleanup(loop.close)
+
+        async def handle(reader, writer):
+            while (await reader.readline()) not in (b'\r\n', b''):
+                pass
+            writer.write(b'HTTP/1.1 200\r\nContent-Length: 2\r\n\r\n{}')
+            await writer.drain()
+            writer.close()
+
+        async def run():
+            server = await asyncio.start_server(handle, '127.0.0.1', 0)
+            writer = AsyncioWriter('127.0.0.1', server.sockets[0].getsockname()[1], loop=loop)
+            try:
+                return await writer._put('/v0.4/traces', b'')
+            finally:
+                writer._close_stream()
+                server.close()
+                await server.wait_closed()
+
+        response = loop.run_until_complete(run())
+        self.assertEqual(response.status, 200)
+        self.assertEqual(response.reason, '')
+        self.assertEqual(response.body, b'{}')
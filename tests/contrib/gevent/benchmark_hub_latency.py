@@ -0,0 +1,83 @@
+"""
+Hub latency of a gevent application while the tracer flushes traces, with the
+``AgentWriter`` (a greenlet once monkey patched) and with the ``GeventWriter``
+(a native thread)::
+
+    $ python -m tests.contrib.gevent.benchmark_hub_latency
+
+Request greenlets create traces with many tagged spans, then wait for I/O,
+while a probe greenlet measures how late it's woken up. Requests to the agent
+are emulated with a sleep, so no agent is needed.
+
+When the request greenlets keep the CPU busy, the native thread competes for
+the GIL with the hub and the latency gets worse: the ``GeventWriter`` helps
+applications bound by I/O, not by CPU.
+"""
+from gevent import monkey; monkey.patch_all()  # noqa
+
+import time  # noqa: E402
+
+import gevent  # noqa: E402
+
+from ddtrace import Tracer  # noqa: E402
+from ddtrace.api import Response  # noqa: E402
+from ddtrace.contrib.gevent import context_provider  # noqa: E402
+from ddtrace.contrib.gevent.writer import GeventWriter  # noqa: E402
+from ddtrace.writer import AgentWriter  # noqa: E402
+
+DURATION = 5
+REQUESTS = 5
+SPANS = 500
+IDLE = 0.1
+PROBE_INTERVAL = 0.001
+
+
+def fake_put(endpoint, data, count=0):
+    # the agent answers in 2ms
+    time.sleep(0.002)
+    return Response(status=200, body=b'{}')
+
+
+def request(tracer):
+    while True:
+        with tracer.trace('web.request', service='web'):
+            for i in range(SPANS):
+                with tracer.trace('db.query', service='db') as span:
+                    span.set_tag('sql.query', 'SELECT * FROM users WHERE id = %s' % i)
+                    span.set_metric('db.rows', i)
+        gevent.sleep(IDLE)
+
+
+def probe(latencies):
+    while True:
+        start = time.time()
+        gevent.sleep(PROBE_INTERVAL)
+        latencies.append(time.time() - start - PROBE_INTERVAL)
+
+
+def run(writer_class):
+    tracer = Tracer()
+    tracer.configure(context_provider=context_provider)
+    tracer.writer = writer_class(flush_interval=0.1)
+    tracer.writer.api._put = fake_put
+
+    latencies = []
+    greenlets = [gevent.spawn(probe, latencies)]
+    greenlets.extend(gevent.spawn(request, tracer) for _ in range(REQUESTS))
+    gevent.sleep(DURATION)
+    gevent.killall(greenlets)
+    tracer.writer._worker.stop()
+
+    latencies.sort()
+    print("- {}: p50 {:.2f}ms, p99 {:.2f}ms, max {:.2f}ms".format(
+        writer_class.__name__,
+        latencies[len(latencies) // 2] * 1000,
+        latencies[int(len(latencies) * 0.99)] * 1000,
+        latencies[-1] * 1000,
+    ))
+
+
+if __name__ == '__main__':
+    print("## hub latency: {} requests of {} spans for {}s ##".format(REQUESTS, SPANS, DURATION))
+    run(AgentWriter)
+    run(GeventWriter)
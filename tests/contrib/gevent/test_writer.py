@@ -0,0 +1,181 @@
+import logging
+import os
+import subprocess
+import sys
+import threading
+import time
+from unittest import TestCase
+
+import ddtrace
+import mock
+
+from ddtrace import Tracer
+from ddtrace.compat import httplib
+from ddtrace.contrib.gevent import patch, unpatch
+from ddtrace.contrib.gevent.writer import (
+    GeventWriter, NativeAPI, NativeAsyncWorker, NativeCondition, NativeHTTPConnection, NativeThread,
+    NativeUDSHTTPConnection, _NativeRLock, _allocate_lock,
+)
+from ddtrace.writer import AgentWriter, AsyncWorker
+
+from nose.tools import eq_, ok_
+from tests.test_writer import DummmyAPI, make_trace
+
+
+class NativePrimitivesTests(TestCase):
+    def test_thread(self):
+        done = []
+        thread = NativeThread(lambda: done.append(time.sleep(0.05)))
+        ok_(not thread.is_alive())
+        thread.start()
+        ok_(thread.is_alive())
+        thread.join(5)
+        ok_(not thread.is_alive())
+        eq_(done, [None])
+
+    def test_condition_notify(self):
+        condition = NativeCondition()
+        woken = []
+
+        def wait():
+            with condition:
+                woken.append(condition.wait(5))
+
+        thread = NativeThread(wait)
+        thread.start()
+        while not condition._waiters:
+            time.sleep(0.01)
+        with condition:
+            condition.notify()
+        thread.join(5)
+        eq_(woken, [True])
+
+    def test_condition_timeout(self):
+        condition = NativeCondition()
+        with condition:
+            start = time.time()
+            ok_(not condition.wait(0.05))
+            ok_(time.time() - start >= 0.04)
+        eq_(condition._waiters, [])
+
+
+class GeventWriterTests(TestCase):
+    def test_not_patched(self):
+        # without monkey patching the writer is an AgentWriter
+        with mock.patch('ddtrace.contrib.gevent.writer.is_patched', return_value=False):
+            writer = GeventWriter()
+            ok_(type(writer.api._new_connection()) is httplib.HTTPConnection)
+            writer.api = DummmyAPI()
+            writer.write(spans=make_trace(1))
+            eq_(type(writer._worker), AsyncWorker)
+            ok_(isinstance(writer._traces.condition, type(threading.Condition())))
+            writer._worker.stop()
+
+    def test_patched(self):
+        with mock.patch('ddtrace.contrib.gevent.writer.is_patched', return_value=True):
+            writer = GeventWriter(flush_interval=60)
+            ok_(isinstance(writer.api, NativeAPI))
+            ok_(isinstance(writer.api._new_connection(), NativeHTTPConnection))
+            ok_(isinstance(NativeAPI('localhost', 8126, uds_path='/tmp/apm.socket')._new_connection(),
+                           NativeUDSHTTPConnection))
+
+            writer.api = DummmyAPI()
+            writer.write(spans=make_trace(2))
+            ok_(isinstance(writer._worker, NativeAsyncWorker))
+            ok_(isinstance(writer._worker._thread, NativeThread))
+            ok_(isinstance(writer._traces.condition, NativeCondition))
+
+            # traces are sent from the native thread on shutdown
+            worker = writer._worker
+            worker._on_shutdown()
+            eq_(len(writer.api.traces), 1)
+            ok_(not worker.is_alive())
+            ok_(writer._worker is None)
+
+    def test_native_locks(self):
+        logger = logging.getLogger('ddtrace.contrib.gevent.test')
+        handler = logging.NullHandler()
+        # the handler lock of a patched application
+        handler.lock = mock.MagicMock()
+        logger.addHandler(handler)
+        try:
+            with mock.patch('ddtrace.contrib.gevent.writer.is_patched', return_value=True):
+                writer = GeventWriter(flush_interval=60)
+                writer.api = DummmyAPI()
+                writer.write(spans=make_trace(1))
+                native_lock = type(_allocate_lock())
+                ok_(isinstance(writer._stats._lock, native_lock))
+                ok_(isinstance(writer._worker._lock, native_lock))
+                ok_(writer._worker._stats is writer._stats)
+                ok_(isinstance(handler.lock, _NativeRLock))
+                writer._worker._on_shutdown()
+        finally:
+            logger.removeHandler(handler)
+
+    def test_contention(self):
+        # greenlets write, read the stats and log while the native thread
+        # flushes and logs, in a monkey patched process
+        script = """
+from gevent import monkey
+monkey.patch_all()
+import logging, os, gevent
+from ddtrace.contrib.gevent.writer import GeventWriter, _NativeRLock, _allocate_lock
+from tests.test_writer import DummmyAPI, make_trace
+
+logging.basicConfig(level=logging.DEBUG, stream=open(os.devnull, 'w'))
+writer = GeventWriter(flush_interval=0.001, flush_size=5)
+writer.api = DummmyAPI()
+
+def write():
+    for _ in range(50):
+        writer.write(spans=make_trace(2))
+        logging.getLogger('ddtrace.test').debug('trace written')
+        writer.stats()
+        gevent.sleep(0)
+
+gevent.joinall([gevent.spawn(write) for _ in range(20)], timeout=20)
+native_lock = type(_allocate_lock())
+assert isinstance(writer._stats._lock, native_lock)
+assert isinstance(writer._worker._lock, native_lock)
+assert all(isinstance(handler.lock, _NativeRLock) for handler in logging.getLogger().handlers)
+writer._worker._on_shutdown()
+assert len(writer.api.traces) == 1000, len(writer.api.traces)
+assert writer.stats()['traces.enqueued'] == 1000
+"""
+        process = subprocess.Popen(
+            [sys.executable, '-c', script],
+            cwd=os.path.join(os.path.dirname(__file__), '..', '..', '..'),
+            stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+        )
+        start = time.time()
+        while process.poll() is None and time.time() - start < 30:
+            time.sleep(0.05)
+        if process.poll() is None:
+            process.kill()
+        output = process.communicate()[0]
+        eq_(process.returncode, 0, output)
+
+    def test_patch_keeps_writer(self):
+        tracer = Tracer()
+        writer = tracer.writer = AgentWriter('agent', 8127)
+        with mock.patch.object(ddtrace, 'tracer', tracer):
+            patch()
+            ok_(tracer.writer is writer)
+            unpatch()
+            ok_(tracer.writer is writer)
+
+    def test_patch_replaces_writer(self):
+        tracer = Tracer()
+        tracer.writer = AgentWriter(
+            'agent', 8127, flush_interval=2, flush_size=10, spool_bytes=1024, max_retries=1,
+            spill_path='/tmp/traces.spill', stats_interval=5,
+        )
+        settings = tracer.writer._settings()
+        with mock.patch.object(ddtrace, 'tracer', tracer), \
+                mock.patch.dict(ddtrace.config.gevent, replace_writer=True):
+            patch()
+            ok_(type(tracer.writer) is GeventWriter)
+            eq_(tracer.writer._settings(), settings)
+            unpatch()
+            ok_(type(tracer.writer) is AgentWriter)
+            eq_(tracer.writer._settings(), settings)
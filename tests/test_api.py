@@ -1,12 +1,27 @@
+import json
 import mock
+import os
+import shutil
+import socket
+import tempfile
+import threading
 import warnings
 
 from unittest import TestCase
 from nose.tools import eq_, ok_
 
 from tests.test_tracer import get_dummy_tracer
-from ddtrace.api import _parse_response_json, API
+from ddtrace.api import _parse_response_json, API, Response
+from ddtrace.encoding import JSONEncoder, MsgpackEncoder
 from ddtrace.compat import iteritems, httplib
+from ddtrace.span import Span
+
+try:
+    from BaseHTTPServer import BaseHTTPRequestHandler
+    from SocketServer import UnixStreamServer
+except ImportError:
+    from http.server import BaseHTTPRequestHandler
+    from socketserver import UnixStreamServer
 
 class ResponseMock:
     def __init__(self, content):
@@ -20,11 +35,13 @@ class APITests(TestCase):
     def setUp(self):
         # DEV: Mock here instead of in tests, before we have patched `httplib.HTTPConnection`
         self.conn = mock.MagicMock(spec=httplib.HTTPConnection)
+        self.other_conn = mock.MagicMock(spec=httplib.HTTPConnection)
         self.api = API('localhost', 8126)
 
     def tearDown(self):
         del self.api
         del self.conn
+        del self.other_conn
 
     @mock.patch('logging.Logger.debug')
     def test_parse_response_json(self, log):
@@ -54,20 +71,41 @@ class APITests(TestCase):
                 ok_(v['log'] in l, "unable to find %s in %s" % (v['log'], l))
 
     @mock.patch('ddtrace.compat.httplib.HTTPConnection')
-    def test_put_connection_close(self, HTTPConnection):
+    def test_put_connection_keep_alive(self, HTTPConnection):
         """
         When calling API._put
-            we close the HTTPConnection we create
+            we keep the HTTPConnection open and reuse it for the next call
         """
         HTTPConnection.return_value = self.conn
+        self.conn.getresponse.return_value.will_close = False
 
         with warnings.catch_warnings(record=True) as w:
-            self.api._put('/test', '<test data>', 1)
+            first = self.api._put('/test', '<test data>', 1)
+            second = self.api._put('/test', '<test data>', 1)
 
             self.assertEqual(len(w), 0, 'Test raised unexpected warnings: {0!r}'.format(w))
 
+        self.assertEqual(HTTPConnection.call_count, 1)
+        self.assertEqual(self.conn.request.call_count, 2)
+        self.conn.close.assert_not_called()
+        ok_(not first.reused)
+        ok_(second.reused)
+        ok_(second.duration >= 0)
+
+    @mock.patch('ddtrace.compat.httplib.HTTPConnection')
+    def test_put_connection_will_close(self, HTTPConnection):
+        """
+        When calling API._put and the agent doesn't keep the connection alive
+            we close the HTTPConnection we create
+        """
+        HTTPConnection.return_value = self.conn
+        self.conn.getresponse.return_value.will_close = True
+
+        self.api._put('/test', '<test data>', 1)
+
         self.conn.request.assert_called_once()
         self.conn.close.assert_called_once()
+        ok_(self.api._conn is None)
 
     @mock.patch('ddtrace.compat.httplib.HTTPConnection')
     def test_put_connection_close_exception(self, HTTPConnection):
@@ -87,3 +125,182 @@ class APITests(TestCase):
 
         self.conn.request.assert_called_once()
         self.conn.close.assert_called_once()
+
+    @mock.patch('ddtrace.compat.httplib.HTTPConnection')
+    def test_put_reconnect_on_stale_connection(self, HTTPConnection):
+        """
+        When calling API._put on a reused connection that fails
+            we retry once on a new connection
+        """
+        stale = self.other_conn
+        stale.request.side_effect = httplib.BadStatusLine('')
+        HTTPConnection.side_effect = [stale, self.conn]
+        self.conn.getresponse.return_value.will_close = False
+        self.api._conn = HTTPConnection()
+        self.api._conn_pid = os.getpid()
+
+        response = self.api._put('/test', '<test data>', 1)
+
+        stale.close.assert_called_once()
+        self.conn.request.assert_called_once()
+        ok_(not response.reused)
+        eq_(self.api._conn, self.conn)
+
+    @mock.patch('ddtrace.compat.httplib.HTTPConnection')
+    def test_put_new_connection_after_fork(self, HTTPConnection):
+        """
+        When calling API._put from a forked process
+            we don't reuse the connection of the parent process
+        """
+        parent = self.other_conn
+        HTTPConnection.return_value = self.conn
+        self.conn.getresponse.return_value.will_close = False
+        self.api._conn = parent
+        self.api._conn_pid = os.getpid() + 1
+
+        response = self.api._put('/test', '<test data>', 1)
+
+        parent.request.assert_not_called()
+        parent.close.assert_called_once()
+        self.conn.request.assert_called_once()
+        ok_(not response.reused)
+
+
+class AgentStandInHandler(BaseHTTPRequestHandler):
+    """Minimal trace agent that records the requests it receives."""
+    protocol_version = 'HTTP/1.1'
+
+    def do_PUT(self):
+        body = self.rfile.read(int(self.headers['Content-Length']))
+        self.server.requests.append((self.path, dict(self.headers), body))
+        if self.path.startswith('/v0.4/'):
+            status, content = 404, b'404 page not found'
+        else:
+            status, content = 200, json.dumps({'rate_by_service': {'service:,env:': 0.5}}).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def address_string(self):
+        return 'uds'
+
+    def log_message(self, *args):
+        pass
+
+
+class UDSAPITests(TestCase):
+    """
+    Ensures the API sends payloads through a Unix Domain Socket, using a local
+    stand-in trace agent bound to a socket file.
+    """
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, 'apm.socket')
+        self.server = UnixStreamServer(self.path, AgentStandInHandler)
+        self.server.requests = []
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.tmpdir)
+
+    def test_uds_url(self):
+        api = API('localhost', 8126, uds_path='unix://' + self.path)
+        eq_(api.uds_path, self.path)
+        eq_(api.url, 'unix://' + self.path)
+
+    def test_send_traces(self):
+        api = API('localhost', 8126, uds_path=self.path)
+        response = api.send_traces([[Span(name='client.testing', tracer=None)]])
+        eq_(response.status, 200)
+        eq_(_parse_response_json(response), {'rate_by_service': {'service:,env:': 0.5}})
+
+        path, headers, _ = self.server.requests[0]
+        eq_(path, '/v0.3/traces')
+        eq_(headers['X-Datadog-Trace-Count'], '1')
+
+        # the connection is kept alive for the next request
+        response = api.send_services([{'service': {'app': 'flask', 'app_type': 'web'}}])
+        eq_(response.status, 200)
+        ok_(response.reused)
+        eq_(self.server.requests[1][0], '/v0.3/services')
+
+    def test_downgrade(self):
+        api = API('localhost', 8126, uds_path=self.path, priority_sampling=True)
+        response = api.send_traces([[Span(name='client.testing', tracer=None)]])
+        eq_(response.status, 200)
+        eq_([request[0] for request in self.server.requests], ['/v0.4/traces', '/v0.3/traces'])
+
+    def test_tracer_configure(self):
+        tracer = get_dummy_tracer()
+        tracer.configure(uds_path='unix://' + self.path)
+        eq_(tracer.writer.api.uds_path, self.path)
+        # the socket path is preserved when the writer is configured again
+        tracer.configure(priority_sampling=True)
+        eq_(tracer.writer.api.uds_path, self.path)
+
+    def test_missing_socket(self):
+        api = API('localhost', 8126, uds_path=os.path.join(self.tmpdir, 'missing.socket'))
+        with self.assertRaises(socket.error):
+            api.send_traces([[Span(name='client.testing', tracer=None)]])
+
+
+class PayloadChunkingTests(TestCase):
+    """
+    Ensures traces that don't fit in a single payload are split in several
+    requests, keeping each trace whole.
+    """
+    def setUp(self):
+        self.api = API('localhost', 8126, encoder=JSONEncoder(), max_payload_size=2048)
+        self.api._put = mock.Mock(return_value=Response(status=200, body=b'{}'))
+
+    def _traces(self, n_traces, n_spans):
+        return [[Span(name='client.testing', tracer=None) for _ in range(n_spans)] for _ in range(n_traces)]
+
+    def test_single_payload(self):
+        self.api.send_traces(self._traces(2, 1))
+        eq_(self.api._put.call_count, 1)
+
+    def test_split_payloads(self):
+        traces = self._traces(20, 3)
+        response = self.api.send_traces(traces)
+        eq_(response.status, 200)
+        ok_(self.api._put.call_count > 1)
+
+        received = []
+        for (endpoint, data, count), _ in self.api._put.call_args_list:
+            payload = json.loads(data)
+            eq_(len(payload), count)
+            ok_(len(data) <= 2048)
+            received.extend(payload)
+        # every trace is sent whole, in order
+        eq_(len(received), 20)
+        ok_(all(len(trace) == 3 for trace in received))
+        eq_([trace[0]['span_id'] for trace in received], [trace[0].span_id for trace in traces])
+
+    def test_oversized_trace(self):
+        # a single trace bigger than the limit is sent alone
+        traces = self._traces(1, 30) + self._traces(1, 1)
+        self.api.send_traces(traces)
+        eq_([call[0][2] for call in self.api._put.call_args_list], [1, 1])
+
+    def test_split_keeps_first_error(self):
+        self.api._put.side_effect = [Response(status=500), Response(status=200)]
+        response = self.api.send_encoded_traces([self.api.encode_trace(trace) for trace in self._traces(2, 20)])
+        eq_(self.api._put.call_count, 2)
+        eq_(response.status, 500)
+
+    def test_downgrade_encodes_again(self):
+        # after a downgrade to another encoding, traces are encoded again
+        api = API('localhost', 8126, encoder=MsgpackEncoder())
+        api._fallback = 'v0.2'
+        api._put = mock.Mock(side_effect=[Response(status=415), Response(status=200)])
+        response = api.send_traces(self._traces(2, 1))
+        eq_(response.status, 200)
+        endpoint, data, count = api._put.call_args[0]
+        eq_(endpoint, '/v0.2/traces')
+        eq_(len(json.loads(data)), 2)
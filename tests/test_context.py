@@ -5,6 +5,7 @@ from unittest import TestCase
 from nose.tools import eq_, ok_
 from tests.test_tracer import get_dummy_tracer
 
+from ddtrace.constants import SAMPLING_PRIORITY_KEY
 from ddtrace.span import Span
 from ddtrace.context import Context, ThreadLocalContext
 from ddtrace.ext.priority import USER_REJECT, AUTO_REJECT, AUTO_KEEP, USER_KEEP
@@ -92,6 +93,41 @@ class TestTracingContext(TestCase):
         ok_(ctx._current_span is None)
         ok_(ctx._sampled is True)
 
+    def test_get_partial(self):
+        ctx = Context()
+        ctx.sampling_priority = USER_KEEP
+        root = Span(tracer=None, name='root')
+        ctx.add_span(root)
+        children = []
+        for i in range(3):
+            child = Span(tracer=None, name='child', trace_id=root.trace_id, parent_id=root.span_id)
+            child._parent = root
+            ctx.add_span(child)
+            children.append(child)
+        opened = Span(tracer=None, name='opened', trace_id=root.trace_id, parent_id=root.span_id)
+        ctx.add_span(opened)
+
+        for child in children[:2]:
+            child._finished = True
+            ctx.close_span(child)
+        eq_(ctx.get_partial(3), (None, None))
+
+        children[2]._finished = True
+        ctx.close_span(children[2])
+        eq_(ctx.get_partial(3), (children, True))
+        eq_(children[0].get_metric(SAMPLING_PRIORITY_KEY), USER_KEEP)
+        # open spans stay in the context
+        eq_(ctx._trace, [root, opened])
+        eq_(ctx._finished_spans, 0)
+        eq_(ctx.get_current_root_span(), root)
+
+        for span in (opened, root):
+            span._finished = True
+            ctx.close_span(span)
+        # a finished trace is returned by get()
+        eq_(ctx.get_partial(1), (None, None))
+        eq_(ctx.get(), ([root, opened], True))
+
     def test_get_trace_empty(self):
         # it should return None if the Context is not finished
         ctx = Context()
@@ -265,3 +301,91 @@ class TestThreadContext(TestCase):
         # because it has not been used in this thread
         ctx = l_ctx.get()
         eq_(0, len(ctx._trace))
+
+    def test_owned_context(self):
+        # the context of a thread is used without its lock
+        ctx = ThreadLocalContext().get()
+        ctx._lock = mock.MagicMock()
+        root = Span(tracer=None, name='root')
+        ctx.add_span(root)
+        ctx.sampling_priority = USER_KEEP
+        eq_(ctx.get_current_span(), root)
+        eq_(ctx.trace_id, root.trace_id)
+        ctx.close_span(root)
+        eq_(ctx.get(), ([root], True))
+        eq_(ctx._lock.__enter__.call_count, 0)
+
+    def test_shared_when_used_by_another_thread(self):
+        ctx = ThreadLocalContext().get()
+        ok_(ctx._owner is not None)
+        t = threading.Thread(target=ctx.add_span, args=(Span(tracer=None, name='fake_span'),))
+        t.start()
+        t.join()
+        eq_(1, len(ctx._trace))
+        # only the owner shares the context, on its next change
+        ok_(ctx._owner is not None)
+        ok_(ctx._share_requested)
+        ctx.add_span(Span(tracer=None, name='fake_span'))
+        ok_(ctx._owner is None)
+        eq_(2, len(ctx._trace))
+
+    def test_wait_for_owner_change(self):
+        # another thread doesn't change the context while its owner does
+        ctx = ThreadLocalContext().get()
+        ctx._busy = True
+        t = threading.Thread(target=ctx.add_span, args=(Span(tracer=None, name='fake_span'),))
+        t.start()
+        t.join(0.05)
+        ok_(t.is_alive())
+        eq_(0, len(ctx._trace))
+        ctx._busy = False
+        t.join()
+        eq_(1, len(ctx._trace))
+
+    def test_shared_when_activated_in_another_thread(self):
+        ctx = ThreadLocalContext().get()
+        t = threading.Thread(target=ThreadLocalContext().set, args=(ctx,))
+        t.start()
+        t.join()
+        ok_(ctx._share_requested)
+        ctx.add_span(Span(tracer=None, name='fake_span'))
+        ok_(ctx._owner is None)
+
+        # but not when activated in its own thread
+        local = ThreadLocalContext()
+        owned = local.get()
+        local.set(owned)
+        ok_(owned._owner is not None)
+        ok_(not owned._share_requested)
+
+    def test_share_from_another_thread(self):
+        # the owner shares the context itself
+        ctx = ThreadLocalContext().get()
+        t = threading.Thread(target=ctx._share)
+        t.start()
+        t.join()
+        ok_(ctx._owner is not None)
+        ctx._share()
+        ok_(ctx._owner is None)
+
+    def test_clone_is_not_owned(self):
+        ctx = ThreadLocalContext().get()
+        ctx.add_span(Span(tracer=None, name='root'))
+        ok_(ctx.clone()._owner is None)
+
+    def test_owned_thread_safe(self):
+        # a context shared by many threads counts all the spans
+        ctx = ThreadLocalContext().get()
+        spans = [Span(tracer=None, name='fake_span') for _ in range(100)]
+
+        def _fill_ctx(span):
+            ctx.add_span(span)
+            ctx.close_span(span)
+
+        threads = [threading.Thread(target=_fill_ctx, args=(span,)) for span in spans]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        eq_(100, len(ctx._trace))
+        eq_(100, ctx._finished_spans)
@@ -4,9 +4,9 @@ import msgpack
 from unittest import TestCase
 from nose.tools import eq_, ok_
 
-from ddtrace.span import Span
+from ddtrace.span import Span, TagLayer
 from ddtrace.compat import msgpack_type, string_type
-from ddtrace.encoding import JSONEncoder, MsgpackEncoder
+from ddtrace.encoding import JSONEncoder, MsgpackEncoder, MsgpackStreamEncoder
 
 
 class TestEncoders(TestCase):
@@ -64,3 +64,83 @@ class TestEncoders(TestCase):
         for i in range(2):
             for j in range(2):
                 eq_(b'client.testing', items[i][j][b'name'])
+
+    def test_encode_traces_msgpack_stream(self):
+        # the streaming encoder must produce the same payload of the
+        # dict based msgpack encoder
+        root = Span(name='client.testing', service='web', resource='GET /', span_type='http', tracer=None)
+        root.set_tag('http.url', 'http://example.com/')
+        root.set_metric('_sampling_priority_v1', 1)
+        root.duration = 0.25
+        child = Span(name='client.testing', tracer=None, trace_id=root.trace_id, parent_id=root.span_id)
+        child.error = True
+        child.set_tag('http.status_code', 200)
+        empty = Span(name='client.testing', tracer=None)
+        empty.start = None
+        traces = [[root, child], [empty], []]
+
+        # the stream encoder converts the tags itself
+        encoder = MsgpackStreamEncoder()
+        spans = encoder.encode_traces(traces)
+        expected = MsgpackEncoder().encode_traces(traces)
+
+        ok_(isinstance(spans, msgpack_type))
+        eq_(msgpack.unpackb(spans), msgpack.unpackb(expected))
+        items = msgpack.unpackb(spans)
+        eq_(items[0][1][b'error'], 1)
+        eq_(items[0][1][b'meta'], {b'http.status_code': b'200'})
+        ok_(b'start' not in items[1][0])
+
+        # the buffer is reset between calls
+        eq_(msgpack.unpackb(encoder.encode_traces(traces)), msgpack.unpackb(expected))
+
+    def test_encode_traces_msgpack_hoist_trace_tags(self):
+        # the tags of the tracer are written once, on the root span
+        layer = TagLayer({'env': 'prod', 'version': '1.0'})
+        root = Span(name='web.request', tracer=None)
+        root._add_tag_layer(layer)
+        root._trace_tags = layer
+        root.set_tag('system.pid', 42)
+        children = []
+        for i in range(3):
+            child = Span(name='db.query', tracer=None, trace_id=root.trace_id, parent_id=root.span_id)
+            child._add_tag_layer(layer)
+            child._parent = root
+            children.append(child)
+        children[1].set_tag('env', 'staging')
+        children[2].set_tag('db.name', 'users')
+        # the tags of the spans are kept, even with the value of the root span
+        children[2].set_tag('system.pid', 42)
+        orphan = Span(name='db.query', tracer=None, trace_id=root.trace_id, parent_id=root.span_id)
+        orphan._add_tag_layer(layer)
+        orphan._parent = root
+        traces = [[root] + children, [orphan, children[0]]]
+
+        expected = msgpack.unpackb(MsgpackEncoder().encode_traces(traces))
+        items = msgpack.unpackb(MsgpackStreamEncoder(hoist_trace_tags=True).encode_traces(traces))
+        eq_(items[0][0], expected[0][0])
+        ok_(b'meta' not in items[0][1])
+        eq_(items[0][2][b'meta'], {b'env': b'staging'})
+        eq_(items[0][3][b'meta'], {b'db.name': b'users', b'system.pid': b'42'})
+        # without the root span, the tags are kept
+        eq_(items[1], expected[1])
+
+        # by default, every span has its tags
+        eq_(msgpack.unpackb(MsgpackStreamEncoder().encode_traces(traces)), expected)
+
+    def test_join_encoded_traces(self):
+        # traces encoded one by one and joined must match the encoding
+        # of the whole list
+        traces = [
+            [Span(name='client.testing', tracer=None), Span(name='client.testing', tracer=None)],
+            [Span(name='client.testing', tracer=None)],
+        ]
+
+        for encoder, decode in [
+            (JSONEncoder(), json.loads),
+            (MsgpackEncoder(), msgpack.unpackb),
+            (MsgpackStreamEncoder(), msgpack.unpackb),
+        ]:
+            payload = encoder.join_encoded([encoder.encode_trace(trace) for trace in traces])
+            eq_(decode(payload), decode(encoder.encode_traces(traces)))
+            eq_(decode(encoder.join_encoded([])), [])
@@ -1,5 +1,8 @@
+import re
 from unittest import TestCase
 
+import mock
+
 from ddtrace.filters import FilterRequestsOnUrl
 from ddtrace.span import Span
 from ddtrace.ext.http import URL
@@ -32,3 +35,38 @@ class FilterRequestOnUrlTests(TestCase):
         filtr = FilterRequestsOnUrl(['http://domain\.example\.com', 'http://anotherdomain\.example\.com'])
         trace = filtr.process_trace([span])
         self.assertIsNotNone(trace)
+
+    def test_root_span_only(self):
+        root = Span(name='Name', tracer=None)
+        root.set_tag(URL, r'http://anotherexample.com')
+        child = Span(name='Name', tracer=None, parent_id=root.span_id)
+        child.set_tag(URL, r'http://example.com')
+        filtr = FilterRequestsOnUrl('http://examp.*.com')
+        self.assertIsNotNone(filtr.process_trace([root, child]))
+        # the root span isn't always the first one
+        root.set_tag(URL, r'http://example.com')
+        self.assertIsNone(filtr.process_trace([child, root]))
+
+    def test_merged_regexps(self):
+        filtr = FilterRequestsOnUrl([
+            r'http://example\.com/health$',
+            r'http://(api|www)\.example\.com',
+            r'http://(?P<sub>\w+)\.(?P=sub)\.com',
+            re.compile(r'http://EXAMPLE\.org', re.IGNORECASE),
+        ])
+        for url in ('http://example.com/health', 'http://api.example.com/users', 'http://a.a.com',
+                    'http://example.org'):
+            self.assertTrue(filtr._is_filtered(url), url)
+        for url in ('http://example.com/health/check', 'http://a.b.com', 'http://example.net'):
+            self.assertFalse(filtr._is_filtered(url), url)
+
+    def test_url_cache(self):
+        filtr = FilterRequestsOnUrl('http://example.com', cache_size=2)
+        filtr._match = mock.Mock(wraps=filtr._match)
+        for url in ('http://example.com/a', 'http://example.com/a', 'http://other.com/', 'http://example.com/a'):
+            filtr._is_filtered(url)
+        self.assertEqual(filtr._match.call_count, 2)
+
+        # the least recently used url is evicted
+        filtr._is_filtered('http://example.com/b')
+        self.assertEqual(list(filtr._cache), ['http://example.com/a', 'http://example.com/b'])
@@ -0,0 +1,86 @@
+import os
+import shutil
+import tempfile
+import time
+from unittest import TestCase
+
+import mock
+
+from ddtrace.api import Response
+from ddtrace.forwarder import ForwarderWriter, TraceForwarder
+
+from .test_writer import make_trace
+
+
+class ForwarderTests(TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, 'forwarder.sock')
+        self.forwarder = TraceForwarder(self.path, flush_interval=60)
+        self.forwarder.writer.api._put = mock.Mock(return_value=Response(status=200, body=b'{}'))
+        self.forwarder.start()
+
+    def tearDown(self):
+        self.forwarder.stop()
+        shutil.rmtree(self.dir)
+
+    def wait_for(self, predicate, timeout=5):
+        start = time.time()
+        while not predicate() and time.time() - start < timeout:
+            time.sleep(0.01)
+
+    def test_forward_traces(self):
+        writer = ForwarderWriter(self.path, flush_interval=60)
+        for i in range(5):
+            writer.write(spans=make_trace(3))
+        # the process doesn't queue anything
+        self.assertIsNone(writer._traces)
+
+        def received():
+            return self.forwarder.writer._traces and self.forwarder.writer._traces.size()
+
+        self.wait_for(lambda: received() == 5)
+        self.assertEqual(received(), 5)
+        self.assertEqual([trace.spans for trace in self.forwarder.writer._traces._things], [3] * 5)
+
+        # traces are sent to the agent in a single payload
+        self.forwarder.writer._worker._on_shutdown()
+        api = self.forwarder.writer.api
+        self.assertEqual(api._put.call_count, 1)
+        self.assertEqual(api._put.call_args[0][2], 5)
+
+    def test_forward_services(self):
+        api = self.forwarder.writer.api
+        api.send_services = mock.Mock(return_value=Response(status=200, body=b'{}'))
+        writer = ForwarderWriter(self.path, flush_interval=60)
+        writer.write(services={'web': {'app': 'flask', 'app_type': 'web'}})
+        self.wait_for(lambda: api.send_services.called)
+        api.send_services.assert_called_once_with([{'web': {'app': 'flask', 'app_type': 'web'}}])
+
+    def test_encoding_mismatch(self):
+        writer = ForwarderWriter(self.path, flush_interval=60)
+        writer.api._encoder.content_type = 'application/x-unknown'
+        writer.write(spans=make_trace(1))
+        self.wait_for(lambda: self.forwarder.dropped)
+        self.assertEqual(self.forwarder.dropped, 1)
+
+    def test_after_fork(self):
+        writer = ForwarderWriter(self.path, flush_interval=60)
+        writer.write(spans=make_trace(1))
+        sock = writer._sock
+        writer._after_fork()
+        # the socket of the parent is closed, the child opens its own
+        self.assertIsNone(writer._sock)
+        self.assertEqual(sock.fileno(), -1)
+        writer.write(spans=make_trace(1))
+        self.assertIsNot(writer._sock, sock)
+        self.wait_for(lambda: self.forwarder.writer._traces and self.forwarder.writer._traces.size() == 2)
+        self.assertEqual(self.forwarder.writer._traces.size(), 2)
+
+    def test_fallback(self):
+        # without forwarder the process sends its traces itself
+        writer = ForwarderWriter(os.path.join(self.dir, 'missing.sock'), flush_interval=60)
+        writer.write(spans=make_trace(2))
+        self.assertEqual(writer._traces.size(), 1)
+        self.assertEqual(writer._traces._things[0].spans, 2)
+        writer._worker.stop()
@@ -1,5 +1,7 @@
 from unittest import TestCase
 
+import mock
+
 from ddtrace import Pin
 from nose.tools import eq_, ok_, assert_raises
 
@@ -159,3 +161,16 @@ class PinTestCase(TestCase):
 
         ok_(global_pin._config['distributed_tracing'] is True)
         ok_(pin._config['distributed_tracing'] is False)
+
+    def test_onto_sends_once(self):
+        # the info of a pin put onto many objects is given once to the tracer
+        tracer = mock.Mock()
+        pin = Pin(service='metrics', app='redis', app_type='db', tracer=tracer)
+        pin.onto(self.Obj())
+        pin.onto(self.Obj())
+        tracer.set_service_info.assert_called_once_with(service='metrics', app='redis', app_type='db')
+
+        # a clone with another tracer or service sends it again
+        pin.clone(service='cache').onto(self.Obj())
+        pin.clone(tracer=mock.Mock()).onto(self.Obj())
+        eq_(tracer.set_service_info.call_count, 2)
@@ -0,0 +1,121 @@
+import weakref
+from unittest import TestCase, skipUnless
+
+import mock
+from nose.tools import eq_, ok_
+
+from ddtrace.api import API, Response
+from ddtrace.pool import SpanPool, SUPPORTED, release_traces
+from ddtrace.span import Span, TagLayer
+from ddtrace.tracer import Tracer
+from ddtrace.writer import AsyncWorker, ServiceQ, TraceQ
+
+from .test_tracer import DummyWriter
+
+
+def make_trace(pool, size=3):
+    root = pool.acquire(None, 'root')
+    root.set_tag('a', 'b')
+    root.set_metric('m', 1)
+    trace = [root]
+    for i in range(size - 1):
+        span = pool.acquire(None, 'child', trace_id=root.trace_id, parent_id=root.span_id)
+        span._parent = root
+        trace.append(span)
+    return trace
+
+
+@skipUnless(SUPPORTED, 'spans are only recycled on CPython')
+class SpanPoolTests(TestCase):
+    def test_recycle(self):
+        pool = SpanPool()
+        trace = make_trace(pool)
+        ids = set(id(span) for span in trace)
+        release_traces([trace])
+        eq_(len(pool), 3)
+        del trace
+
+        span = pool.acquire('tracer', 'name', service='s', parent_id=42)
+        ok_(id(span) in ids)
+        eq_(span.name, 'name')
+        eq_(span.resource, 'name')
+        eq_(span.service, 's')
+        eq_(span.parent_id, 42)
+        eq_(span.meta, {})
+        eq_(span.metrics, {})
+        eq_(span._tracer, 'tracer')
+        ok_(span._parent is None)
+        ok_(not span._finished)
+        eq_(pool.reused, 1)
+
+    def test_kept_spans_are_not_recycled(self):
+        pool = SpanPool()
+        trace = make_trace(pool, 4)
+        kept_root, kept_child = trace[0], trace[1]
+        meta = trace[2].meta
+        ref = weakref.ref(trace[3])  # noqa
+        release_traces([trace])
+        eq_(len(pool), 0)
+        # and they are still usable
+        eq_(kept_root.get_tag('a'), 'b')
+        ok_(kept_child._parent is kept_root)
+        eq_(meta, {})
+
+    def test_shared_meta(self):
+        pool = SpanPool()
+        layer = TagLayer({'env': 'prod'})
+        trace = make_trace(pool)
+        trace[1]._add_tag_layer(layer)
+        trace[2]._add_tag_layer(layer)
+        release_traces([trace])
+        del trace
+        eq_(len(pool), 3)
+        # the shared meta is left alone
+        eq_(layer.meta, {'env': 'prod'})
+        span = pool.acquire(None, 'name')
+        eq_(span.meta, {})
+        ok_(not span._shared_meta)
+
+    def test_max_size(self):
+        pool = SpanPool(max_size=2)
+        release_traces([make_trace(pool, 3)])
+        eq_(len(pool), 2)
+
+    def test_other_spans(self):
+        release_traces([[Span(None, 'a')], []])
+        pool = SpanPool()
+        trace = [Span(None, 'a')] + make_trace(pool, 1)
+        release_traces([trace])
+        eq_(len(pool), 0)
+
+    def test_tracer(self):
+        tracer = Tracer()
+        tracer.writer = DummyWriter()
+        ok_(tracer._span_pool is None)
+        tracer.configure(recycle_spans=True)
+        ok_(isinstance(tracer._span_pool, SpanPool))
+
+        with tracer.trace('root'):
+            with tracer.trace('child'):
+                pass
+        traces = tracer.writer.pop_traces()
+        tracer.writer.spans = []
+        release_traces(traces)
+        del traces
+        eq_(len(tracer._span_pool), 2)
+        with tracer.trace('root') as span:
+            eq_(span.get_tag('system.pid') is not None, True)
+        eq_(tracer._span_pool.reused, 1)
+
+        tracer.configure(recycle_spans=False)
+        ok_(tracer._span_pool is None)
+
+    def test_worker_releases_encoded_traces(self):
+        api = API('localhost', 8126)
+        api.send_payload = mock.Mock(return_value=Response(status=200))
+        traces = TraceQ()
+        worker = AsyncWorker(api, traces, ServiceQ())
+        pool = SpanPool()
+        worker._send_traces([make_trace(pool), make_trace(pool)])
+        eq_(api.send_payload.call_count, 1)
+        eq_(len(pool), 6)
@@ -1,10 +1,12 @@
 import time
 
-from nose.tools import eq_
+import mock
+
+from nose.tools import eq_, ok_
 from unittest.case import SkipTest
 
 from ddtrace.context import Context
-from ddtrace.span import Span
+from ddtrace.span import Span, TagLayer
 from ddtrace.ext import errors
 
 
@@ -86,6 +88,74 @@ def test_tags_not_string():
 
     s = Span(tracer=None, name="test.span")
     s.set_tag("a", Foo())
+    s.set_tag("b", "b")
+    # the tag is dropped when it's converted
+    eq_(s.get_tag("a"), None)
+    eq_(s.to_dict()["meta"], {"b": "b"})
+
+def test_tag_not_string_keeps_previous():
+    class Foo(object):
+        def __repr__(self):
+            1 / 0
+
+    s = Span(tracer=None, name="test.span")
+    s.set_tag("a", "a")
+    s.set_tag("a", Foo())
+    s.set_tag("b", 42)
+    eq_(s.meta, {"a": "a", "b": "42"})
+    s.set_tag("b", Foo())
+    # the previous value is kept, whether it was set or converted
+    eq_(s.get_tag("a"), "a")
+    eq_(s.get_tag("b"), "42")
+    eq_(s.to_dict()["meta"], {"a": "a", "b": "42"})
+
+def test_tags_converted_when_encoded():
+    class Counter(object):
+        def __init__(self):
+            self.calls = 0
+
+        def __str__(self):
+            self.calls += 1
+            return "counter"
+
+    s = Span(tracer=None, name="test.span")
+    counter = Counter()
+    s.set_tag("a", counter)
+    s.set_tag("b", 42)
+    s.set_tag("c", "c")
+    # the values are kept apart as they are
+    eq_(s._raw_tags, {"a": counter, "b": 42})
+    eq_(counter.calls, 0)
+    # get_tag returns the string that will be sent
+    eq_(s.get_tag("b"), "42")
+    eq_(s.get_tag("a"), "counter")
+    eq_(s.get_tag("c"), "c")
+    eq_(counter.calls, 1)
+    # meta only holds strings: it converts them once
+    eq_(s.meta, {"a": "counter", "b": "42", "c": "c"})
+    eq_(s.to_dict()["meta"], {"a": "counter", "b": "42", "c": "c"})
+    eq_(counter.calls, 2)
+    ok_(s._raw_tags is None)
+
+def test_tag_set_again():
+    s = Span(tracer=None, name="test.span")
+    s.set_tag("a", 1)
+    s.set_tag("a", "one")
+    s.set_tag("b", "two")
+    s.set_tag("b", 2)
+    eq_(s.meta, {"a": "one", "b": "2"})
+    s._remove_tag("a")
+    s.set_tag("c", 3)
+    s._remove_tag("c")
+    eq_(s.meta, {"b": "2"})
+
+def test_exc_info_not_kept():
+    s = Span(tracer=None, name="test.span")
+    try:
+        raise ValueError("error message")
+    except ValueError:
+        s.set_traceback()
+    eq_(s.meta[errors.ERROR_MSG], "error message")
 
 def test_finish():
     # ensure finish will record a span
@@ -127,6 +197,45 @@ def test_finish_set_span_duration():
     s.finish()
     assert s.duration == 1337.0
 
+def test_ns_timestamps():
+    s = Span(tracer=None, name='test.span')
+    eq_(type(s.start_ns), int)
+    assert abs(s.start - time.time()) < 1
+    s.finish()
+    eq_(type(s.duration_ns), int)
+    assert s.duration_ns >= 0
+    eq_(s.duration, s.duration_ns / 1e9)
+
+    d = s.to_dict()
+    eq_(d['start'], s.start_ns)
+    eq_(type(d['start']), int)
+
+
+def test_duration_monotonic_clock():
+    # wall clock steps don't change the duration
+    with mock.patch('ddtrace.span.monotonic_ns', return_value=1000):
+        s = Span(tracer=None, name='test.span')
+    with mock.patch('ddtrace.span.time_ns', return_value=0), \
+            mock.patch('ddtrace.span.monotonic_ns', return_value=1500):
+        s.finish()
+    eq_(s.duration_ns, 500)
+
+
+def test_given_start_and_finish_time():
+    # float seconds since the epoch are precise to the microsecond
+    s = Span(tracer=None, name='test.span', start=1500000000.5)
+    assert abs(s.start_ns - 1500000000500000000) < 1000
+    s.finish(finish_time=1500000001.75)
+    assert abs(s.duration_ns - 1250000000) < 1000
+
+    # setting the start time doesn't use the monotonic clock anymore
+    s = Span(tracer=None, name='test.span')
+    s.start = 1500000000.0
+    assert abs(s.start_ns - 1500000000000000000) < 1000
+    s.finish()
+    assert s.duration > 1
+
+
 def test_traceback_with_error():
     s = Span(None, "test.span")
     try:
@@ -242,3 +351,73 @@ class DummyTracer(object):
     def record(self, span):
         self.last_span = span
         self.spans_recorded += 1
+
+
+def test_tag_layer():
+    layer = TagLayer({'env': 'prod', 'port': 6379})
+    eq_(layer.meta, {'env': 'prod', 'port': '6379'})
+    s1 = Span(tracer=None, name="s1")
+    s2 = Span(tracer=None, name="s2")
+    s1._add_tag_layer(layer)
+    s2._add_tag_layer(layer)
+    # the meta is shared until a tag is set
+    assert s1._meta is layer.meta
+    assert s2._meta is layer.meta
+    eq_(s1.get_tag('port'), '6379')
+
+    s1.set_tag('key', 'value')
+    eq_(s1.meta, {'env': 'prod', 'port': '6379', 'key': 'value'})
+    eq_(layer.meta, {'env': 'prod', 'port': '6379'})
+    s2._remove_tag('env')
+    eq_(s2.meta, {'port': '6379'})
+    eq_(layer.meta, {'env': 'prod', 'port': '6379'})
+
+    # tags set before the layer are kept, those of the layer are set on top
+    s3 = Span(tracer=None, name="s3")
+    s3.set_tag('env', 'dev')
+    s3.set_tag('key', 'value')
+    s3._add_tag_layer(layer)
+    eq_(s3.meta, {'env': 'prod', 'port': '6379', 'key': 'value'})
+    s3._add_tag_layer(None)
+    eq_(len(s3.meta), 3)
+
+
+def test_tag_layer_meta_not_changed():
+    # the shared meta is copied before it's given to the application
+    layer = TagLayer({'env': 'prod'})
+    s1 = Span(tracer=None, name="s1")
+    s2 = Span(tracer=None, name="s2")
+    s1._add_tag_layer(layer)
+    s2._add_tag_layer(layer)
+    s1.meta['user'] = 'x'
+    eq_(s1.meta, {'env': 'prod', 'user': 'x'})
+    eq_(s2.meta, {'env': 'prod'})
+    eq_(layer.meta, {'env': 'prod'})
+
+
+def test_tag_layer_merge():
+    base = TagLayer({'env': 'prod', 'db': 'main'})
+    layer = TagLayer({'db': 'users'})
+    spans = [Span(tracer=None, name="s") for _ in range(2)]
+    for span in spans:
+        span._add_tag_layer(base)
+        span._add_tag_layer(layer)
+    # the merge is shared too
+    assert spans[0]._meta is spans[1]._meta
+    eq_(spans[0].meta, {'env': 'prod', 'db': 'users'})
+    eq_(base.meta, {'env': 'prod', 'db': 'main'})
+
+
+def test_tag_layer_get():
+    eq_(TagLayer.get(None, {}), None)
+    eq_(TagLayer.get(None, None), None)
+    tags = {'env': 'prod'}
+    layer = TagLayer.get(None, tags)
+    eq_(layer.meta, tags)
+    assert TagLayer.get(layer, {'env': 'prod'}) is layer
+    # the layer doesn't change with the tags it was created from
+    tags['env'] = 'staging'
+    new_layer = TagLayer.get(layer, tags)
+    assert new_layer is not layer
+    eq_(new_layer.meta, {'env': 'staging'})
+    eq_(layer.meta, {'env': 'prod'})
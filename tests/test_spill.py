@@ -0,0 +1,106 @@
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+
+from ddtrace.api import Payload
+from ddtrace.spill import SpillFile, HEADER_SIZE, RECORD, open_spill_file
+
+
+class SpillFileTests(TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, 'traces.spill')
+        self.spills = []
+
+    def tearDown(self):
+        for spill in self.spills:
+            spill.close()
+        shutil.rmtree(self.dir)
+
+    def open(self, size=HEADER_SIZE + 4096):
+        spill = SpillFile(self.path, size)
+        self.spills.append(spill)
+        return spill
+
+    def payload(self, n, size=100):
+        return Payload(bytes(bytearray([n % 256])) * size, n, 'application/msgpack')
+
+    def test_append_pop(self):
+        spill = self.open()
+        self.assertIsNone(spill.pop())
+        self.assertTrue(spill.append(self.payload(1)))
+        self.assertTrue(spill.append(self.payload(2)))
+        self.assertEqual(len(spill), 2 * (RECORD.size + len('application/msgpack') + 100))
+
+        payload = spill.pop()
+        self.assertEqual(payload.count, 1)
+        self.assertEqual(payload.data, b'\x01' * 100)
+        self.assertEqual(payload.content_type, 'application/msgpack')
+        self.assertEqual(spill.pop().count, 2)
+        self.assertIsNone(spill.pop())
+        self.assertEqual(len(spill), 0)
+
+    def test_overwrite_oldest(self):
+        spill = self.open()
+        # ~32 records fit in the file, the first ones are overwritten
+        for i in range(1, 101):
+            self.assertTrue(spill.append(self.payload(i)))
+        self.assertLessEqual(len(spill), 4096)
+        self.assertGreater(spill.dropped, 0)
+
+        counts = []
+        payload = spill.pop()
+        while payload:
+            self.assertEqual(payload.data, bytes(bytearray([payload.count])) * 100)
+            counts.append(payload.count)
+            payload = spill.pop()
+        self.assertEqual(counts, list(range(101 - len(counts), 101)))
+        self.assertEqual(spill.dropped, sum(range(1, 101 - len(counts))))
+
+    def test_wrap_around(self):
+        spill = self.open()
+        # records of different sizes end up wrapping at different offsets
+        for i in range(1, 300):
+            spill.append(self.payload(i, size=i * 7 % 500))
+            if i % 3 == 0:
+                payload = spill.pop()
+                self.assertEqual(len(payload.data), payload.count * 7 % 500)
+
+    def test_overwrite_all(self):
+        # the new record doesn't fit at the end of the file, nor before it
+        # once the other records are dropped
+        spill = self.open()
+        self.assertTrue(spill.append(self.payload(1, size=2900)))
+        self.assertTrue(spill.append(self.payload(2, size=3000)))
+        self.assertEqual(spill.dropped, 1)
+        self.assertEqual(len(spill), RECORD.size + len('application/msgpack') + 3000)
+        payload = spill.pop()
+        self.assertEqual(payload.count, 2)
+        self.assertEqual(payload.data, b'\x02' * 3000)
+        self.assertIsNone(spill.pop())
+
+    def test_too_large(self):
+        spill = self.open()
+        spill.append(self.payload(1))
+        self.assertFalse(spill.append(self.payload(2, size=5000)))
+        self.assertEqual(spill.dropped, 2)
+        self.assertEqual(spill.pop().count, 1)
+
+    def test_reopen(self):
+        spill = self.open()
+        for i in range(1, 4):
+            spill.append(self.payload(i))
+        spill.pop()
+        spill.close()
+        self.spills.remove(spill)
+
+        spill = self.open()
+        self.assertEqual(spill.pop().count, 2)
+        self.assertEqual(spill.pop().count, 3)
+        self.assertIsNone(spill.pop())
+
+    def test_locked(self):
+        self.open()
+        # the file can be used by one process at a time
+        self.assertIsNone(open_spill_file(self.path, 8192))
@@ -0,0 +1,73 @@
+from unittest import TestCase
+
+import mock
+
+from ddtrace.stats import Histogram, StatsReporter, WriterStats
+
+
+class HistogramTests(TestCase):
+    def test_add(self):
+        histogram = Histogram((1, 10))
+        for value in (0.5, 1, 5, 20, 30):
+            histogram.add(value)
+        self.assertEqual(histogram.to_dict(), {
+            'count': 5,
+            'sum': 56.5,
+            'min': 0.5,
+            'max': 30,
+            'buckets': [(1, 2), (10, 1), (float('inf'), 2)],
+        })
+
+
+class WriterStatsTests(TestCase):
+    def test_snapshot(self):
+        stats = WriterStats()
+        stats.increment('traces.sent', 3)
+        stats.increment('traces.sent')
+        stats.record('http.duration', 0.2)
+        stats.record('payload.bytes', 2048)
+        snapshot = stats.snapshot()
+        self.assertEqual(snapshot['traces.sent'], 4)
+        self.assertEqual(snapshot['http.duration']['count'], 1)
+        self.assertEqual(snapshot['payload.bytes']['buckets'][1], (4 << 10, 1))
+
+        # snapshots are copies
+        stats.increment('traces.sent')
+        self.assertEqual(snapshot['traces.sent'], 4)
+
+
+class StatsReporterTests(TestCase):
+    def test_report(self):
+        client = mock.Mock()
+        reporter = StatsReporter(client, prefix='test.')
+        stats = WriterStats()
+        stats.increment('traces.sent', 3)
+        stats.record('http.duration', 0.2)
+        stats.record('http.duration', 0.4)
+        snapshot = stats.snapshot()
+        snapshot['queue.traces'] = 7
+        reporter.report(snapshot)
+        client.increment.assert_has_calls([
+            mock.call('test.traces.sent', 3),
+            mock.call('test.http.duration.count', 2),
+        ], any_order=True)
+        client.gauge.assert_has_calls([
+            mock.call('test.queue.traces', 7),
+            mock.call('test.http.duration.max', 0.4),
+        ], any_order=True)
+
+        # counters are reported as increments since the previous report
+        client.reset_mock()
+        stats.increment('traces.sent', 2)
+        stats.record('http.duration', 1.0)
+        reporter.report(stats.snapshot())
+        client.increment.assert_has_calls([
+            mock.call('test.traces.sent', 2),
+            mock.call('test.http.duration.count', 1),
+        ], any_order=True)
+        client.gauge.assert_any_call('test.http.duration.avg', 1.0)
+
+        # nothing changed
+        client.reset_mock()
+        reporter.report(stats.snapshot())
+        client.increment.assert_not_called()
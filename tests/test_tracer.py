@@ -12,6 +12,7 @@ from unittest.case import SkipTest
 
 from ddtrace.encoding import JSONEncoder, MsgpackEncoder
 from ddtrace.ext import system
+from ddtrace.span import NoopSpan
 from ddtrace.tracer import Tracer
 from ddtrace.writer import AgentWriter
 from ddtrace.context import Context
@@ -378,6 +379,19 @@ def test_tracer_global_tags():
     assert s3.get_tag('env') == 'staging'
     assert s3.get_tag('other') == 'tag'
 
+    # the children share the global tags until they set their own
+    tracer.tags['env'] = 'dev'
+    with tracer.trace('root'):
+        with tracer.trace('child') as child1:
+            pass
+        with tracer.trace('child') as child2:
+            child2.set_tag('key', 'value')
+        with tracer.trace('child') as child3:
+            pass
+    assert child1._meta is child3._meta
+    eq_(child1.meta, {'env': 'dev', 'other': 'tag'})
+    eq_(child2.meta, {'env': 'dev', 'other': 'tag', 'key': 'value'})
+
 
 def test_global_context():
     # the tracer uses a global thread-local Context
@@ -485,6 +499,104 @@ def test_start_child_from_context():
     eq_(child, child._context._current_span)
 
 
+def test_set_service_info_sends_changes():
+    tracer = get_dummy_tracer()
+    writer = tracer.writer
+    with mock.patch.object(writer, 'write', wraps=writer.write) as write:
+        tracer.set_service_info('web', 'flask', 'web')
+        tracer.set_service_info('db', 'postgres', 'db')
+        # nothing changed
+        tracer.set_service_info('web', 'flask', 'web')
+        tracer.set_service_info('web', 'django', 'web')
+
+    eq_(write.call_args_list, [
+        mock.call(services={'web': {'app': 'flask', 'app_type': 'web'}}),
+        mock.call(services={'db': {'app': 'postgres', 'app_type': 'db'}}),
+        mock.call(services={'web': {'app': 'django', 'app_type': 'web'}}),
+    ])
+    eq_(writer.pop_services(), {
+        'web': {'app': 'django', 'app_type': 'web'},
+        'db': {'app': 'postgres', 'app_type': 'db'},
+    })
+
+
+def test_partial_flush():
+    tracer = get_dummy_tracer()
+    tracer.configure(partial_flush_min_spans=5)
+    with tracer.trace('root'):
+        for i in range(12):
+            with tracer.trace('child'):
+                pass
+            if i == 4:
+                spans = tracer.writer.pop()
+                eq_([span.name for span in spans], ['child'] * 5)
+        eq_(len(tracer.writer.pop()), 5)
+        eq_(len(tracer.get_call_context()._trace), 3)
+    # the last spans, with the root span
+    spans = tracer.writer.pop()
+    eq_([span.name for span in spans], ['root', 'child', 'child'])
+
+    tracer.configure(partial_flush_min_spans=0)
+    with tracer.trace('root'):
+        for i in range(12):
+            with tracer.trace('child'):
+                pass
+    eq_(len(tracer.writer.pop()), 13)
+
+
+def test_max_spans_per_trace():
+    tracer = get_dummy_tracer()
+    tracer.configure(max_spans_per_trace=3)
+    with tracer.trace('root') as root:
+        with tracer.trace('other') as span:
+            ok_(not isinstance(span, NoopSpan))
+        with tracer.trace('child') as child:
+            for _ in range(5):
+                with tracer.trace('loop', service='db') as span:
+                    span.set_tag('key', 'value')
+                    ok_(isinstance(span, NoopSpan))
+                    eq_(span.trace_id, root.trace_id)
+                    eq_(span.span_id, child.span_id)
+                    # the spans past the maximum are never the current span
+                    eq_(tracer.current_span(), child)
+                    eq_(span.get_tag('key'), None)
+        with tracer.trace('other') as span:
+            ok_(isinstance(span, NoopSpan))
+
+    spans = tracer.writer.pop()
+    eq_([span.name for span in spans], ['root', 'other', 'child'])
+    eq_(root.get_metric('_dd.dropped_spans'), 6)
+    eq_(root.get_metric('_dd.dropped_spans.db.loop.count'), 5)
+    ok_(root.get_metric('_dd.dropped_spans.db.loop.duration') >= 0)
+    eq_(root.get_metric('_dd.dropped_spans.no_service.other.count'), 1)
+
+    # the next trace starts from scratch
+    with tracer.trace('root') as root:
+        with tracer.trace('child'):
+            pass
+    eq_(len(tracer.writer.pop()), 2)
+    eq_(root.get_metric('_dd.dropped_spans'), None)
+
+
+def test_max_spans_per_trace_partial_flush():
+    # the spans already flushed count in the maximum
+    tracer = get_dummy_tracer()
+    tracer.configure(max_spans_per_trace=4, partial_flush_min_spans=2)
+    with tracer.trace('root') as root:
+        for _ in range(5):
+            with tracer.trace('child'):
+                pass
+    eq_(len(tracer.writer.pop()), 4)
+    eq_(root.get_metric('_dd.dropped_spans'), 2)
+
+    tracer.configure(max_spans_per_trace=0)
+    with tracer.trace('root'):
+        for _ in range(5):
+            with tracer.trace('child'):
+                pass
+    eq_(len(tracer.writer.pop()), 6)
+
+
 class DummyWriter(AgentWriter):
     """ DummyWriter is a small fake writer used for tests. not thread-safe. """
 
@@ -1,10 +1,12 @@
 import os
+import threading
 import unittest
 import warnings
 
 from nose.tools import eq_, ok_
 
 from ddtrace.utils.deprecation import deprecation, deprecated, format_message
+from ddtrace.utils import ids
 from ddtrace.utils.formats import asbool, get_env
 
 
@@ -89,3 +91,37 @@ class TestUtilities(unittest.TestCase):
             ok_(len(w) == 1)
             ok_(issubclass(w[-1].category, DeprecationWarning))
             ok_('decorator' in str(w[-1].message))
+
+    def test_new_id(self):
+        generated = set(ids.new_id() for _ in range(ids.BATCH_SIZE * 3))
+        eq_(len(generated), ids.BATCH_SIZE * 3)
+        ok_(all(0 <= i < 2 ** 64 for i in generated))
+
+    def test_new_id_threads(self):
+        generated = []
+
+        def generate():
+            generated.extend(ids.new_id() for _ in range(ids.BATCH_SIZE * 2))
+
+        threads = [threading.Thread(target=generate) for _ in range(4)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        eq_(len(set(generated)), ids.BATCH_SIZE * 8)
+
+    @unittest.skipUnless(hasattr(os, 'fork'), 'fork is not available')
+    def test_new_id_after_fork(self):
+        # the child doesn't reuse the ids buffered by the parent
+        ids.new_id()
+        r, w = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            if not ids.AT_FORK:
+                ids._check_pid()
+            os.write(w, str(len(ids._ids)).encode())
+            os._exit(0)
+        os.waitpid(pid, 0)
+        eq_(os.read(r, 16), b'0')
+        os.close(r)
+        os.close(w)
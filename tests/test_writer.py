@@ -1,7 +1,24 @@
-from unittest import TestCase
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+from unittest import TestCase, skipUnless
 
+import mock
+
+from ddtrace.api import API, Payload, Response
+from ddtrace.constants import SAMPLING_PRIORITY_KEY
+from ddtrace.encoding import JSONEncoder, MsgpackEncoder
+from ddtrace.ext.priority import AUTO_REJECT, USER_KEEP, USER_REJECT
 from ddtrace.span import Span
-from ddtrace.writer import AsyncWorker, Q
+from ddtrace.spill import SpillFile
+from ddtrace.writer import (
+    AT_FORK, _reset_writers_after_fork, AgentWriter, AsyncWorker, EncodedTrace, Q, ServiceQ, Spool, TraceQ,
+    DROP_BY_PRIORITY, DROP_NEWEST, DROP_OLDEST,
+    estimate_trace_size,
+)
 
 class RemoveAllFilter():
     def __init__(self):
@@ -31,6 +48,9 @@ class AddTagFilter():
         return trace
 
 class DummmyAPI():
+    content_type = 'dummy'
+    url = 'dummy'
+
     def __init__(self):
         self.traces = []
 
@@ -38,13 +58,46 @@ class DummmyAPI():
         for trace in traces:
             self.traces.append(trace)
 
+    def encode_traces(self, traces):
+        return [Payload(traces, len(traces), self.content_type)]
+
+    def join_encoded_traces(self, encoded):
+        return self.encode_traces(encoded)
+
+    def send_payload(self, payload):
+        if isinstance(payload.data, bytes):
+            self.traces.append(payload.data)
+        else:
+            self.send_traces(payload.data)
+        return Response(status=200)
+
+    def send_services(self, services):
+        pass
+
+
+class FailingAPI(DummmyAPI):
+    """Fails the first `failures` payloads, with an exception or a 5xx status."""
+    def __init__(self, failures, status=None):
+        DummmyAPI.__init__(self)
+        self.failures = failures
+        self.status = status
+        self.attempts = 0
+
+    def send_payload(self, payload):
+        self.attempts += 1
+        if self.attempts <= self.failures:
+            if self.status:
+                return Response(status=self.status)
+            raise IOError('agent unavailable')
+        return DummmyAPI.send_payload(self, payload)
+
 N_TRACES = 11
 
 class AsyncWorkerTests(TestCase):
     def setUp(self):
         self.api = DummmyAPI()
         self.traces = Q()
-        self.services = Q()
+        self.services = ServiceQ()
         for i in range(N_TRACES):
             self.traces.add([Span(tracer=None, name="name", trace_id=i, span_id=j, parent_id=j-1 or None) for j in range(7)])
 
@@ -87,3 +140,574 @@ class AsyncWorkerTests(TestCase):
         worker.join()
         self.assertEqual(len(self.api.traces), 0)
         self.assertEqual(filtr.filtered_traces, 0)
+
+
+class SizedQ(Q):
+    def _size(self, thing):
+        return len(thing)
+
+
+def make_trace(n_spans, priority=None):
+    trace = [Span(tracer=None, name='name') for _ in range(n_spans)]
+    if priority is not None:
+        trace[0].set_metric(SAMPLING_PRIORITY_KEY, priority)
+    return trace
+
+
+class QTests(TestCase):
+    def test_max_size_drop_newest(self):
+        q = Q(max_size=2, policy=DROP_NEWEST)
+        self.assertTrue(q.add(1))
+        self.assertTrue(q.add(2))
+        self.assertFalse(q.add(3))
+        self.assertEqual(q.pop(), [1, 2])
+        self.assertEqual(q.dropped, 1)
+
+    def test_max_size_drop_oldest(self):
+        q = Q(max_size=2, policy=DROP_OLDEST)
+        q.add(1)
+        q.add(2)
+        self.assertTrue(q.add(3))
+        self.assertEqual(q.pop(), [2, 3])
+        self.assertEqual(q.dropped, 1)
+
+    def test_max_bytes(self):
+        q = SizedQ(max_size=0, max_bytes=10, policy=DROP_OLDEST)
+        q.add('aaaa')
+        q.add('bbbb')
+        q.add('cccccc')
+        self.assertEqual(q.pop(), ['bbbb', 'cccccc'])
+        # a single item bigger than the budget is never queued
+        self.assertFalse(q.add('d' * 11))
+        self.assertEqual(q.size(), 0)
+        self.assertEqual(q.dropped, 2)
+
+    def test_trace_q_drop_by_priority(self):
+        q = TraceQ(max_size=2, policy=DROP_BY_PRIORITY)
+        keep = make_trace(1, USER_KEEP)
+        reject = make_trace(2, AUTO_REJECT)
+        default = make_trace(1)
+        q.add(keep)
+        q.add(reject)
+        # the lowest priority trace is evicted
+        self.assertTrue(q.add(default))
+        # a trace with a lower priority than everything queued is dropped
+        self.assertFalse(q.add(make_trace(3, USER_REJECT)))
+        self.assertEqual(q.pop(), [keep, default])
+        self.assertEqual(q.dropped, 2)
+        self.assertEqual(q.dropped_spans, 5)
+
+    def test_estimate_trace_size_raw_tags(self):
+        # the tags are only converted to strings when encoded
+        trace = make_trace(1)
+        size = estimate_trace_size(trace)
+        trace[0].set_tag('http.status_code', 200)
+        self.assertTrue(estimate_trace_size(trace) > size)
+
+    def test_trace_q_max_bytes(self):
+        trace = make_trace(10)
+        size = estimate_trace_size(trace)
+        q = TraceQ(max_size=0, max_bytes=size * 3, policy=DROP_NEWEST)
+        for _ in range(5):
+            q.add(make_trace(10))
+        self.assertEqual(q.size(), 3)
+        self.assertEqual(q.dropped, 2)
+        self.assertEqual(q.dropped_spans, 20)
+
+    def test_wait_flush_size(self):
+        q = Q(flush_size=2)
+        q.add(1)
+        start = time.time()
+        t = threading.Timer(0.05, q.add, args=(2,))
+        t.start()
+        q.wait(timeout=5)
+        t.join()
+        self.assertLess(time.time() - start, 1)
+        self.assertEqual(q.pop(), [1, 2])
+
+    def test_wait_flush_bytes(self):
+        q = SizedQ(flush_bytes=10)
+        q.add('abcde')
+        t = threading.Timer(0.05, q.add, args=('fghij',))
+        t.start()
+        start = time.time()
+        q.wait(timeout=5)
+        t.join()
+        self.assertLess(time.time() - start, 1)
+        self.assertEqual(q.pop(), ['abcde', 'fghij'])
+
+    def test_wait_max_age(self):
+        q = Q(max_age=0.05)
+        q.add(1)
+        start = time.time()
+        q.wait(timeout=5)
+        self.assertLess(time.time() - start, 1)
+
+    def test_wait_others(self):
+        q = Q(flush_size=10)
+        other = Q(flush_size=1, condition=q.condition)
+        t = threading.Timer(0.05, other.add, args=(1,))
+        t.start()
+        start = time.time()
+        q.wait(timeout=5, others=(other,))
+        t.join()
+        self.assertLess(time.time() - start, 1)
+
+    def test_wait_closed(self):
+        q = Q()
+        t = threading.Timer(0.05, q.close)
+        t.start()
+        start = time.time()
+        q.wait(timeout=5)
+        t.join()
+        self.assertLess(time.time() - start, 1)
+        self.assertTrue(q.closed())
+
+    def test_service_q_merges(self):
+        q = ServiceQ(flush_size=1)
+        q.add({'web': {'app': 'flask', 'app_type': 'web'}})
+        q.add({'db': {'app': 'postgres', 'app_type': 'db'}})
+        q.add({'web': {'app': 'django', 'app_type': 'web'}})
+        self.assertEqual(q.size(), 1)
+        self.assertEqual(q.added, 3)
+        self.assertEqual(q.pop(), [{
+            'web': {'app': 'django', 'app_type': 'web'},
+            'db': {'app': 'postgres', 'app_type': 'db'},
+        }])
+        self.assertIsNone(q.pop())
+
+    def test_service_q_requeue(self):
+        q = ServiceQ(flush_size=1)
+        q.add({'web': {'app': 'flask', 'app_type': 'web'}})
+        services = q.pop()
+        q.add({'web': {'app': 'django', 'app_type': 'web'}})
+        # the services added since the pop win
+        q.requeue(services + [{'db': {'app': 'postgres', 'app_type': 'db'}}], time.time() + 0.05)
+        self.assertIsNone(q.pop())
+        q.wait(timeout=0)
+        time.sleep(0.05)
+        self.assertEqual(q.pop(), [{
+            'web': {'app': 'django', 'app_type': 'web'},
+            'db': {'app': 'postgres', 'app_type': 'db'},
+        }])
+        self.assertIsNone(q.retry_at)
+
+
+class AgentWriterTests(TestCase):
+    def test_flush_size_wakes_worker(self):
+        # the worker must not wait for the flush interval when the queue is full
+        writer = AgentWriter(flush_interval=60, flush_size=N_TRACES)
+        writer.api = DummmyAPI()
+        for i in range(N_TRACES):
+            writer.write(spans=[Span(tracer=None, name='name')])
+
+        start = time.time()
+        while len(writer.api.traces) < N_TRACES and time.time() - start < 5:
+            time.sleep(0.01)
+        self.assertEqual(len(writer.api.traces), N_TRACES)
+        self.assertLess(time.time() - start, 5)
+
+    def test_flush_interval(self):
+        # traces written slowly are sent after the flush interval
+        writer = AgentWriter(flush_interval=0.2)
+        writer.api = DummmyAPI()
+        for i in range(5):
+            writer.write(spans=[Span(tracer=None, name='name')])
+            time.sleep(0.05)
+
+        start = time.time()
+        while len(writer.api.traces) < 5 and time.time() - start < 2:
+            time.sleep(0.01)
+        self.assertEqual(len(writer.api.traces), 5)
+        writer._worker.stop()
+        writer._worker.join()
+
+    def test_dropped_counters(self):
+        writer = AgentWriter(flush_interval=60, max_bytes=1, drop_policy=DROP_NEWEST)
+        writer.api = DummmyAPI()
+        writer.write(spans=make_trace(3))
+        self.assertEqual(writer.dropped_traces, 1)
+        self.assertEqual(writer.dropped_spans, 3)
+
+    def test_shutdown_drains_queue(self):
+        writer = AgentWriter(flush_interval=60)
+        writer.api = DummmyAPI()
+        writer.write(spans=[Span(tracer=None, name='name')])
+        writer.write(spans=[Span(tracer=None, name='name')])
+        worker = writer._worker
+        worker._on_shutdown()
+        self.assertEqual(len(writer.api.traces), 2)
+        self.assertFalse(worker.is_alive())
+        # the worker unsets itself when it exits
+        self.assertIsNone(writer._worker)
+
+
+class WorkerTestCase(TestCase):
+    def make_worker(self, api, **kwargs):
+        kwargs.setdefault('backoff_base', 0.01)
+        kwargs.setdefault('backoff_max', 0.05)
+        traces = TraceQ(flush_size=1)
+        return AsyncWorker(api, traces, ServiceQ(flush_size=1, condition=traces.condition), **kwargs), traces
+
+    def wait_for(self, predicate, timeout=5):
+        start = time.time()
+        while not predicate() and time.time() - start < timeout:
+            time.sleep(0.01)
+
+
+class ForkTests(TestCase):
+    def test_reset_after_fork(self):
+        writer = AgentWriter(flush_interval=60)
+        writer.api._close_connection = mock.Mock()
+        writer.write(spans=make_trace(1))
+        worker, traces = writer._worker, writer._traces
+
+        _reset_writers_after_fork()
+        writer.api._close_connection.assert_called_once_with()
+        self.assertIsNone(writer._worker)
+
+        writer.write(spans=make_trace(1))
+        self.assertIsNot(writer._worker, worker)
+        self.assertIsNot(writer._traces, traces)
+        self.assertEqual(writer._traces.size(), 1)
+        worker.stop()
+        writer._worker.stop()
+
+    @skipUnless(AT_FORK, 'os.register_at_fork is not available')
+    def test_fork(self):
+        writer = AgentWriter(flush_interval=60)
+        writer.api = DummmyAPI()
+        writer.api._close_connection = lambda: None
+        writer.write(spans=make_trace(1))
+        pid = os.fork()
+        if pid == 0:
+            # the child doesn't use the queue and the worker of its parent
+            ok = writer._worker is None and writer._traces is None
+            writer.write(spans=make_trace(1))
+            ok = ok and writer._traces.size() == 1 and writer._worker.is_alive()
+            os._exit(0 if ok else 1)
+        _, status = os.waitpid(pid, 0)
+        self.assertEqual(status, 0)
+        self.assertEqual(writer._traces.size(), 1)
+        writer._worker.stop()
+
+    def test_pid_fallback(self):
+        writer = AgentWriter(flush_interval=60)
+        writer._at_fork = False
+        writer.write(spans=make_trace(1))
+        worker = writer._worker
+        writer._pid = os.getpid() + 1
+        writer.write(spans=make_trace(1))
+        self.assertIsNot(writer._worker, worker)
+        self.assertEqual(writer._traces.size(), 1)
+        worker.stop()
+        writer._worker.stop()
+
+    def test_restart_dead_worker(self):
+        writer = AgentWriter(flush_interval=60)
+        writer.api = DummmyAPI()
+        # the thread of the worker dies without closing the queue
+        die = threading.Event()
+        with mock.patch.object(AsyncWorker, '_target', side_effect=lambda: die.wait(5)):
+            writer.write(spans=make_trace(1))
+            worker = writer._worker
+            die.set()
+            worker.join()
+        self.assertIsNone(writer._worker)
+        writer.write(spans=make_trace(1))
+        self.assertIsNot(writer._worker, worker)
+        self.assertTrue(writer._worker.is_alive())
+        writer._worker.stop()
+
+
+class RetryTests(WorkerTestCase):
+    def test_retry_services(self):
+        for failure in (IOError('agent unavailable'), Response(status=503)):
+            api = DummmyAPI()
+            sent = []
+
+            def send_services(services, failures=[failure]):
+                if failures:
+                    failure = failures.pop()
+                    if isinstance(failure, Exception):
+                        raise failure
+                    return failure
+                sent.append(services)
+                return Response(status=200)
+
+            api.send_services = send_services
+            worker, traces = self.make_worker(api)
+            worker._service_queue.add({'web': {'app': 'flask', 'app_type': 'web'}})
+            self.wait_for(lambda: sent)
+            worker.stop()
+            self.assertEqual(sent, [[{'web': {'app': 'flask', 'app_type': 'web'}}]])
+            self.assertEqual(worker._service_failures, 0)
+
+    def test_retry_until_agent_recovers(self):
+        api = FailingAPI(3)
+        worker, traces = self.make_worker(api)
+        traces.add(make_trace(2))
+        self.wait_for(lambda: api.traces)
+        self.assertEqual(len(api.traces), 1)
+        self.assertEqual(api.attempts, 4)
+        self.assertFalse(worker._spool)
+        worker.stop()
+
+    def test_retry_server_errors(self):
+        api = FailingAPI(1, status=503)
+        worker, traces = self.make_worker(api)
+        traces.add(make_trace(2))
+        self.wait_for(lambda: api.traces)
+        self.assertEqual(len(api.traces), 1)
+        self.assertEqual(api.attempts, 2)
+        worker.stop()
+
+    def test_no_retry_on_client_errors(self):
+        api = FailingAPI(1, status=400)
+        worker, traces = self.make_worker(api)
+        traces.add(make_trace(2))
+        self.wait_for(lambda: api.attempts)
+        worker.stop()
+        worker.join()
+        self.assertEqual(api.attempts, 1)
+        self.assertFalse(worker._spool)
+
+    def test_max_retries(self):
+        api = FailingAPI(100)
+        worker, traces = self.make_worker(api, max_retries=2)
+        traces.add(make_trace(2))
+        self.wait_for(lambda: api.attempts >= 3)
+        time.sleep(0.1)
+        self.assertEqual(api.attempts, 3)
+        self.assertFalse(worker._spool)
+        worker.stop()
+
+    def test_backoff(self):
+        worker, _ = self.make_worker(DummmyAPI(), backoff_base=1, backoff_max=8)
+        worker.stop()
+        for failures, cap in ((1, 1), (2, 2), (3, 4), (4, 8), (10, 8), (1000, 8)):
+            delay = worker._backoff(failures)
+            self.assertGreaterEqual(delay, cap / 2.0)
+            self.assertLessEqual(delay, cap)
+
+    def test_spool_max_bytes(self):
+        spool = Spool(10)
+        spool.add(Payload(b'x' * 4, 1, 'dummy'))
+        spool.add(Payload(b'x' * 4, 2, 'dummy'))
+        self.assertEqual((len(spool), spool.bytes, spool.traces), (2, 8, 3))
+        # the oldest payload is dropped to make room
+        spool.add(Payload(b'x' * 4, 3, 'dummy'))
+        self.assertEqual((len(spool), spool.bytes, spool.traces, spool.dropped), (2, 8, 5, 1))
+        # a payload larger than the spool is dropped altogether
+        spool.add(Payload(b'x' * 11, 4, 'dummy'))
+        self.assertEqual((len(spool), spool.traces, spool.dropped), (2, 5, 5))
+        payload, attempts = spool.pop()
+        self.assertEqual((payload.count, attempts), (2, 0))
+
+    def test_write_doesnt_block(self):
+        # the application never waits for a failing agent
+        api = FailingAPI(1000)
+        writer = AgentWriter(flush_interval=60, flush_size=1)
+        writer.api = api
+        start = time.time()
+        for i in range(100):
+            writer.write(spans=make_trace(2))
+        self.assertLess(time.time() - start, 1)
+        self.wait_for(lambda: api.attempts)
+        self.assertGreater(api.attempts, 0)
+        worker = writer._worker
+        worker.stop()
+        worker.join()
+        self.assertFalse(worker.is_alive())
+
+    def test_shutdown_flushes_spool(self):
+        api = FailingAPI(1)
+        worker, traces = self.make_worker(api, backoff_base=60, backoff_max=60)
+        traces.add(make_trace(2))
+        self.wait_for(lambda: worker._spool)
+        worker._on_shutdown()
+        self.assertEqual(len(api.traces), 1)
+        self.assertFalse(worker.is_alive())
+
+
+class SpillTests(WorkerTestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.spill = SpillFile(os.path.join(self.dir, 'traces.spill'), 1 << 16)
+
+    def json_api(self, api):
+        # spilled payloads must be encoded
+        api.content_type = 'application/json'
+        api.encode_traces = lambda traces: [
+            Payload(json.dumps([len(trace) for trace in traces]).encode('utf-8'), len(traces), api.content_type)
+        ]
+        return api
+
+    def tearDown(self):
+        self.spill.close()
+        shutil.rmtree(self.dir)
+
+    def test_spill_after_max_retries(self):
+        api = self.json_api(FailingAPI(2))
+        worker, traces = self.make_worker(api, max_retries=1, spill=self.spill)
+        traces.add(make_trace(2))
+        self.wait_for(lambda: self.spill)
+        # once the agent is back the spilled payload is sent again
+        self.wait_for(lambda: api.traces)
+        worker.stop()
+        self.assertEqual(api.attempts, 3)
+        self.assertEqual(api.traces, [b'[2]'])
+        self.assertFalse(self.spill)
+
+    def test_spill_spool_overflow(self):
+        api = self.json_api(FailingAPI(1000))
+        worker, traces = self.make_worker(api, spool_bytes=4, spill=self.spill)
+        worker.stop()
+        worker.join()
+        worker._spool.add(Payload(b'[1]', 1, api.content_type))
+        worker._spool.add(Payload(b'[2]', 1, api.content_type))
+        self.assertEqual(len(worker._spool), 1)
+        self.assertEqual(self.spill.pop().data, b'[1]')
+
+    def test_replay_on_start(self):
+        api = self.json_api(DummmyAPI())
+        self.spill.append(Payload(b'[1]', 1, api.content_type))
+        self.spill.append(Payload(b'[2]', 1, api.content_type))
+        worker, _ = self.make_worker(api, spill=self.spill)
+        self.wait_for(lambda: len(api.traces) == 2)
+        worker.stop()
+        self.assertEqual(api.traces, [b'[1]', b'[2]'])
+
+    def test_replay_error(self):
+        api = self.json_api(DummmyAPI())
+        self.spill.append(Payload(b'[1]', 1, api.content_type))
+        self.spill.pop = mock.Mock(side_effect=ValueError('corrupted'))
+        worker, traces = self.make_worker(api, spill=self.spill)
+        self.wait_for(lambda: self.spill.pop.called)
+        # the worker keeps sending the new traces
+        traces.add(make_trace(1))
+        self.wait_for(lambda: api.traces)
+        self.assertTrue(worker.is_alive())
+        worker.stop()
+        worker.join()
+
+
+class StatsTests(TestCase):
+    def setUp(self):
+        self.api = API('localhost', 8126, encoder=JSONEncoder())
+        self.api._put = mock.Mock(return_value=Response(status=200, body=b'{}', duration=0.01))
+
+    def test_stats(self):
+        writer = AgentWriter(flush_interval=60, max_bytes=1 << 10, drop_policy=DROP_NEWEST)
+        writer.api = self.api
+        for _ in range(3):
+            writer.write(spans=make_trace(2))
+        writer.write(spans=make_trace(100))
+
+        stats = writer.stats()
+        self.assertEqual(stats['traces.enqueued'], 3)
+        self.assertEqual(stats['spans.enqueued'], 6)
+        self.assertEqual(stats['traces.dropped'], 1)
+        self.assertEqual(stats['spans.dropped'], 100)
+        self.assertEqual(stats['queue.traces'], 3)
+        self.assertGreater(stats['queue.bytes'], 0)
+
+        writer._worker._on_shutdown()
+        stats = writer.stats()
+        self.assertEqual(stats['queue.traces'], 0)
+        self.assertEqual(stats['traces.sent'], 3)
+        self.assertEqual(stats['spans.sent'], 6)
+        self.assertEqual(stats['payloads.sent'], 1)
+        self.assertNotIn('flushes.chunked', stats)
+        self.assertEqual(stats['http.status.200'], 1)
+        self.assertEqual(stats['http.duration']['sum'], 0.01)
+        self.assertEqual(stats['encode.duration']['count'], 1)
+        self.assertGreater(stats['payload.bytes']['sum'], 0)
+
+    def test_chunked_flush_stats(self):
+        api = API('localhost', 8126, encoder=JSONEncoder(), max_payload_size=2048)
+        api._put = self.api._put
+        writer = AgentWriter(flush_interval=60)
+        writer.api = api
+        for _ in range(20):
+            writer.write(spans=make_trace(3))
+        writer._worker._on_shutdown()
+        stats = writer.stats()
+        self.assertEqual(stats['flushes.chunked'], 1)
+        # each chunk is recorded in the payload sizes
+        self.assertEqual(stats['payload.bytes']['count'], api._put.call_count)
+        self.assertEqual(stats['payloads.sent'], api._put.call_count)
+        self.assertLessEqual(stats['payload.bytes']['max'], 2048)
+
+    def test_encode_on_write_stats(self):
+        writer = AgentWriter(flush_interval=60, encode_on_write=True)
+        writer.api = self.api
+        writer.write(spans=make_trace(2))
+        writer.write(spans=make_trace(3))
+        writer._worker._on_shutdown()
+        stats = writer.stats()
+        self.assertEqual(stats['spans.enqueued'], 5)
+        self.assertEqual(stats['spans.sent'], 5)
+        # each trace is encoded on write, and joined in a payload
+        self.assertEqual(stats['encode.duration']['count'], 3)
+
+    def test_report_stats(self):
+        client = mock.Mock()
+        writer = AgentWriter(flush_interval=60, stats_client=client, stats_interval=0.05)
+        writer.api = self.api
+        writer.write(spans=make_trace(2))
+        start = time.time()
+        while not client.increment.called and time.time() - start < 5:
+            time.sleep(0.01)
+        # the stats are reported while the worker is running
+        self.assertTrue(writer._worker.is_alive())
+        client.increment.assert_any_call('datadog.tracer.traces.enqueued', 1)
+        client.gauge.assert_any_call('datadog.tracer.spool.bytes', 0)
+        writer._worker._on_shutdown()
+        client.increment.assert_any_call('datadog.tracer.traces.sent', 1)
+
+
+class EncodeOnWriteTests(TestCase):
+    def setUp(self):
+        self.api = API('localhost', 8126, encoder=JSONEncoder())
+        self.api._put = mock.Mock(return_value=Response(status=200, body=b'{}'))
+
+    def test_traces_encoded_on_write(self):
+        writer = AgentWriter(flush_interval=60, encode_on_write=True)
+        writer.api = self.api
+        for i in range(N_TRACES):
+            writer.write(spans=make_trace(2))
+
+        # the queue only holds the encoded traces
+        queued = writer._traces._things
+        self.assertEqual(len(queued), N_TRACES)
+        self.assertTrue(all(isinstance(trace, EncodedTrace) for trace in queued))
+        self.assertEqual(writer._traces._bytes, sum(len(trace.data) for trace in queued))
+
+        writer._worker._on_shutdown()
+        self.assertEqual(self.api._put.call_count, 1)
+        endpoint, data, count = self.api._put.call_args[0]
+        self.assertEqual(count, N_TRACES)
+        payload = json.loads(data)
+        self.assertEqual(len(payload), N_TRACES)
+        self.assertEqual([len(trace) for trace in payload], [2] * N_TRACES)
+
+    def test_filters_applied_on_write(self):
+        filtr = RemoveAllFilter()
+        writer = AgentWriter(flush_interval=60, encode_on_write=True, filters=[filtr])
+        writer.api = self.api
+        writer.write(spans=make_trace(2))
+        self.assertEqual(filtr.filtered_traces, 1)
+        self.assertEqual(writer._traces.size(), 0)
+        writer._worker._on_shutdown()
+        self.assertEqual(self.api._put.call_count, 0)
+
+    def test_drop_on_encoder_downgrade(self):
+        # a payload can't be sent with a different encoding after a downgrade
+        api = API('localhost', 8126, encoder=MsgpackEncoder())
+        api._put = mock.Mock(return_value=Response(status=404))
+        api._fallback = 'v0.2'
+        response = api.send_encoded_traces([api.encode_trace(make_trace(1))])
+        self.assertEqual(response.status, 404)
+        self.assertEqual(api._put.call_count, 1)
+        self.assertIsInstance(api._encoder, JSONEncoder)